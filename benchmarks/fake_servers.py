@@ -0,0 +1,236 @@
+"""
+A local stand-in for the GitHub API and for helm chart repositories, so that the
+full update pipeline can be benchmarked without touching the network.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+def generate_index(n_charts, n_releases):
+    """Generate a synthetic helm chart repository index
+
+    Args:
+        n_charts (int): The number of charts listed in the index
+        n_releases (int): The number of releases of each chart
+
+    Returns:
+        index (str): The index in YAML format. The newest release of chart-N is
+            version N.<n_releases - 1>.0
+    """
+    lines = ["apiVersion: v1", "entries:"]
+    for chart in range(n_charts):
+        lines.append(f"  chart-{chart}:")
+        for release in reversed(range(n_releases)):
+            version = f"{chart}.{release}.0"
+            created = datetime(2021, 1, 1) + timedelta(hours=release)
+            lines.extend(
+                [
+                    "  - apiVersion: v2",
+                    f"    appVersion: {version}",
+                    f'    created: "{created:%Y-%m-%dT%H:%M:%SZ}"',
+                    f"    description: A synthetic chart number {chart}",
+                    f"    digest: {hashlib.sha256(version.encode()).hexdigest()}",
+                    "    maintainers:",
+                    "    - email: octocat@example.com",
+                    "      name: octocat",
+                    f"    name: chart-{chart}",
+                    "    urls:",
+                    f"    - https://example.com/chart-{chart}-{version}.tgz",
+                    f"    version: {version}",
+                ]
+            )
+    lines.append('generated: "2022-01-01T00:00:00Z"')
+    return "\n".join(lines) + "\n"
+
+
+def generate_chart_yaml(dependencies):
+    """Generate a Chart.yaml file whose dependencies are all out of date
+
+    Args:
+        dependencies (dict): A mapping of dependency name to repository URL
+
+    Returns:
+        chart_yaml (str): The Chart.yaml file in YAML format
+    """
+    lines = ["apiVersion: v2", "name: bench-chart", "version: 0.0.1", "dependencies:"]
+    for name, url in dependencies.items():
+        lines.extend(
+            [
+                f"  - name: {name}",
+                '    version: "0.0.0"',
+                f"    repository: {url}",
+            ]
+        )
+    return "\n".join(lines) + "\n"
+
+
+class FakeServer:
+    """A threaded HTTP server that answers the GitHub API requests made by
+    helm_bot and serves helm chart repository indexes
+    """
+
+    def __init__(self, chart_path, chart_yaml, indexes):
+        """
+        Args:
+            chart_path (str): The path of the helm chart in the fake repository
+            chart_yaml (str): The contents of the helm chart file
+            indexes (dict): A mapping of URL path (e.g. /repo/index.yaml) to the
+                contents of the index served there
+        """
+        self.chart_path = chart_path
+        self.chart_yaml = chart_yaml.encode("utf-8")
+        self.indexes = {
+            path: index.encode("utf-8") for (path, index) in indexes.items()
+        }
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+
+    def _route(self, method, path, body):
+        """Work out the response to a request
+
+        Returns:
+            (tuple): The status code and body of the response. A dict or list
+                body is sent as JSON.
+        """
+        if method == "GET" and path in self.indexes:
+            return 200, self.indexes[path]
+
+        if method == "GET" and path == f"/raw/{self.chart_path}":
+            return 200, self.chart_yaml
+
+        if (
+            method == "POST"
+            and path == "/graphql"
+            and "expression" in body["variables"]
+        ):
+            return 200, {
+                "data": {
+                    "repository": {
+                        "object": {
+                            "oid": hashlib.sha1(self.chart_yaml).hexdigest(),
+                            "text": self.chart_yaml.decode("utf-8"),
+                            "isTruncated": False,
+                        }
+                    }
+                }
+            }
+
+        if method == "POST" and path == "/graphql":
+            return 200, {
+                "data": {
+                    "repository": {
+                        "refs": {
+                            "pageInfo": {"hasNextPage": False, "endCursor": None},
+                            "nodes": [],
+                        }
+                    }
+                }
+            }
+
+        match = re.fullmatch(r"(/repos/[^/]+/[^/]+)/(.*)", path)
+        if match is None:
+            return 404, {"message": "Not Found"}
+        repo_url, endpoint = self.url + match.group(1), match.group(2)
+
+        if method == "GET" and endpoint == f"contents/{self.chart_path}":
+            return 200, {
+                "download_url": f"{self.url}/raw/{self.chart_path}",
+                "sha": hashlib.sha1(self.chart_yaml).hexdigest(),
+            }
+        if method == "GET" and endpoint == "git/trees/main":
+            return 200, {"tree": [{"path": self.chart_path, "type": "blob"}]}
+        if method == "GET" and endpoint.startswith("git/ref/heads/"):
+            return 200, {"object": {"sha": "0" * 40}}
+        if method == "GET" and endpoint.startswith("git/commits/"):
+            return 200, {"tree": {"sha": "1" * 40}}
+        if method == "POST" and endpoint == "git/refs":
+            return 201, {"ref": body["ref"]}
+        if method == "POST" and endpoint == "git/trees":
+            return 201, {"sha": "2" * 40}
+        if method == "POST" and endpoint == "git/commits":
+            return 201, {"sha": "3" * 40}
+        if method == "PATCH" and endpoint.startswith("git/refs/heads/"):
+            return 200, {"object": {"sha": body["sha"]}}
+        if method == "PUT" and endpoint.startswith("contents/"):
+            return 200, {"commit": {"sha": "3" * 40}}
+        if method == "POST" and endpoint == "pulls":
+            return 201, {
+                "number": 1,
+                "url": f"{repo_url}/pulls/1",
+                "issue_url": f"{repo_url}/issues/1",
+            }
+        if method == "PATCH" and re.fullmatch(r"pulls/\d+", endpoint):
+            return 200, {"number": int(endpoint.split("/")[-1])}
+        if method == "POST" and re.fullmatch(
+            r"(issues/\d+/labels|pulls/\d+/requested_reviewers)", endpoint
+        ):
+            return 200, {}
+
+        return 404, {"message": "Not Found"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _respond(self, method):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+                path = urlparse(self.path).path
+
+                status, payload = server._route(method, path, body)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode("utf-8")
+
+                with server._lock:
+                    server.requests[method] += 1
+                    server.bytes_sent += len(payload)
+
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def do_PATCH(self):
+                self._respond("PATCH")
+
+            def do_PUT(self):
+                self._respond("PUT")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
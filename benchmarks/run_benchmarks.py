@@ -0,0 +1,178 @@
+"""
+Benchmark the helm_bot update pipeline end to end, and stage by stage, against a
+local stand-in for the GitHub API and for helm chart repositories.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 1000 10000 100000]
+        [--repeat 5] [--output benchmark-results.json]
+
+Results are written as JSON so that they can be compared between commits.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from fake_servers import FakeServer, generate_chart_yaml, generate_index
+from loguru import logger
+
+from helm_bot import __version__
+from helm_bot.github_api import GitHubAPI
+from helm_bot.index_reader import read_charts_releases
+from helm_bot.main import UpdateHelmDeps
+from helm_bot.pull_version_info import HelmChartVersionPuller
+
+CHART_PATH = "bench-chart/Chart.yaml"
+RELEASES_PER_CHART = 100
+
+
+def time_call(func, repeat):
+    """Call a function several times and record how long each call took
+
+    Args:
+        func (callable): The function to call, without arguments
+        repeat (int): The number of times to call it
+
+    Returns:
+        times (list): The wall-clock time of each call, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarise(size, stage, times, server):
+    """Summarise the timings of one stage as a JSON-serialisable dict"""
+    return {
+        "entries": size,
+        "stage": stage,
+        "repeat": len(times),
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.mean(times),
+        "requests": sum(server.requests.values()) // len(times),
+        "bytes_downloaded": server.bytes_sent // len(times),
+    }
+
+
+def make_inputs(server, dependencies):
+    """Create the UpdateHelmDeps inputs pointing at the fake server"""
+    return UpdateHelmDeps(
+        "octocat/octocat",
+        "ThIs_Is_A_t0k3n",
+        CHART_PATH,
+        dependencies,
+        github_api_url=server.url,
+        github_graphql_url=f"{server.url}/graphql",
+    )
+
+
+def benchmark_size(size, repeat):
+    """Benchmark every stage of the pipeline against an index of a given size
+
+    Args:
+        size (int): The total number of releases listed in the index
+        repeat (int): The number of times to run each stage
+
+    Returns:
+        results (list): The summary of each stage
+    """
+    n_charts = max(size // RELEASES_PER_CHART, 1)
+    tracked = sorted({0, n_charts // 2, n_charts - 1})
+    index_path = f"/charts-{size}/index.yaml"
+    index = generate_index(n_charts, RELEASES_PER_CHART)
+
+    results = []
+    with FakeServer(CHART_PATH, "", {index_path: index}) as server:
+        dependencies = {f"chart-{chart}": server.url + index_path for chart in tracked}
+        server.chart_yaml = generate_chart_yaml(dependencies).encode("utf-8")
+
+        inputs = make_inputs(server, dependencies)
+        puller = HelmChartVersionPuller(inputs, inputs.base_branch)
+        github = GitHubAPI(inputs)
+
+        def run_stage(stage, func):
+            server.reset_counters()
+            times = time_call(func, repeat)
+            results.append(summarise(size, stage, times, server))
+            logger.info("{} entries: {}: {:.4f}s", size, stage, results[-1]["median_s"])
+
+        run_stage(
+            "config_fetch",
+            lambda: asyncio.run(puller._get_config_text(inputs.base_branch)),
+        )
+
+        index_url = server.url + index_path
+        run_stage("index_fetch", lambda: puller._fetch_index(index_url))
+
+        run_stage("parse", lambda: read_charts_releases(index, dependencies.keys()))
+
+        asyncio.run(puller.get_chart_versions())
+        run_stage("compare", puller._compare_chart_versions)
+
+        inputs.head_branch = "bump-helm-deps/bench-chart/abcd"
+        updated_chart_yaml = inputs.update_versions()
+        run_stage(
+            "commit",
+            lambda: github.create_tree_commit(
+                "Bump charts", {CHART_PATH: updated_chart_yaml}
+            ),
+        )
+
+        # A fresh UpdateHelmDeps is needed for each run, since update() picks a
+        # new head branch every time
+        run_stage("update", lambda: make_inputs(server, dependencies).update())
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="The numbers of releases listed in the synthetic indexes",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="How many times to run each stage"
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark-results.json",
+        help="The file to write the results to",
+    )
+    args = parser.parse_args()
+
+    # Only the benchmark's own progress is of interest
+    logger.remove()
+    logger.add(sys.stderr, filter=__name__, level="INFO")
+
+    results = []
+    for size in args.sizes:
+        results.extend(benchmark_size(size, args.repeat))
+
+    report = {
+        "helm_bot_version": __version__.public(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    logger.info("Results written to: {}", args.output)
+
+
+if __name__ == "__main__":
+    main()
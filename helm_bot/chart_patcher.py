@@ -0,0 +1,145 @@
+from ruamel.yaml.events import (
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+
+from .index_reader import _skip_node
+from .instrumentation import instrumented
+from .yaml_parser import YamlParser
+
+yaml = YamlParser(fast=True)
+
+
+class ChartPatcher:
+    """Update the versions of a helm chart's dependencies without re-serialising
+    its Chart.yaml. The source span of every dependency's version scalar is
+    recorded while the file is parsed, and new versions are spliced directly into
+    the original text, so that everything else stays byte-identical.
+    """
+
+    def __init__(self, text):
+        """
+        Args:
+            text (str): The contents of the Chart.yaml file
+        """
+        self.text = text
+        # A mapping of dependency name to the (start, end, style) of its version
+        self.spans = {}
+        self._record_spans()
+
+    def _record_spans(self):
+        """Walk the parser's events to find the version scalar of each dependency"""
+        events = iter(yaml.parse_events(self.text))
+
+        for event in events:
+            if isinstance(event, MappingStartEvent):
+                break
+        else:
+            return
+
+        for key in events:
+            if isinstance(key, MappingEndEvent):
+                break
+
+            _skip_node(events, key)
+            value = next(events)
+            if (
+                isinstance(key, ScalarEvent)
+                and key.value == "dependencies"
+                and isinstance(value, SequenceStartEvent)
+            ):
+                self._record_dependencies(events)
+            else:
+                _skip_node(events, value)
+
+    def _record_dependencies(self, events):
+        """Record the version spans of a sequence of dependencies, consuming the
+        events up to the end of the sequence"""
+        for item in events:
+            if isinstance(item, SequenceEndEvent):
+                return
+            if not isinstance(item, MappingStartEvent):
+                _skip_node(events, item)
+                continue
+
+            name, span = None, None
+            for key in events:
+                if isinstance(key, MappingEndEvent):
+                    break
+
+                _skip_node(events, key)
+                value = next(events)
+                if not isinstance(key, ScalarEvent) or not isinstance(
+                    value, ScalarEvent
+                ):
+                    _skip_node(events, value)
+                elif key.value == "name":
+                    name = value.value
+                elif key.value == "version":
+                    span = (value.start_mark.index, value.end_mark.index, value.style)
+
+            # Like the rest of helm_bot, only the first dependency with a given
+            # name is updated
+            if name is not None and span is not None:
+                self.spans.setdefault(name, span)
+
+    @staticmethod
+    def _format(version, style):
+        """Represent a version as a YAML scalar in the style of the one it replaces
+
+        Args:
+            version (str): The new version
+            style (str): The style of the original scalar, as reported by the
+                parser
+
+        Returns:
+            (str): The scalar to splice into the text
+        """
+        version = str(version)
+        if style == "'":
+            return "'" + version.replace("'", "''") + "'"
+        if style in ("|", ">"):
+            raise ValueError("Cannot patch a version written as a block scalar")
+
+        # Keep a plain scalar plain, unless the new version would then be read
+        # back as something other than the same string, e.g. 1.10 as a float
+        if style != '"' and "\n" not in version:
+            loaded = yaml.yaml_string_to_object(version)
+            if isinstance(loaded, str) and loaded == version:
+                return version
+
+        return '"' + version.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    @instrumented("chart_patch")
+    def patch(self, versions):
+        """Splice new versions of some dependencies into the original text
+
+        Args:
+            versions (dict): A mapping of dependency name to its new version
+
+        Returns:
+            (str): The patched contents of the Chart.yaml file
+
+        Raises:
+            ValueError: If a dependency does not have a version that can be patched
+                in place
+        """
+        edits = []
+        for name, version in versions.items():
+            if name not in self.spans:
+                raise ValueError(f"Could not find a version for dependency: {name}")
+            start, end, style = self.spans[name]
+            edits.append((start, end, self._format(version, style)))
+
+        patched = []
+        position = 0
+        for start, end, replacement in sorted(edits):
+            patched.append(self.text[position:start])
+            patched.append(replacement)
+            position = end
+        patched.append(self.text[position:])
+
+        return "".join(patched)
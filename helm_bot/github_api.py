@@ -1,23 +1,87 @@
+import asyncio
+import posixpath
 import random
 import string
 
-import jmespath
+import requests
 from loguru import logger
-from requests import put
 
-from .http_requests import get_request, patch_request, post_request
+from .http_requests import (
+    async_get_request,
+    async_patch_request,
+    async_post_request,
+)
+from .instrumentation import instrumented
 
+# Open Pull Requests opened from branches whose names start with a given prefix
+FIND_PULL_REQUESTS_QUERY = """
+query($owner: String!, $name: String!, $refPrefix: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    refs(refPrefix: $refPrefix, first: 100, after: $cursor) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        name
+        associatedPullRequests(states: OPEN, first: 1) {
+          nodes {
+            number
+          }
+        }
+      }
+    }
+  }
+}
+"""
 
-class GitHubAPI:
-    """Interact with the GitHub API and perform various git-flow tasks"""
+GET_TREE_MODES_QUERY = """
+query($owner: String!, $name: String!, $expression: String!) {
+  repository(owner: $owner, name: $name) {
+    object(expression: $expression) {
+      ... on Tree {
+        entries {
+          name
+          mode
+        }
+      }
+    }
+  }
+}
+"""
+
+# The mode of a regular, non-executable file
+FILE_MODE = "100644"
+
+GET_FILE_QUERY = """
+query($owner: String!, $name: String!, $expression: String!) {
+  repository(owner: $owner, name: $name) {
+    object(expression: $expression) {
+      ... on Blob {
+        oid
+        text
+        isTruncated
+      }
+    }
+  }
+}
+"""
+
+
+class AsyncGitHubAPI:
+    """Interact with the GitHub API and perform various git-flow tasks from an
+    event loop. Requests share the connection pool of the shared HTTPClient, so
+    many charts or repositories can be processed concurrently in one loop.
+    """
 
     def __init__(self, inputs):
         self.inputs = inputs
         self.api_url = "/".join(
-            ["https://api.github.com", "repos", self.inputs.repository]
+            [self.inputs.github_api_url, "repos", self.inputs.repository]
         )
+        self.graphql_url = self.inputs.github_graphql_url
 
-    def _assign_labels(self, pr_url):
+    async def _assign_labels(self, pr_url):
         """Assign labels to an open Pull Request. The labels must already exist in
         the repository.
 
@@ -28,13 +92,35 @@ class GitHubAPI:
         logger.info("Assigning labels to Pull Request: {}", pr_url)
         logger.info("Assigning labels: {}", self.inputs.labels)
         url = "/".join([pr_url, "labels"])
-        post_request(
+        await async_post_request(
             url,
             headers=self.inputs.headers,
             json={"labels": self.inputs.labels},
         )
 
-    def _assign_reviewers(self, pr_url):
+    async def _graphql(self, query, variables):
+        """Send a query to GitHub's GraphQL API
+
+        Args:
+            query (str): The GraphQL query to send
+            variables (dict): The values of the variables used in the query
+
+        Returns:
+            data (dict): The data payload of the response
+        """
+        resp = await async_post_request(
+            self.graphql_url,
+            headers=self.inputs.headers,
+            json={"query": query, "variables": variables},
+            return_json=True,
+        )
+
+        if resp.get("errors"):
+            raise RuntimeError(f"GraphQL query failed: {resp['errors']}")
+
+        return resp["data"]
+
+    async def _assign_reviewers(self, pr_url):
         """Request reviews from GitHub users  or teams on a Pull Request
 
         Args:
@@ -52,30 +138,105 @@ class GitHubAPI:
             json["team_reviewers"] = self.inputs.team_reviewers
 
         url = "/".join([pr_url, "requested_reviewers"])
-        post_request(
+        await async_post_request(
             url,
             headers=self.inputs.headers,
             json=json,
         )
 
-    def create_commit(self, commit_msg, contents):
-        """Create a commit over the GitHub API by creating or updating a file
+    async def _file_modes(self, commit_sha, paths):
+        """Get the modes of files in a commit, so that committing new contents
+        keeps e.g. their executable bit. The entries of each directory are listed
+        in one request to the GraphQL API.
+
+        Args:
+            commit_sha (str): The SHA of the commit the files are stored in
+            paths (iterable): The paths to the files in the repository
+
+        Returns:
+            modes (dict): A mapping of each path to its mode. Files that do not
+                exist yet, or whose directory could not be listed, are given the
+                mode of a regular file.
+        """
+        owner, name = self.inputs.repository.split("/")
+        directories = sorted({posixpath.dirname(path) for path in paths})
+
+        async def list_modes(directory):
+            variables = {
+                "owner": owner,
+                "name": name,
+                "expression": f"{commit_sha}:{directory}",
+            }
+            try:
+                tree = await self._graphql(GET_TREE_MODES_QUERY, variables)
+            except (RuntimeError, requests.HTTPError) as e:
+                logger.warning(f"Could not get the file modes of {directory}: {e}")
+                return {}
+
+            tree = tree["repository"]["object"] or {}
+            return {
+                posixpath.join(directory, entry["name"]): format(entry["mode"], "o")
+                for entry in tree.get("entries", [])
+            }
+
+        modes = {}
+        for directory_modes in await asyncio.gather(*map(list_modes, directories)):
+            modes.update(directory_modes)
+        return {path: modes.get(path, FILE_MODE) for path in paths}
+
+    @instrumented("create_commit")
+    async def create_tree_commit(self, commit_msg, files):
+        """Create a single commit that updates any number of files with GitHub's
+        git database API endpoints. The file contents are sent inline in one new
+        tree, so the number of requests does not depend on the number of files.
 
         Args:
             commit_msg (str): A message describing the changes the commit applies
-            contents (str): The content of the file to be updated, encoded in base64
+            files (dict): A mapping of file path to the new (text) content of the
+                file
+
+        Returns:
+            sha (str): The SHA of the new commit
         """
-        logger.info("Committing changes to file: {}", self.inputs.chart_path)
-        url = "/".join([self.api_url, "contents", self.inputs.chart_path])
+        logger.info("Committing changes to files: {}", list(files.keys()))
+
+        parent_sha = (await self.get_ref(self.inputs.head_branch))["object"]["sha"]
+
+        url = "/".join([self.api_url, "git", "commits", parent_sha])
+        base_tree = await async_get_request(
+            url, headers=self.inputs.headers, output="json"
+        )
+        base_tree = base_tree["tree"]["sha"]
+
+        modes = await self._file_modes(parent_sha, files.keys())
+
+        url = "/".join([self.api_url, "git", "trees"])
         body = {
-            "message": commit_msg,
-            "content": contents,
-            "sha": self.inputs.sha,
-            "branch": self.inputs.head_branch,
+            "base_tree": base_tree,
+            "tree": [
+                {"path": path, "mode": modes[path], "type": "blob", "content": content}
+                for (path, content) in files.items()
+            ],
         }
-        put(url, json=body, headers=self.inputs.headers)
+        tree = await async_post_request(
+            url, headers=self.inputs.headers, json=body, return_json=True
+        )
 
-    def create_ref(self, ref, sha):
+        url = "/".join([self.api_url, "git", "commits"])
+        body = {"message": commit_msg, "tree": tree["sha"], "parents": [parent_sha]}
+        commit = await async_post_request(
+            url, headers=self.inputs.headers, json=body, return_json=True
+        )
+
+        url = "/".join([self.api_url, "git", "refs", "heads", self.inputs.head_branch])
+        await async_patch_request(
+            url, headers=self.inputs.headers, json={"sha": commit["sha"]}
+        )
+
+        return commit["sha"]
+
+    @instrumented("create_ref")
+    async def create_ref(self, ref, sha):
         """Create a new git reference (specifically, a branch) with GitHub's git
         database API endpoint
 
@@ -89,9 +250,10 @@ class GitHubAPI:
             "ref": f"refs/heads/{ref}",
             "sha": sha,
         }
-        post_request(url, headers=self.inputs.headers, json=body)
+        await async_post_request(url, headers=self.inputs.headers, json=body)
 
-    def create_update_pull_request(self):
+    @instrumented("create_pull_request")
+    async def create_update_pull_request(self):
         """Create or update a Pull Request via the GitHub API"""
         url = "/".join([self.api_url, "pulls"])
         pr = {
@@ -100,7 +262,7 @@ class GitHubAPI:
                 f"This Pull Request is bumping the dependencies of the `{self.inputs.chart_name}` chart to the following versions.\n\n"
                 + "\n".join(
                     [
-                        f"- {chart}: `{self.inputs.chart_versions[chart]['current']}` -> `{self.inputs.chart_versions[chart]['latest']}`"
+                        f"- {chart}: `{self.inputs.chart_versions[chart].current}` -> `{self.inputs.chart_versions[chart].latest}`"
                         for chart in self.inputs.charts_to_update
                     ]
                 )
@@ -113,7 +275,7 @@ class GitHubAPI:
 
             url = "/".join([url, str(self.pr_number)])
             pr["state"] = "open"
-            resp = patch_request(
+            resp = await async_patch_request(
                 url,
                 headers=self.inputs.headers,
                 json=pr,
@@ -125,7 +287,7 @@ class GitHubAPI:
             logger.info("Creating Pull Request...")
 
             pr["head"] = self.inputs.head_branch
-            resp = post_request(
+            resp = await async_post_request(
                 url,
                 headers=self.inputs.headers,
                 json=pr,
@@ -134,36 +296,54 @@ class GitHubAPI:
 
             logger.info(f"Pull Request #{resp['number']} created!")
 
+            # Labels and reviewers are independent of each other, so are
+            # assigned concurrently
+            follow_ups = []
             if self.inputs.labels:
-                self._assign_labels(resp["issue_url"])
+                follow_ups.append(self._assign_labels(resp["issue_url"]))
 
             if self.inputs.reviewers or self.inputs.team_reviewers:
-                self._assign_reviewers(resp["url"])
+                follow_ups.append(self._assign_reviewers(resp["url"]))
 
-    def find_existing_pull_request(self):
-        """Check if the bot already has an open Pull Request"""
+            await asyncio.gather(*follow_ups)
+
+    @instrumented("find_pull_request")
+    async def find_existing_pull_request(self):
+        """Check if the bot already has an open Pull Request. Only the branches
+        starting with the bot's head_branch prefix are requested from the GraphQL
+        API, so the lookup does not depend on how many Pull Requests are open.
+        """
         logger.info(
             "Finding Pull Requests previously opened to bump helm subchart versions"
         )
 
-        url = "/".join([self.api_url, "pulls"])
-        params = {"state": "open", "sort": "created", "direction": "desc"}
-        resp = get_request(
-            url, headers=self.inputs.headers, params=params, output="json"
-        )
+        owner, name = self.inputs.repository.split("/")
+        variables = {
+            "owner": owner,
+            "name": name,
+            "refPrefix": f"refs/heads/{self.inputs.head_branch}/",
+            "cursor": None,
+        }
 
-        # Expression to match the head ref
-        matches = jmespath.search("[*].head.label", resp)
-        indx, match = next(
-            (
-                (indx, match)
-                for (indx, match) in enumerate(matches)
-                if self.inputs.head_branch in match
-            ),
-            (None, None),
-        )
+        # Find the most recently opened Pull Request from a matching branch
+        match, pr_number = None, None
+        while True:
+            refs = await self._graphql(FIND_PULL_REQUESTS_QUERY, variables)
+            refs = refs["repository"]["refs"]
+
+            for ref in refs["nodes"]:
+                if "/" in ref["name"]:
+                    # The branch of a chart in a subdirectory of this one
+                    continue
+                for pr in ref["associatedPullRequests"]["nodes"]:
+                    if (pr_number is None) or (pr["number"] > pr_number):
+                        match, pr_number = ref["name"], pr["number"]
 
-        if (indx is None) and (match is None):
+            if not refs["pageInfo"]["hasNextPage"]:
+                break
+            variables["cursor"] = refs["pageInfo"]["endCursor"]
+
+        if match is None:
             logger.info(
                 "No relevant Pull Requests found. A new Pull Request will be opened."
             )
@@ -175,11 +355,89 @@ class GitHubAPI:
                 "Relevant Pull Request found. Will push new commits to this Pull Request."
             )
 
-            self.inputs.head_branch = match.split(":")[-1]
-            self.pr_number = resp[indx]["number"]
+            self.inputs.head_branch = "/".join([self.inputs.head_branch, match])
+            self.pr_number = pr_number
             self.pr_exists = True
 
-    def get_ref(self, ref):
+    async def get_file(self, path, ref):
+        """Get the contents and blob SHA of a file in a single request to the
+        GraphQL API
+
+        Args:
+            path (str): The path to the file in the repository
+            ref (str): The reference (branch) the file is stored on
+
+        Returns:
+            text (str): The contents of the file
+            sha (str): The SHA of the file's blob
+            None is returned instead if the file does not exist, or its contents
+            are binary or too large to be returned by the GraphQL API.
+        """
+        owner, name = self.inputs.repository.split("/")
+        variables = {"owner": owner, "name": name, "expression": f"{ref}:{path}"}
+        blob = await self._graphql(GET_FILE_QUERY, variables)
+        blob = blob["repository"]["object"]
+
+        if not blob or blob.get("text") is None or blob.get("isTruncated"):
+            return None
+
+        return blob["text"], blob["oid"]
+
+    async def _list_tree(self, tree, prefix=""):
+        """List the paths of every file in a git tree. If the recursive listing is
+        truncated because the tree is too large, each of its subtrees is listed
+        separately instead.
+
+        Args:
+            tree (str): The reference or SHA of the tree to list
+            prefix (str, optional): The path of the tree in the repository.
+                Defaults to an empty string, the root of the repository.
+
+        Returns:
+            paths (list): The paths of all the files in the tree
+        """
+        url = "/".join([self.api_url, "git", "trees", tree])
+        resp = await async_get_request(
+            url,
+            headers=self.inputs.headers,
+            params={"recursive": "1"},
+            output="json",
+        )
+        if not resp.get("truncated"):
+            return [
+                prefix + item["path"] for item in resp["tree"] if item["type"] == "blob"
+            ]
+
+        logger.info("Listing of tree was truncated, listing subtrees: {}", prefix)
+        resp = await async_get_request(url, headers=self.inputs.headers, output="json")
+        paths = [
+            prefix + item["path"] for item in resp["tree"] if item["type"] == "blob"
+        ]
+        subtrees = await asyncio.gather(
+            *(
+                self._list_tree(item["sha"], f"{prefix}{item['path']}/")
+                for item in resp["tree"]
+                if item["type"] == "tree"
+            )
+        )
+        for subtree in subtrees:
+            paths.extend(subtree)
+        return paths
+
+    async def list_files(self, ref):
+        """List the paths of every file in the repository with GitHub's git
+        database API endpoint
+
+        Args:
+            ref (str): The reference (branch) to list the files of
+
+        Returns:
+            paths (list): The paths of all the files in the repository
+        """
+        logger.info("Listing files on ref: {}", ref)
+        return await self._list_tree(ref)
+
+    async def get_ref(self, ref):
         """Get a git reference (specifically, a HEAD ref) using GitHub's git
         database API endpoint
 
@@ -191,4 +449,86 @@ class GitHubAPI:
         """
         logger.info("Pulling info for ref: {}", ref)
         url = "/".join([self.api_url, "git", "ref", "heads", ref])
-        return get_request(url, headers=self.inputs.headers, output="json")
+        return await async_get_request(url, headers=self.inputs.headers, output="json")
+
+    async def get_rate_limit(self):
+        """Get the rate limit of the core GitHub API. Requests to this endpoint
+        do not count against the rate limit.
+
+        Returns:
+            dict: The limit, remaining requests and reset time of the rate limit
+        """
+        url = "/".join([self.inputs.github_api_url, "rate_limit"])
+        resp = await async_get_request(url, headers=self.inputs.headers, output="json")
+        return resp["resources"]["core"]
+
+
+class GitHubAPI:
+    """A synchronous wrapper around AsyncGitHubAPI, for callers that are not
+    running in an event loop. Each call runs the matching coroutine to completion
+    in a new event loop.
+    """
+
+    def __init__(self, inputs):
+        self._api = AsyncGitHubAPI(inputs)
+
+    @property
+    def inputs(self):
+        return self._api.inputs
+
+    @property
+    def api_url(self):
+        return self._api.api_url
+
+    @property
+    def graphql_url(self):
+        return self._api.graphql_url
+
+    @property
+    def pr_exists(self):
+        return self._api.pr_exists
+
+    @pr_exists.setter
+    def pr_exists(self, value):
+        self._api.pr_exists = value
+
+    @property
+    def pr_number(self):
+        return self._api.pr_number
+
+    @pr_number.setter
+    def pr_number(self, value):
+        self._api.pr_number = value
+
+    def _assign_labels(self, pr_url):
+        return asyncio.run(self._api._assign_labels(pr_url))
+
+    def _graphql(self, query, variables):
+        return asyncio.run(self._api._graphql(query, variables))
+
+    def _assign_reviewers(self, pr_url):
+        return asyncio.run(self._api._assign_reviewers(pr_url))
+
+    def create_tree_commit(self, commit_msg, files):
+        return asyncio.run(self._api.create_tree_commit(commit_msg, files))
+
+    def create_ref(self, ref, sha):
+        return asyncio.run(self._api.create_ref(ref, sha))
+
+    def create_update_pull_request(self):
+        return asyncio.run(self._api.create_update_pull_request())
+
+    def find_existing_pull_request(self):
+        return asyncio.run(self._api.find_existing_pull_request())
+
+    def get_file(self, path, ref):
+        return asyncio.run(self._api.get_file(path, ref))
+
+    def list_files(self, ref):
+        return asyncio.run(self._api.list_files(ref))
+
+    def get_ref(self, ref):
+        return asyncio.run(self._api.get_ref(ref))
+
+    def get_rate_limit(self):
+        return asyncio.run(self._api.get_rate_limit())
@@ -1,7 +1,225 @@
+import asyncio
+import hashlib
+import mmap
+import tempfile
+import threading
+import time
+
 import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .instrumentation import recorder
+from .request_scheduler import RequestScheduler
+
+# The size of the chunks a streamed response body is read in
+CHUNK_SIZE = 64 * 1024
+
+
+class ConnectionStats:
+    """Thread-safe counters of the connections a HTTPClient has used"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_opened(self):
+        with self._lock:
+            self.opened += 1
+
+    @property
+    def reused(self):
+        return self.requests - self.opened
+
+
+class _CountingAdapter(HTTPAdapter):
+    """A HTTPAdapter whose connection pools report to a ConnectionStats object"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        stats = self.stats
+        pool_classes = {}
+        for scheme, pool_class in (
+            ("http", HTTPConnectionPool),
+            ("https", HTTPSConnectionPool),
+        ):
+
+            class CountingPool(pool_class):
+                def _get_conn(self, timeout=None):
+                    stats.count_request()
+                    return super()._get_conn(timeout=timeout)
+
+                def _new_conn(self):
+                    stats.count_opened()
+                    return super()._new_conn()
+
+            pool_classes[scheme] = CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+
+class HTTPClient:
+    """A HTTP client that keeps connections alive and pools them per host, so that
+    repeated requests to the same host (e.g. api.github.com) do not pay for a new
+    TCP and TLS handshake each time
+    """
+
+    def __init__(
+        self, pool_connections=10, pool_maxsize=10, headers={}, scheduler=None
+    ):
+        """
+        Args:
+            pool_connections (int, optional): The number of hosts to keep
+                connection pools for. Defaults to 10.
+            pool_maxsize (int, optional): The maximum number of connections to
+                keep alive per host. Defaults to 10.
+            headers (dict, optional): Default headers to send with every request.
+                Defaults to an empty dict.
+            scheduler (RequestScheduler, optional): Decides when requests are
+                sent and retried. Defaults to a RequestScheduler with its default
+                settings.
+        """
+        self.stats = ConnectionStats()
+        self.scheduler = scheduler or RequestScheduler()
+        self.session = requests.Session()
+        # Advertise every content encoding urllib3 can decode, which includes
+        # brotli and zstd when their optional packages are installed
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        self.session.headers.update(headers)
+
+        adapter = _CountingAdapter(
+            self.stats, pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """Send a HTTP request over a pooled connection. The request waits for the
+        scheduler's go-ahead, and is retried if the scheduler decides a failure
+        is worth retrying.
+
+        Args:
+            method (str): The HTTP method of the request
+            url (str): The URL to send the request to
+            **kwargs: Any other arguments accepted by requests.Session.request
+
+        Returns:
+            resp (requests.Response): The final response to the request
+        """
+        attempt = 0
+        while True:
+            self.scheduler.wait(url)
+
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self.scheduler.retry_delay(method, attempt)
+                if delay is None:
+                    raise
+                logger.warning(
+                    "Request failed, retrying in {:.2f}s: {} {}: {}",
+                    delay,
+                    method,
+                    url,
+                    e,
+                )
+            else:
+                self.scheduler.update(resp)
+                delay = self.scheduler.retry_delay(method, attempt, resp)
+                if delay is None:
+                    break
+                logger.warning(
+                    "Request failed with status {}, retrying in {:.2f}s: {} {}",
+                    resp.status_code,
+                    delay,
+                    method,
+                    url,
+                )
+                resp.close()
+
+            time.sleep(delay)
+            attempt += 1
 
+        if kwargs.get("stream"):
+            # Reading the content would defeat streaming, so the transferred
+            # size is used instead
+            n_bytes = int(resp.headers.get("Content-Length", 0))
+        else:
+            n_bytes = len(resp.content)
 
-def get_request(url, headers={}, params={}, output="default"):
+        recorder.record_request(
+            method,
+            url,
+            resp.status_code,
+            n_bytes,
+            time.perf_counter() - start,
+            retries=attempt,
+        )
+        return resp
+
+    def close(self):
+        """Close every pooled connection"""
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the HTTPClient shared by all the request helpers, creating it the
+    first time it is needed
+
+    Returns:
+        client (HTTPClient): The shared HTTP client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+
+def set_client(client):
+    """Replace the HTTPClient shared by all the request helpers
+
+    Args:
+        client (HTTPClient): The HTTP client to use for all subsequent requests
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def _iter_response(resp):
+    """Iterate over the decoded body of a streamed response in chunks, releasing
+    its connection back to the pool when done"""
+    try:
+        yield from resp.iter_content(CHUNK_SIZE)
+    finally:
+        resp.close()
+
+
+def _iter_file(f):
+    """Iterate over the contents of a binary file in chunks, then close it"""
+    with f:
+        yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+
+
+def get_request(url, headers={}, params={}, output="default", cache=None):
     """Send a GET request to an HTTP API endpoint
 
     Args:
@@ -11,27 +229,147 @@ def get_request(url, headers={}, params={}, output="default"):
         params (dict, optional): A dictionary of parameters to send with the
             request. Defaults to an empty dict.
         output (str): The format in which to output the response in. Currently
-            accepts 'default', 'json' or 'text'. 'default' does not apply any
-            format parsing of the response.
+            accepts 'default', 'json', 'text', 'bytes' or 'stream'. 'default' does
+            not apply any format parsing of the response. 'bytes' returns the
+            decompressed body without decoding it. 'stream' returns an iterator
+            over chunks of the decompressed body, which is read from the network
+            (or the cache) as it is consumed rather than buffered in memory.
+        cache (ResponseCache, optional): A persistent response cache. If
+            provided, the request is made conditional on the cached ETag and
+            Last-Modified validators, and a 304 Not Modified response is served
+            from disk. Defaults to None.
     """
-    accepted_formats = ["default", "json", "text"]
+    accepted_formats = ["default", "json", "text", "bytes", "stream"]
     if output not in accepted_formats:
         raise ValueError(
             "Invalid output format. Please choose one of the following options: %s"
             % accepted_formats
         )
 
-    resp = requests.get(url, headers=headers, params=params)
+    request_headers = headers
+    if cache is not None:
+        request_headers = {**headers, **cache.validators(url, params)}
+
+    stream = output == "stream"
+    resp = get_client().request(
+        "GET", url, headers=request_headers, params=params, stream=stream
+    )
 
     if not resp:
         raise requests.HTTPError(f"{resp.text}\nRequest URL: {url}")
 
+    if stream:
+        if cache is None:
+            return _iter_response(resp)
+
+        if resp.status_code == 304:
+            resp.close()
+            body = cache.open(url, params)
+            if body is None:
+                # The entry was evicted since the validators were read
+                return get_request(url, headers=headers, params=params, output=output)
+            return _iter_file(body)
+
+        return cache.store_stream(url, resp, _iter_response(resp), params)
+
+    if cache is not None:
+        if resp.status_code == 304:
+            body, encoding = cache.load(url, params)
+            if body is None:
+                # The entry was evicted since the validators were read
+                return get_request(url, headers=headers, params=params, output=output)
+            resp._content = body
+            resp.encoding = encoding
+        else:
+            cache.store(url, resp, params)
+
     if output == "default":
         return resp
     elif output == "json":
         return resp.json()
     elif output == "text":
         return resp.text
+    elif output == "bytes":
+        return resp.content
+
+
+# Indexes are stripped of these bytes as they are downloaded, since every byte of a
+# multi-byte character is outside the ascii range
+NON_ASCII_BYTES = bytes(range(128, 256))
+
+
+class SpooledBody:
+    """A response body collected from a stream of chunks. It is held in memory
+    while small and spills over to a temporary file on disk once larger, so that
+    large downloads do not occupy memory. The SHA-256 digest of the body is
+    computed as it is written, and several threads can read the body at once,
+    each from their own reader.
+    """
+
+    def __init__(self, max_memory=8 * 1024 * 1024):
+        """
+        Args:
+            max_memory (int, optional): The size, in bytes, above which the body
+                is moved to disk. Defaults to 8 MiB.
+        """
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._max_memory = max_memory
+        self._hash = hashlib.sha256()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def write(self, chunk):
+        """Append a chunk to the body"""
+        with self._lock:
+            self._file.seek(0, 2)
+            self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def digest(self):
+        """Return the SHA-256 digest of the body written so far"""
+        return self._hash.digest()
+
+    def read_at(self, offset, size):
+        """Read up to size bytes of the body, starting from offset"""
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def view(self):
+        """Return a read-only buffer of the whole body for random access. A body
+        spooled to disk is memory-mapped rather than read into memory."""
+        with self._lock:
+            if self.size <= self._max_memory:
+                self._file.seek(0)
+                return self._file.read()
+
+            self._file.flush()
+            return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open(self):
+        """Return a new binary file-like reader positioned at the start of the
+        body"""
+        return _SpooledBodyReader(self)
+
+    def close(self):
+        """Discard the body, removing any temporary file"""
+        self._file.close()
+
+
+class _SpooledBodyReader:
+    """A read-only file-like view of a SpooledBody with its own position"""
+
+    def __init__(self, body):
+        self._body = body
+        self._position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._body.size - self._position
+        data = self._body.read_at(self._position, size)
+        self._position += len(data)
+        return data
 
 
 def patch_request(url, headers={}, json={}, return_json=False):
@@ -46,7 +384,7 @@ def patch_request(url, headers={}, json={}, return_json=False):
         return_json (bool, optional): Return the JSON payload response.
             Defaults to False.
     """
-    resp = requests.patch(url, headers=headers, json=json)
+    resp = get_client().request("PATCH", url, headers=headers, json=json)
 
     if not resp:
         raise requests.HTTPError(f"{resp.text}\nRequest URL: {url}")
@@ -67,10 +405,74 @@ def post_request(url, headers={}, json={}, return_json=False):
         return_json (bool, optional): Return the JSON payload response.
             Defaults to False.
     """
-    resp = requests.post(url, headers=headers, json=json)
+    resp = get_client().request("POST", url, headers=headers, json=json)
+
+    if not resp:
+        raise requests.HTTPError(f"{resp.text}\nRequest URL: {url}")
+
+    if return_json:
+        return resp.json()
+
+
+def put_request(url, headers={}, json={}, return_json=False):
+    """Send a PUT request to an HTTP API endpoint
+
+    Args:
+        url (str): The URL to send the request to
+        headers (dict, optional): A dictionary of any headers to send with the
+            request. Defaults to an empty dictionary.
+        json (dict, optional): A dictionary containing JSON payload to send with
+            the request. Defaults to an empty dictionary.
+        return_json (bool, optional): Return the JSON payload response.
+            Defaults to False.
+    """
+    resp = get_client().request("PUT", url, headers=headers, json=json)
 
     if not resp:
         raise requests.HTTPError(f"{resp.text}\nRequest URL: {url}")
 
     if return_json:
         return resp.json()
+
+
+async def async_get_request(url, **kwargs):
+    """Send a GET request to an HTTP API endpoint without blocking the event loop.
+    The request is sent from a worker thread over the shared HTTPClient, so it
+    uses the same connection pool, scheduler and caches as get_request.
+
+    Args:
+        url (str): The URL to send the request to
+        **kwargs: Any other arguments accepted by get_request
+    """
+    return await asyncio.to_thread(get_request, url, **kwargs)
+
+
+async def async_patch_request(url, **kwargs):
+    """Send a PATCH request to an HTTP API endpoint without blocking the event
+    loop
+
+    Args:
+        url (str): The URL to send the request to
+        **kwargs: Any other arguments accepted by patch_request
+    """
+    return await asyncio.to_thread(patch_request, url, **kwargs)
+
+
+async def async_post_request(url, **kwargs):
+    """Send a POST request to an HTTP API endpoint without blocking the event loop
+
+    Args:
+        url (str): The URL to send the request to
+        **kwargs: Any other arguments accepted by post_request
+    """
+    return await asyncio.to_thread(post_request, url, **kwargs)
+
+
+async def async_put_request(url, **kwargs):
+    """Send a PUT request to an HTTP API endpoint without blocking the event loop
+
+    Args:
+        url (str): The URL to send the request to
+        **kwargs: Any other arguments accepted by put_request
+    """
+    return await asyncio.to_thread(put_request, url, **kwargs)
@@ -0,0 +1,198 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+from loguru import logger
+
+# File layout, all integers little-endian:
+#
+#   header:    magic (4s) | format version (H) | content hash (32s) | charts (I)
+#   directory: one fixed-size record per chart, sorted by chart name:
+#              name offset (Q) | name length (I) | data offset (Q) | releases (I)
+#   names:     the utf-8 encoded chart names
+#   data:      for each release of a chart, sorted by created:
+#              created length (H) | created | version length (H) | version
+MAGIC = b"HBIX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sH32sI")
+RECORD = struct.Struct("<QIQI")
+LENGTH = struct.Struct("<H")
+
+
+def version_table(releases):
+    """Reduce the releases of a chart to a table of (created, version) pairs
+
+    Args:
+        releases (list): A list of (version, created, digest) tuples, as returned
+            by read_charts_releases
+
+    Returns:
+        table (list): The (created, version) pairs sorted by created
+    """
+    return sorted((created or "", version or "") for (version, created, _) in releases)
+
+
+def content_hash(content):
+    """Calculate the hash an index's parsed form is keyed by
+
+    Args:
+        content (str or bytes): The contents of the index
+
+    Returns:
+        (bytes): The SHA-256 digest of the contents
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).digest()
+
+
+class IndexCache:
+    """A persistent on-disk cache of the chart version tables extracted from helm
+    chart repository indexes. Each index is stored in a compact binary file keyed
+    by its URL and the hash of its contents, so that a warm run can skip parsing
+    the YAML altogether. Files are memory-mapped when read and the chart
+    directory is binary searched, so looking up one chart does not deserialize
+    any other chart.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The directory to store the parsed indexes in. It will
+                be created if it does not exist.
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url):
+        """Return the filepath of the parsed index for a URL"""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.idx")
+
+    def store(self, url, digest, releases):
+        """Write the version tables of an index to disk
+
+        Args:
+            url (str): The URL of the index
+            digest (bytes): The hash of the index contents, from content_hash
+            releases (dict): A mapping of chart name to a list of (version,
+                created, digest) tuples, as returned by read_charts_releases
+        """
+        names = sorted(releases.keys())
+        encoded_names = [name.encode("utf-8") for name in names]
+
+        data = bytearray()
+        data_offsets = []
+        for name in names:
+            data_offsets.append(len(data))
+            for created, version in version_table(releases[name]):
+                for field in (created.encode("utf-8"), version.encode("utf-8")):
+                    data += LENGTH.pack(len(field))
+                    data += field
+
+        names_start = HEADER.size + RECORD.size * len(names)
+        data_start = names_start + sum(len(name) for name in encoded_names)
+
+        buffer = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, digest, len(names)))
+        name_offset = names_start
+        for name, encoded_name, data_offset in zip(names, encoded_names, data_offsets):
+            buffer += RECORD.pack(
+                name_offset,
+                len(encoded_name),
+                data_start + data_offset,
+                len(releases[name]),
+            )
+            name_offset += len(encoded_name)
+        for encoded_name in encoded_names:
+            buffer += encoded_name
+        buffer += data
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(buffer)
+            os.replace(tmp_path, self._path(url))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def lookup(self, url, digest, charts):
+        """Read the version tables of some charts from a parsed index
+
+        Args:
+            url (str): The URL of the index
+            digest (bytes): The hash of the current index contents, from
+                content_hash
+            charts (iterable): The names of the charts to look up
+
+        Returns:
+            tables (dict): A mapping of chart name to a list of (created, version)
+                tuples sorted by created. Charts that are not in the index are
+                omitted. None is returned if the index has not been cached or its
+                contents have changed since it was.
+        """
+        try:
+            f = open(self._path(url), "rb")
+        except FileNotFoundError:
+            return None
+
+        with f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with mm:
+            magic, format_version, cached_digest, count = HEADER.unpack_from(mm, 0)
+            if (
+                magic != MAGIC
+                or format_version != FORMAT_VERSION
+                or cached_digest != digest
+            ):
+                logger.debug("Parsed index is stale: {}", url)
+                return None
+
+            tables = {}
+            for chart in charts:
+                record = self._find(mm, count, chart.encode("utf-8"))
+                if record is not None:
+                    tables[chart] = self._read_table(mm, *record)
+            return tables
+
+    def _find(self, mm, count, name):
+        """Binary search the chart directory for a chart name
+
+        Returns:
+            (tuple): The data offset and number of releases of the chart, or None
+                if the chart is not in the index
+        """
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            name_offset, name_length, data_offset, releases = RECORD.unpack_from(
+                mm, HEADER.size + mid * RECORD.size
+            )
+            candidate = mm[name_offset : name_offset + name_length]
+            if candidate == name:
+                return data_offset, releases
+            elif candidate < name:
+                low = mid + 1
+            else:
+                high = mid
+
+        return None
+
+    def _read_table(self, mm, offset, releases):
+        """Read the (created, version) table of a single chart"""
+        table = []
+        for _ in range(releases):
+            fields = []
+            for _ in range(2):
+                (length,) = LENGTH.unpack_from(mm, offset)
+                offset += LENGTH.size
+                fields.append(mm[offset : offset + length].decode("utf-8"))
+                offset += length
+            table.append(tuple(fields))
+
+        return table
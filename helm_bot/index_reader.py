@@ -0,0 +1,272 @@
+import re
+
+from ruamel.yaml.events import (
+    CollectionEndEvent,
+    CollectionStartEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+
+from .instrumentation import instrumented
+from .yaml_parser import YamlParser
+
+# Indexes are only ever read, so they are parsed in the read-only fast mode
+yaml = YamlParser(fast=True)
+
+RELEASE_FIELDS = ("version", "created", "digest")
+
+# The top-level entries key, and the first line of the document after it that
+# is not indented, which ends the entries mapping
+ENTRIES_KEY = re.compile(rb"^entries:[ \t]*(?:#[^\r\n]*)?\r?$", re.MULTILINE)
+TOP_LEVEL_LINE = re.compile(rb"^[^\s#]", re.MULTILINE)
+FIRST_KEY_INDENT = re.compile(rb"^([ ]+)[^\s#]", re.MULTILINE)
+# A chart name that is a plain scalar, followed only by a colon and perhaps a
+# comment
+PLAIN_KEY = re.compile(rb"([A-Za-z0-9_.][^:#'\"{}\[\],]*):[ \t]*(?:#.*)?\r?")
+
+
+def _skip_node(events, event):
+    """Consume the remainder of a YAML node from an event stream without
+    building it
+
+    Args:
+        events (iterator): The stream of parser events
+        event (ruamel.yaml.events.Event): The first event of the node to skip
+    """
+    if not isinstance(event, CollectionStartEvent):
+        # Scalars and aliases are a single event
+        return
+
+    depth = 1
+    while depth > 0:
+        event = next(events)
+        if isinstance(event, CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, CollectionEndEvent):
+            depth -= 1
+
+
+def _read_release(events):
+    """Read the fields we care about from a single chart release mapping
+
+    Args:
+        events (iterator): The stream of parser events, positioned just after the
+            MappingStartEvent of the release
+
+    Returns:
+        (tuple): The (version, created, digest) of the release. Missing fields
+            are returned as None.
+    """
+    fields = dict.fromkeys(RELEASE_FIELDS)
+
+    for key in events:
+        if isinstance(key, MappingEndEvent):
+            break
+
+        # Complex keys are collections, so consume them before the value
+        _skip_node(events, key)
+        value = next(events)
+        if (
+            isinstance(key, ScalarEvent)
+            and key.value in fields
+            and isinstance(value, ScalarEvent)
+        ):
+            fields[key.value] = value.value
+        else:
+            _skip_node(events, value)
+
+    return tuple(fields[field] for field in RELEASE_FIELDS)
+
+
+def _read_releases(events, event):
+    """Read every release of a chart listed under the entries key
+
+    Args:
+        events (iterator): The stream of parser events
+        event (ruamel.yaml.events.Event): The first event of the chart's node
+
+    Returns:
+        releases (list): A list of (version, created, digest) tuples
+    """
+    releases = []
+    if not isinstance(event, SequenceStartEvent):
+        _skip_node(events, event)
+        return releases
+
+    for event in events:
+        if isinstance(event, SequenceEndEvent):
+            break
+        if isinstance(event, MappingStartEvent):
+            releases.append(_read_release(events))
+        else:
+            _skip_node(events, event)
+
+    return releases
+
+
+@instrumented("index_parse")
+def read_charts_releases(stream, charts=None):
+    """Extract the releases of several charts from a helm repository index in a
+    single pass without loading the whole document. The parser's event stream is
+    walked and the subtree of every other chart is skipped without constructing
+    any nodes.
+
+    Args:
+        stream (str or file-like): The contents of the index.yaml file, or a
+            readable stream of it
+        charts (iterable, optional): The names of the charts to extract releases
+            for. Defaults to None, which extracts the releases of every chart in
+            the index.
+
+    Returns:
+        releases (dict): A mapping of chart name to a list of (version, created,
+            digest) tuples, one per published release of the chart. Charts not
+            present in the index are omitted.
+    """
+    wanted = None if charts is None else set(charts)
+    releases = {}
+
+    events = iter(yaml.parse_events(stream))
+
+    for event in events:
+        if isinstance(event, MappingStartEvent):
+            break
+    else:
+        return releases
+
+    try:
+        for key in events:
+            if isinstance(key, MappingEndEvent):
+                break
+
+            _skip_node(events, key)
+            value = next(events)
+            if not (isinstance(key, ScalarEvent) and key.value == "entries"):
+                _skip_node(events, value)
+                continue
+            if not isinstance(value, MappingStartEvent):
+                _skip_node(events, value)
+                continue
+
+            for name in events:
+                if isinstance(name, MappingEndEvent):
+                    break
+
+                _skip_node(events, name)
+                value = next(events)
+                if isinstance(name, ScalarEvent) and (
+                    wanted is None or name.value in wanted
+                ):
+                    releases[name.value] = _read_releases(events, value)
+                    if wanted is None:
+                        continue
+                    wanted.discard(name.value)
+                    if not wanted:
+                        # Everything we need has been read, no need to finish
+                        # parsing the document
+                        return releases
+                else:
+                    _skip_node(events, value)
+    finally:
+        events.close()
+
+    return releases
+
+
+class EntryOffsets:
+    """A sidecar index of a helm repository index, mapping the name of every chart
+    under the entries key to the byte range of its releases. It is built by
+    scanning the lines of the index with regular expressions, which is far
+    cheaper than parsing it, and lets the releases of a chart be read by parsing
+    only its own slice of the index.
+    """
+
+    def __init__(self, buffer, ranges):
+        """
+        Args:
+            buffer (bytes-like): The contents of the index, e.g. a memory map
+            ranges (dict): A mapping of chart name to the (start, end) byte
+                offsets of its key and releases in buffer
+        """
+        self.buffer = buffer
+        self.ranges = ranges
+
+    def read_charts_releases(self, charts):
+        """Extract the releases of several charts, parsing only their slices of
+        the index
+
+        Args:
+            charts (iterable): The names of the charts to extract releases for
+
+        Returns:
+            releases (dict): A mapping of chart name to a list of (version,
+                created, digest) tuples. Charts not present in the index are
+                omitted.
+        """
+        releases = {}
+        for chart in charts:
+            if chart not in self.ranges:
+                continue
+            start, end = self.ranges[chart]
+            chunk = bytes(self.buffer[start:end]).decode("utf-8")
+            releases.update(read_charts_releases(f"entries:\n{chunk}", [chart]))
+
+        return releases
+
+    def close(self):
+        """Release the buffer, unmapping it if it is a memory map"""
+        if hasattr(self.buffer, "close"):
+            self.buffer.close()
+
+
+@instrumented("index_scan")
+def scan_entry_offsets(buffer):
+    """Build the EntryOffsets of a helm repository index. Only indexes laid out in
+    block style, as helm writes them, can be scanned. Any other layout is
+    detected and left to be parsed in full.
+
+    Args:
+        buffer (bytes-like): The contents of the index, e.g. a memory map
+
+    Returns:
+        offsets (EntryOffsets): The byte ranges of the charts in the index, or
+            None if the index could not be scanned
+    """
+    entries = ENTRIES_KEY.search(buffer)
+    if entries is None:
+        return None
+    start = entries.end()
+
+    end_line = TOP_LEVEL_LINE.search(buffer, start)
+    end = end_line.start() if end_line else len(buffer)
+
+    first_key = FIRST_KEY_INDENT.search(buffer, start, end)
+    if first_key is None:
+        return None
+    indent = first_key.group(1)
+
+    # Lines at the indentation of the chart names, other than sequence items
+    key_line = re.compile(
+        rb"^" + re.escape(indent) + rb"([^\s#-][^\r\n]*)\r?$", re.MULTILINE
+    )
+
+    ranges = {}
+    previous = None
+    for line in key_line.finditer(buffer, start, end):
+        key = PLAIN_KEY.fullmatch(line.group(1))
+        if key is None:
+            return None
+
+        if previous is not None:
+            ranges[previous[0]] = (previous[1], line.start())
+        previous = (key.group(1).decode("utf-8").strip(), line.start())
+
+    if previous is None:
+        # No chart names were found, so the layout is not understood
+        return None
+    ranges[previous[0]] = (previous[1], end)
+
+    return EntryOffsets(buffer, ranges)
@@ -0,0 +1,249 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# The names of the stages the current code is running in, outermost first
+_current_stages = contextvars.ContextVar("current_stages", default=())
+
+
+class StageStats:
+    """Counters describing every call of a single stage"""
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        self.requests = 0
+        self.bytes_downloaded = 0
+        self.retries = 0
+        self.status_codes = Counter()
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "wall_time_s": self.wall_time,
+            "requests": self.requests,
+            "bytes_downloaded": self.bytes_downloaded,
+            "retries": self.retries,
+            "status_codes": {
+                str(code): count for (code, count) in sorted(self.status_codes.items())
+            },
+        }
+
+
+class Recorder:
+    """Record the wall time of each stage of a run, and the HTTP requests made
+    while in that stage. A request is attributed to every stage it is nested in,
+    as well as to a stage of its own named after the request's method and URL.
+    If a profiler is set, every stage is also run in its profiler.stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self.stages = {}
+        self.trace_events = []
+        self.profiler = None
+
+    def _stats(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats()
+        return self.stages[name]
+
+    def _trace(self, name, start, duration, args={}):
+        """Add a complete event to the Chrome trace"""
+        self.trace_events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+    @contextmanager
+    def stage(self, name, awaits=False):
+        """Time a block of code as a named stage
+
+        Args:
+            name (str): The name of the stage
+            awaits (bool, optional): Whether the block awaits, so that other
+                coroutines can run during it. Defaults to False.
+        """
+        token = _current_stages.set(_current_stages.get() + (name,))
+        profiler = self.profiler
+        profiling = (
+            profiler.stage(name, awaits=awaits)
+            if profiler is not None
+            else nullcontext()
+        )
+        start = time.perf_counter()
+        try:
+            with profiling:
+                yield
+        finally:
+            duration = time.perf_counter() - start
+            _current_stages.reset(token)
+
+            with self._lock:
+                stats = self._stats(name)
+                stats.calls += 1
+                stats.wall_time += duration
+                self._trace(name, start, duration)
+
+    def record_request(self, method, url, status_code, n_bytes, duration, retries=0):
+        """Record a HTTP request against the stages it was made in
+
+        Args:
+            method (str): The HTTP method of the request
+            url (str): The URL of the request
+            status_code (int): The status code of the final response
+            n_bytes (int): The size of the response body
+            duration (float): How long the request took, in seconds
+            retries (int, optional): How many times the request was retried.
+                Defaults to 0.
+        """
+        name = f"http {method} {url.split('?')[0]}"
+        start = time.perf_counter() - duration
+
+        with self._lock:
+            for stage in _current_stages.get() + (name,):
+                stats = self._stats(stage)
+                stats.requests += 1
+                stats.bytes_downloaded += n_bytes
+                stats.retries += retries
+                stats.status_codes[status_code] += 1
+
+            stats = self._stats(name)
+            stats.calls += 1
+            stats.wall_time += duration
+            self._trace(
+                name,
+                start,
+                duration,
+                args={"status_code": status_code, "bytes": n_bytes},
+            )
+
+    def summary(self):
+        """Summarise every recorded stage
+
+        Returns:
+            (dict): A JSON-serialisable mapping of stage name to its counters
+        """
+        with self._lock:
+            return {name: stats.to_dict() for (name, stats) in self.stages.items()}
+
+    def write_summary(self, path):
+        """Write the summary of every stage to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_chrome_trace(self, path):
+        """Write every stage and request as a Chrome trace, which can be opened in
+        chrome://tracing or https://ui.perfetto.dev"""
+        with self._lock:
+            trace = {"traceEvents": list(self.trace_events)}
+        with open(path, "w") as f:
+            json.dump(trace, f)
+
+    def write_openmetrics(self, path):
+        """Write the counters of every stage in the OpenMetrics text format"""
+        metrics = [
+            ("stage_calls", "calls", "Number of times the stage ran"),
+            ("stage_seconds", "wall_time_s", "Wall time spent in the stage"),
+            ("stage_requests", "requests", "HTTP requests made in the stage"),
+            (
+                "stage_bytes_downloaded",
+                "bytes_downloaded",
+                "Bytes downloaded in the stage",
+            ),
+            ("stage_retries", "retries", "HTTP requests retried in the stage"),
+        ]
+        summary = self.summary()
+
+        lines = []
+        for metric, key, description in metrics:
+            lines.append(f"# TYPE helm_bot_{metric} counter")
+            lines.append(f"# HELP helm_bot_{metric} {description}.")
+            for stage, stats in summary.items():
+                lines.append(
+                    f'helm_bot_{metric}_total{{stage="{_escape(stage)}"}} {stats[key]}'
+                )
+
+        lines.append("# TYPE helm_bot_stage_responses counter")
+        lines.append("# HELP helm_bot_stage_responses HTTP responses by status code.")
+        for stage, stats in summary.items():
+            for code, count in stats["status_codes"].items():
+                lines.append(
+                    f'helm_bot_stage_responses_total{{stage="{_escape(stage)}",code="{code}"}} {count}'
+                )
+
+        lines.append("# EOF")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self._origin = time.perf_counter()
+            self.stages = {}
+            self.trace_events = []
+
+
+def _escape(label):
+    """Escape a label value for the OpenMetrics text format"""
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# The recorder shared by the whole run
+recorder = Recorder()
+
+
+def instrumented(name):
+    """Decorate a function so that every call is recorded as a stage. Coroutine
+    functions are timed until the coroutine completes.
+
+    Args:
+        name (str): The name of the stage
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with recorder.stage(name, awaits=True):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def propagate_context(func):
+    """Wrap a function so that it runs in the caller's current stages, even when
+    it is called from another thread
+
+    Args:
+        func (callable): The function to wrap
+
+    Returns:
+        (callable): The wrapped function
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
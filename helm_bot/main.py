@@ -1,15 +1,38 @@
-import base64
+import asyncio
 import json
 import os
+import posixpath
+import sys
+import time
+from collections import Counter
+from fnmatch import fnmatchcase
 
+import requests
 from loguru import logger
 
-from .github_api import GitHubAPI
-from .pull_version_info import HelmChartVersionPuller
+from ._version import __version__
+from .github_api import AsyncGitHubAPI
+from .http_requests import HTTPClient, get_client, set_client
+from .index_cache import IndexCache
+from .instrumentation import instrumented, recorder
+from .pull_version_info import (
+    ChartVersionError,
+    HelmChartVersionPuller,
+    IndexDownloads,
+)
+from .request_scheduler import RateLimitBudget, RequestScheduler
+from .response_cache import ResponseCache
+from .run_state import RunState, unchanged_versions
+from .versions import ChartVersion, ChartVersions
 from .yaml_parser import YamlParser
 
 yaml = YamlParser()
 
+# The most GitHub API requests updating a single chart takes: reading the chart,
+# finding an existing Pull Request, committing, and opening and labelling a new
+# Pull Request
+REQUESTS_PER_CHART = 12
+
 
 class UpdateHelmDeps:
     """Update the versions of helm subcharts of a local helm chart"""
@@ -26,6 +49,13 @@ class UpdateHelmDeps:
         reviewers=[],
         team_reviewers=[],
         dry_run=False,
+        max_concurrency=8,
+        cache_dir=None,
+        index_downloads=None,
+        github_api_url="https://api.github.com",
+        github_graphql_url=None,
+        version_constraints={},
+        branch_by_directory=False,
     ):
         self.repository = repository
         self.chart_path = chart_path
@@ -35,51 +65,144 @@ class UpdateHelmDeps:
         self.reviewers = reviewers
         self.team_reviewers = team_reviewers
         self.dry_run = dry_run
+        self.max_concurrency = max_concurrency
+        self.version_constraints = version_constraints
+        self.chart_yaml_text = None
+        self.chart_versions = ChartVersions()
+        self.cache = None
+        self.index_cache = None
+        self.run_state = None
+        if cache_dir:
+            self.cache = ResponseCache(os.path.join(cache_dir, "responses"))
+            self.index_cache = IndexCache(os.path.join(cache_dir, "indexes"))
+            self.run_state = RunState(os.path.join(cache_dir, "state"))
+        self.index_downloads = index_downloads or IndexDownloads(max_concurrency)
+
+        self.github_api_url = github_api_url.rstrip("/")
+        self.github_graphql_url = github_graphql_url or graphql_url(self.github_api_url)
+        self.headers = github_headers(github_token)
+        self.chart_name = chart_name(repository, self.chart_path)
+        # Branches are named after the chart, unless charts with the same name in
+        # other directories are updated too, when they are named after the whole
+        # directory of the chart so that they do not share one
+        chart_dir = posixpath.dirname(self.chart_path)
+        self.head_branch = "/".join(
+            [head_branch, chart_dir if branch_by_directory else self.chart_name]
+        )
 
-        self.headers = {
-            "Accept": "application/vnd.github.v3+json",
-            "Authorization": f"token {github_token}",
-        }
-        self.chart_name = self.chart_path.split("/")[-2]
-        self.head_branch = "/".join([head_branch, self.chart_name])
+    @property
+    def chart_versions(self):
+        """The ChartVersions of the dependencies. Plain dicts of versions are
+        converted when set."""
+        return self._chart_versions
+
+    @chart_versions.setter
+    def chart_versions(self, versions):
+        if not isinstance(versions, ChartVersions):
+            versions = ChartVersions(versions)
+        self._chart_versions = versions
 
+    @instrumented("update_versions")
     def update_versions(self):
-        """Update the dependencies of a local helm chart with the latest versions
+        """Update the dependencies of a local helm chart with the latest versions.
+        The new versions are spliced into the original text of the chart where
+        possible, so that the rest of the file is left untouched. Otherwise, the
+        whole chart is re-serialised.
 
         Returns:
-            chart_yaml (str): The updated helm chart dependencies in YAML format and
-                encoded in base64
+            chart_yaml (str): The updated helm chart dependencies in YAML format
         """
-        for chart in self.charts_to_update:
-            indx = next(
-                (
-                    indx
-                    for (indx, chart_dep) in enumerate(self.chart_yaml["dependencies"])
-                    if chart_dep["name"] == chart
-                ),
-                None,
-            )
-            self.chart_yaml["dependencies"][indx]["version"] = self.chart_versions[
-                chart
-            ]["latest"]
+        latest_versions = {
+            chart: self.chart_versions[chart].latest for chart in self.charts_to_update
+        }
 
-        encoded_chart_yaml = yaml.object_to_yaml_str(self.chart_yaml).encode("utf-8")
-        base64_bytes = base64.b64encode(encoded_chart_yaml)
-        chart_yaml = base64_bytes.decode("utf-8")
+        if self.chart_yaml_text is not None:
+            # Only imported once a chart needs updating
+            from .chart_patcher import ChartPatcher
 
-        return chart_yaml
+            try:
+                return ChartPatcher(self.chart_yaml_text).patch(latest_versions)
+            except ValueError as e:
+                logger.warning(f"Could not update {self.chart_path} in place: {e}")
+                self.chart_yaml = yaml.yaml_string_to_object(self.chart_yaml_text)
 
-    def update(self):
-        """Run the action to check the helm chart dependencies are up to date"""
-        github = GitHubAPI(self)
-        github.find_existing_pull_request()
+        # Index the dependencies once, keeping the first of any duplicate names
+        dependencies = {}
+        for chart_dep in self.chart_yaml["dependencies"]:
+            dependencies.setdefault(chart_dep["name"], chart_dep)
+
+        for chart, version in latest_versions.items():
+            dependencies[chart]["version"] = version
+
+        return yaml.object_to_yaml_str(self.chart_yaml)
+
+    @instrumented("check_state")
+    def check_state(self):
+        """Check whether the chart and the indexes it depends on have changed
+        since the last run, if that run found nothing to update
+
+        Returns:
+            versions (dict): The versions resolved by the last run if nothing has
+                changed since, otherwise None
+        """
+        try:
+            return unchanged_versions(self)
+        except requests.RequestException as e:
+            logger.warning(f"Could not check for changes since the last run: {e}")
+            return None
+
+    def record_state(self, pr_exists):
+        """Record the fingerprints of a run that found nothing to update, so that
+        the next run can stop early if they have not changed. Any other outcome
+        clears the record, so that the next run is a full run.
+
+        Args:
+            pr_exists (bool): Whether a Pull Request was already open, in which
+                case the versions were read from the head branch
+        """
+        if pr_exists or self.charts_to_update:
+            self.run_state.remove(self)
+            return
+
+        self.run_state.store(
+            self,
+            self.sha,
+            self.index_fingerprints,
+            {chart: version.latest for (chart, version) in self.chart_versions.items()},
+        )
+
+    @instrumented("update")
+    async def async_update(self):
+        """Run the action to check the helm chart dependencies are up to date.
+        GitHub API requests are awaited in the running event loop, while the
+        chart indexes are downloaded and parsed in a worker thread.
+        """
+        if self.run_state is not None:
+            versions = await asyncio.to_thread(self.check_state)
+            if versions is not None:
+                self.chart_versions = ChartVersions(
+                    {
+                        chart: ChartVersion(chart, version, version)
+                        for (chart, version) in versions.items()
+                    }
+                )
+                self.charts_to_update = []
+                logger.info(
+                    "Nothing has changed since the last run. All subcharts are up-to-date!"
+                )
+                return
+
+        github = AsyncGitHubAPI(self)
+        await github.find_existing_pull_request()
 
         if github.pr_exists:
             version_puller = HelmChartVersionPuller(self, self.head_branch)
         else:
             version_puller = HelmChartVersionPuller(self, self.base_branch)
 
-        version_puller.get_chart_versions()
+        await version_puller.get_chart_versions()
+        if self.run_state is not None:
+            self.record_state(github.pr_exists)
 
         if len(self.charts_to_update) > 0 and not self.dry_run:
             logger.info(
@@ -87,13 +210,15 @@ class UpdateHelmDeps:
             )
 
             if not github.pr_exists:
-                resp = github.get_ref(self.base_branch)
-                github.create_ref(self.head_branch, resp["object"]["sha"])
+                resp = await github.get_ref(self.base_branch)
+                await github.create_ref(self.head_branch, resp["object"]["sha"])
 
             updated_chart_yaml = self.update_versions()
-            commit_msg = f"Bump charts {[chart for chart in self.charts_to_update]} to versions {[self.chart_versions[chart]['latest'] for chart in self.charts_to_update]}, respectively"
-            github.create_commit(commit_msg, updated_chart_yaml)
-            github.create_update_pull_request()
+            commit_msg = f"Bump charts {[chart for chart in self.charts_to_update]} to versions {[self.chart_versions[chart].latest for chart in self.charts_to_update]}, respectively"
+            await github.create_tree_commit(
+                commit_msg, {self.chart_path: updated_chart_yaml}
+            )
+            await github.create_update_pull_request()
 
         elif len(self.charts_to_update) > 0 and self.dry_run:
             logger.info(
@@ -103,6 +228,269 @@ class UpdateHelmDeps:
         else:
             logger.info("All subcharts are up-to-date!")
 
+    def update(self):
+        """Run the action to check the helm chart dependencies are up to date, in
+        a new event loop"""
+        try:
+            asyncio.run(self.async_update())
+        finally:
+            self.index_downloads.close()
+
+
+class UpdateManyHelmDeps:
+    """Update the versions of helm subcharts of several local helm charts stored in
+    the same repository. One Pull Request is opened per chart, while index
+    downloads and caches are shared between all of them.
+    """
+
+    def __init__(
+        self,
+        repository,
+        github_token,
+        chart_paths,
+        chart_urls,
+        chart_workers=4,
+        index_downloads=None,
+        **kwargs,
+    ):
+        """
+        Args:
+            repository (str): The GitHub repository where the helm charts are stored
+            github_token (str): A GitHub token to make requests to the API with
+            chart_paths (list): The paths to the files that store the helm chart
+                dependencies. Glob patterns, e.g. 'charts/*/Chart.yaml', are
+                matched against the files on the base branch.
+            chart_urls (dict): The location of every dependent chart's versions
+            chart_workers (int, optional): The maximum number of charts to process
+                concurrently. Defaults to 4.
+            index_downloads (IndexDownloads, optional): The index downloads to
+                share between the charts. Defaults to a new IndexDownloads.
+            **kwargs: Any other arguments accepted by UpdateHelmDeps
+        """
+        self.repository = repository
+        self.github_token = github_token
+        self.chart_paths = chart_paths
+        self.chart_urls = chart_urls
+        self.chart_workers = chart_workers
+        self.kwargs = kwargs
+
+        self.base_branch = kwargs.get("base_branch", "main")
+        self.github_api_url = kwargs.get(
+            "github_api_url", "https://api.github.com"
+        ).rstrip("/")
+        self.github_graphql_url = kwargs.get("github_graphql_url") or graphql_url(
+            self.github_api_url
+        )
+        self.headers = github_headers(github_token)
+        # Resolve the versions of as many charts at a time as are processed
+        self.index_downloads = index_downloads or IndexDownloads(
+            kwargs.get("max_concurrency", 8), chart_workers
+        )
+
+    async def _fetch_rate_limit(self):
+        """Look up the GitHub API rate limit, unless a response has already
+        reported it, so that the charts can be planned within it"""
+        scheduler = get_client().scheduler
+        if scheduler.budget(self.github_api_url) is not None:
+            return
+
+        try:
+            core = await AsyncGitHubAPI(self).get_rate_limit()
+        except requests.RequestException as e:
+            # e.g. GitHub Enterprise Server instances without rate limiting
+            logger.warning(f"Could not look up the GitHub API rate limit: {e}")
+            return
+
+        scheduler.set_budget(
+            self.github_api_url,
+            RateLimitBudget(core["limit"], core["remaining"], core["reset"]),
+        )
+
+    def _within_rate_limit(self, chart_paths):
+        """Keep only as many charts as the remaining GitHub API rate limit can
+        update, if it will not reset in time to wait for it. The other charts are
+        left for a later run, rather than failing part way through their updates.
+
+        Args:
+            chart_paths (list): The paths of the charts to update, in order
+
+        Returns:
+            chart_paths (list): The paths of the charts to update in this run
+        """
+        scheduler = get_client().scheduler
+        budget = scheduler.budget(self.github_api_url)
+        if (
+            budget is None
+            or budget.remaining >= len(chart_paths) * REQUESTS_PER_CHART
+            or budget.reset - time.time() <= scheduler.max_wait
+        ):
+            return chart_paths
+
+        affordable = max(budget.remaining, 0) // REQUESTS_PER_CHART
+        logger.warning(
+            "Only {} GitHub API requests remain until the rate limit resets. "
+            + "Deferring helm charts to a later run: {}",
+            budget.remaining,
+            chart_paths[affordable:],
+        )
+        return chart_paths[:affordable]
+
+    async def expand_chart_paths(self):
+        """Expand any glob patterns in chart_paths against the files stored on the
+        base branch
+
+        Returns:
+            chart_paths (list): The paths of the files to process, without
+                duplicates
+        """
+        if not any(_is_glob(chart_path) for chart_path in self.chart_paths):
+            return self.chart_paths
+
+        files = await AsyncGitHubAPI(self).list_files(self.base_branch)
+
+        chart_paths = []
+        for chart_path in self.chart_paths:
+            if _is_glob(chart_path):
+                chart_paths.extend(
+                    sorted(path for path in files if _match_glob(path, chart_path))
+                )
+            else:
+                chart_paths.append(chart_path)
+
+        return list(dict.fromkeys(chart_paths))
+
+    async def _update_charts(self, chart_paths, colliding=set()):
+        """Update helm charts concurrently in the running event loop, at most
+        chart_workers at a time
+
+        Args:
+            chart_paths (list): The paths of the helm charts to update
+            colliding (set, optional): The names shared by several charts, whose
+                branches are named after their directories. Defaults to an empty
+                set.
+
+        Returns:
+            results (list): The result of each chart's update, or the exception it
+                raised, in the order the charts were given
+        """
+        semaphore = asyncio.Semaphore(self.chart_workers)
+
+        async def update_chart(chart_path):
+            async with semaphore:
+                # Built here, so that a chart with invalid inputs only fails itself
+                chart = UpdateHelmDeps(
+                    self.repository,
+                    self.github_token,
+                    chart_path,
+                    self.chart_urls,
+                    index_downloads=self.index_downloads,
+                    branch_by_directory=(
+                        chart_name(self.repository, chart_path) in colliding
+                    ),
+                    **self.kwargs,
+                )
+                return await chart.async_update()
+
+        return await asyncio.gather(
+            *(update_chart(chart_path) for chart_path in chart_paths),
+            return_exceptions=True,
+        )
+
+    async def async_update(self):
+        """Run the action for every helm chart concurrently in the running event
+        loop"""
+        chart_paths = await self.expand_chart_paths()
+        # Found before any chart is deferred, so that branch names do not change
+        # from one run to the next
+        names = Counter(chart_name(self.repository, path) for path in chart_paths)
+        colliding = {name for (name, count) in names.items() if count > 1}
+
+        await self._fetch_rate_limit()
+        chart_paths = self._within_rate_limit(chart_paths)
+        logger.info("Checking the dependencies of helm charts: {}", chart_paths)
+
+        results = await self._update_charts(chart_paths, colliding)
+
+        # Report failures in the order the charts were given, and only after
+        # every other chart has had the chance to open its Pull Request
+        errors = []
+        for chart_path, result in zip(chart_paths, results):
+            if isinstance(result, Exception):
+                logger.error(f"Could not update helm chart {chart_path}: {result}")
+                errors.append(result)
+
+        if errors:
+            raise errors[0]
+
+    def update(self):
+        """Run the action for every helm chart concurrently, in a single event
+        loop"""
+        try:
+            asyncio.run(self.async_update())
+        finally:
+            self.index_downloads.close()
+
+
+def chart_name(repository, chart_path):
+    """Derive the name of a helm chart from the directory it is stored in, or the
+    name of the repository for a chart at its root
+
+    Args:
+        repository (str): The GitHub repository the chart is stored in
+        chart_path (str): The path to the file storing the chart's dependencies
+
+    Returns:
+        (str): The name of the chart
+    """
+    chart_dir = posixpath.dirname(chart_path)
+    return posixpath.basename(chart_dir) or repository.split("/")[-1]
+
+
+def _is_glob(path):
+    """Check whether a path contains glob pattern characters"""
+    return any(char in path for char in "*?[")
+
+
+def _match_glob(path, pattern):
+    """Match a path against a glob pattern one path segment at a time, so that
+    wildcards do not match across '/', e.g. 'charts/*/Chart.yaml' does not match
+    'charts/umbrella/charts/redis/Chart.yaml'"""
+    path_parts, pattern_parts = path.split("/"), pattern.split("/")
+    return len(path_parts) == len(pattern_parts) and all(
+        fnmatchcase(part, pattern_part)
+        for (part, pattern_part) in zip(path_parts, pattern_parts)
+    )
+
+
+def graphql_url(github_api_url):
+    """Derive the URL of GitHub's GraphQL API from the URL of its REST API
+
+    Args:
+        github_api_url (str): The URL of the REST API, e.g. https://api.github.com
+            or https://HOSTNAME/api/v3 for GitHub Enterprise Server
+
+    Returns:
+        (str): The URL of the GraphQL API
+    """
+    if github_api_url.endswith("/api/v3"):
+        return github_api_url[: -len("/v3")] + "/graphql"
+    return github_api_url + "/graphql"
+
+
+def github_headers(github_token):
+    """Build the headers to authenticate requests to the GitHub API with
+
+    Args:
+        github_token (str): A GitHub token to make requests to the API with
+
+    Returns:
+        (dict): The request headers
+    """
+    return {
+        "Accept": "application/vnd.github.v3+json",
+        "Authorization": f"token {github_token}",
+    }
+
 
 def split_str_to_list(input_str, split_char=","):
     """Split a string into a list of elements.
@@ -137,6 +525,23 @@ def main():
     reviewers = os.environ.get("INPUT_REVIEWERS", [])
     team_reviewers = os.environ.get("INPUT_TEAM_REVIEWERS", [])
     dry_run = os.environ.get("INPUT_DRY_RUN", False)
+    chart_workers = os.environ.get("INPUT_CHART_WORKERS", 4)
+
+    # Set by GitHub Actions, and point to the GitHub Enterprise Server instance
+    # where applicable
+    github_api_url = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    github_graphql_url = os.environ.get("GITHUB_GRAPHQL_URL", None)
+    max_concurrency = os.environ.get("INPUT_MAX_CONCURRENCY", 8)
+    cache_dir = os.environ.get("INPUT_CACHE_DIR", None)
+    metrics_file = os.environ.get("INPUT_METRICS_FILE", None)
+    trace_file = os.environ.get("INPUT_TRACE_FILE", None)
+    openmetrics_file = os.environ.get("INPUT_OPENMETRICS_FILE", None)
+    profile_dir = os.environ.get("INPUT_PROFILE_DIR", None)
+    max_retries = os.environ.get("INPUT_MAX_RETRIES", 5)
+    requests_per_second = os.environ.get("INPUT_REQUESTS_PER_SECOND", None)
+    version_constraints = json.loads(
+        os.environ.get("INPUT_VERSION_CONSTRAINTS", None) or "{}"
+    )
 
     # Reference dict for required inputs
     required_vars = {
@@ -176,19 +581,127 @@ def main():
             + f"You have provided: {dry_run} ({type(dry_run)})"
         )
 
-    update_helm_deps = UpdateHelmDeps(
-        repository,
-        github_token,
-        chart_path,
-        chart_urls,
-        base_branch=base_branch,
-        head_branch=head_branch,
-        labels=labels,
-        reviewers=reviewers,
-        team_reviewers=team_reviewers,
-        dry_run=dry_run,
+    # Check the max_concurrency variable is a positive integer
+    if not str(max_concurrency).isdigit() or int(max_concurrency) < 1:
+        raise ValueError(
+            "MAX_CONCURRENCY variable must be a positive integer. "
+            + f"You have provided: {max_concurrency}"
+        )
+    max_concurrency = int(max_concurrency)
+
+    # Check the chart_workers variable is a positive integer
+    if not str(chart_workers).isdigit() or int(chart_workers) < 1:
+        raise ValueError(
+            "CHART_WORKERS variable must be a positive integer. "
+            + f"You have provided: {chart_workers}"
+        )
+    chart_workers = int(chart_workers)
+
+    # The stages of charts processed concurrently would be recorded in each
+    # other's profiles
+    if profile_dir and chart_workers > 1:
+        logger.info("Processing one chart at a time, since profile_dir is set")
+        chart_workers = 1
+
+    # Check the max_retries variable is a non-negative integer
+    if not str(max_retries).isdigit():
+        raise ValueError(
+            "MAX_RETRIES variable must be a non-negative integer. "
+            + f"You have provided: {max_retries}"
+        )
+    max_retries = int(max_retries)
+
+    # Check the requests_per_second variable is a positive number
+    if requests_per_second:
+        try:
+            requests_per_second = float(requests_per_second)
+        except ValueError:
+            requests_per_second = 0
+        if requests_per_second <= 0:
+            raise ValueError(
+                "REQUESTS_PER_SECOND variable must be a positive number. "
+                + f"You have provided: {os.environ['INPUT_REQUESTS_PER_SECOND']}"
+            )
+
+    # Share one pool of keep-alive connections between every request of the run
+    set_client(
+        HTTPClient(
+            pool_maxsize=max(max_concurrency, chart_workers),
+            headers={"User-Agent": f"helm-bot/{__version__.public()}"},
+            scheduler=RequestScheduler(
+                max_retries=max_retries, requests_per_second=requests_per_second
+            ),
+        )
     )
-    update_helm_deps.update()
+
+    kwargs = {
+        "base_branch": base_branch,
+        "head_branch": head_branch,
+        "labels": labels,
+        "reviewers": reviewers,
+        "team_reviewers": team_reviewers,
+        "dry_run": dry_run,
+        "max_concurrency": max_concurrency,
+        "cache_dir": cache_dir,
+        "version_constraints": version_constraints,
+        "github_api_url": github_api_url,
+        "github_graphql_url": github_graphql_url,
+    }
+
+    # CHART_PATH may be a comma-separated list of paths and/or glob patterns
+    chart_paths = split_str_to_list(chart_path)
+    if len(chart_paths) == 1 and not _is_glob(chart_path):
+        update_helm_deps = UpdateHelmDeps(
+            repository, github_token, chart_path, chart_urls, **kwargs
+        )
+    else:
+        update_helm_deps = UpdateManyHelmDeps(
+            repository,
+            github_token,
+            chart_paths,
+            chart_urls,
+            chart_workers=chart_workers,
+            **kwargs,
+        )
+
+    if profile_dir:
+        from .profiling import Profiler
+
+        recorder.profiler = Profiler()
+        recorder.profiler.start()
+
+    try:
+        update_helm_deps.update()
+    except ChartVersionError as e:
+        # Only exit once every chart has finished, so that none is left with a
+        # branch but no Pull Request
+        logger.error(str(e))
+        sys.exit(1)
+    finally:
+        stats = get_client().stats
+        logger.info(
+            "HTTP connections opened: {}, reused: {}", stats.opened, stats.reused
+        )
+        budget = get_client().scheduler.budget(github_api_url)
+        if budget is not None:
+            logger.info(
+                "GitHub API rate limit remaining: {}/{}", budget.remaining, budget.limit
+            )
+
+        # Write the instrumentation reports, even if the run failed
+        if metrics_file:
+            logger.info("Writing run metrics to: {}", metrics_file)
+            recorder.write_summary(metrics_file)
+        if trace_file:
+            logger.info("Writing Chrome trace to: {}", trace_file)
+            recorder.write_chrome_trace(trace_file)
+        if openmetrics_file:
+            logger.info("Writing OpenMetrics to: {}", openmetrics_file)
+            recorder.write_openmetrics(openmetrics_file)
+        if profile_dir:
+            logger.info("Writing stage profiles to: {}", profile_dir)
+            recorder.profiler.write(profile_dir)
+            recorder.profiler.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import re
+import threading
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from .http_requests import get_client, get_request
+from .instrumentation import instrumented
+
+# The number of tags to ask for in each page of the tags/list API
+PAGE_SIZE = 1000
+
+# Registries on these hosts are spoken to over plain HTTP, as docker and helm do
+# for local registries
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+CHALLENGE_PARAM = re.compile(r'(\w+)="([^"]*)"')
+NEXT_LINK = re.compile(r'<([^>]+)>\s*;\s*rel="?next"?')
+
+
+def oci_reference(chart_url, chart):
+    """Build the reference of a chart stored in an OCI registry. As helm does, the
+    name of the chart is appended to the repository URL, unless the URL already
+    ends with it.
+
+    Args:
+        chart_url (str): The oci:// URL of the repository, e.g.
+            oci://registry-1.docker.io/bitnamicharts
+        chart (str): The name of the chart
+
+    Returns:
+        reference (str): The oci:// URL of the chart, e.g.
+            oci://registry-1.docker.io/bitnamicharts/nginx
+    """
+    reference = chart_url.rstrip("/")
+    if reference.rsplit("/", 1)[-1] != chart:
+        reference = "/".join([reference, chart])
+    return reference
+
+
+def tag_to_version(tag):
+    """Convert the tag of a chart pushed by helm back to its version. OCI tags
+    cannot contain '+', so helm replaces the '+' of any build metadata with '_'.
+    """
+    return tag.replace("_", "+")
+
+
+class OCIRegistryClient:
+    """List the tags of helm charts stored in OCI registries with the registry v2
+    HTTP API. Requests are sent over the shared, pooled HTTPClient. When a
+    registry challenges a request for a bearer token, an anonymous pull token is
+    requested from its authorisation service and reused for every page and every
+    later request to the same repository.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def _fetch_token(self, challenge):
+        """Request a bearer token that answers a WWW-Authenticate challenge
+
+        Args:
+            challenge (str): The value of the WWW-Authenticate header, e.g.
+                'Bearer realm="https://auth.docker.io/token",service="..."'
+
+        Returns:
+            token (str): The bearer token
+        """
+        params = dict(CHALLENGE_PARAM.findall(challenge))
+        realm = params.pop("realm", None)
+        if realm is None:
+            raise requests.HTTPError(
+                f"Unsupported authentication challenge: {challenge}"
+            )
+
+        resp = get_request(realm, params=params, output="json")
+        return resp.get("token") or resp.get("access_token")
+
+    def _get(self, url, repository):
+        """Send a GET request to a registry, authenticating with a bearer token if
+        the registry asks for one
+
+        Args:
+            url (str): The URL to send the request to
+            repository (tuple): The host and name of the repository the request
+                is for, which its token is stored under
+
+        Returns:
+            resp (requests.Response): The response to the request
+        """
+        client = get_client()
+
+        for attempt in range(2):
+            headers = {"Accept": "application/json"}
+            with self._lock:
+                token = self._tokens.get(repository)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+
+            resp = client.request("GET", url, headers=headers)
+
+            # Fetch a new token if there was none, or if it has expired
+            if resp.status_code != 401 or attempt > 0:
+                break
+            challenge = resp.headers.get("WWW-Authenticate", "")
+            if not challenge.lower().startswith("bearer "):
+                break
+
+            token = self._fetch_token(challenge)
+            with self._lock:
+                self._tokens[repository] = token
+
+        if not resp:
+            raise requests.HTTPError(f"{resp.text}\nRequest URL: {url}")
+
+        return resp
+
+    @instrumented("oci_list_tags")
+    def list_tags(self, reference):
+        """List every tag of a chart in an OCI registry, following the Link
+        headers of paginated responses
+
+        Args:
+            reference (str): The oci:// URL of the chart
+
+        Returns:
+            tags (list): The tags of the chart
+        """
+        parsed = urlparse(reference)
+        name = parsed.path.strip("/")
+        scheme = "http" if parsed.hostname in LOCAL_HOSTS else "https"
+        url = f"{scheme}://{parsed.netloc}/v2/{name}/tags/list?n={PAGE_SIZE}"
+
+        tags = []
+        while url:
+            resp = self._get(url, (parsed.netloc, name))
+            tags.extend(resp.json().get("tags") or [])
+
+            next_link = NEXT_LINK.search(resp.headers.get("Link", ""))
+            url = urljoin(url, next_link.group(1)) if next_link else None
+
+        return tags
+
+
+# The client shared by the whole run, so that tokens are reused between charts
+registry = OCIRegistryClient()
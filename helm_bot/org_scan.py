@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import json
+import os
+import posixpath
+import sys
+
+from loguru import logger
+
+from ._version import __version__
+from .http_requests import HTTPClient, async_get_request, get_client, set_client
+from .instrumentation import recorder
+from .main import UpdateManyHelmDeps, github_headers, split_str_to_list
+from .pull_version_info import ChartVersionError, IndexDownloads
+from .request_scheduler import RequestScheduler
+
+# GitHub's code search API returns at most 1000 results, in pages of up to 100
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_RESULTS = 1000
+
+
+class UpdateOrgHelmDeps:
+    """Update the versions of helm subcharts of helm charts stored across many
+    repositories in a single run. Each distinct chart index is downloaded only
+    once for the whole fleet, and the repositories are processed concurrently in
+    one event loop. One Pull Request is opened per chart, as UpdateHelmDeps does.
+    """
+
+    def __init__(
+        self,
+        github_token,
+        chart_urls,
+        repositories={},
+        search_query=None,
+        repo_workers=8,
+        chart_workers=4,
+        **kwargs,
+    ):
+        """
+        Args:
+            github_token (str): A GitHub token to make requests to the API with
+            chart_urls (dict): The location of every dependent chart's versions
+            repositories (dict, optional): A mapping of repository name, e.g.
+                'octocat/octocat', to the paths (or glob patterns) of the helm
+                charts stored in it. Defaults to an empty dict.
+            search_query (str, optional): A GitHub code search query that finds
+                helm charts to update, e.g. 'org:octocat filename:Chart.yaml'.
+                The charts found are added to repositories. Defaults to None.
+            repo_workers (int, optional): The maximum number of repositories to
+                process concurrently. Defaults to 8.
+            chart_workers (int, optional): The maximum number of charts to
+                process concurrently within each repository. Defaults to 4.
+            **kwargs: Any other arguments accepted by UpdateHelmDeps. If
+                base_branch is not set, each repository's default branch is used.
+        """
+        self.github_token = github_token
+        self.chart_urls = chart_urls
+        self.repositories = repositories
+        self.search_query = search_query
+        self.repo_workers = repo_workers
+        self.chart_workers = chart_workers
+        self.kwargs = kwargs
+
+        self.github_api_url = kwargs.get(
+            "github_api_url", "https://api.github.com"
+        ).rstrip("/")
+        self.headers = github_headers(github_token)
+        # Resolve the versions of as many charts at a time as are processed
+        self.index_downloads = IndexDownloads(
+            kwargs.get("max_concurrency", 8), repo_workers * chart_workers
+        )
+
+    async def search_chart_paths(self):
+        """Find helm charts with GitHub's code search API
+
+        Returns:
+            repositories (dict): A mapping of repository name to the sorted paths
+                of the files matching search_query
+        """
+        logger.info("Searching for helm charts: {}", self.search_query)
+        url = "/".join([self.github_api_url, "search", "code"])
+
+        repositories = {}
+        page = 1
+        while True:
+            resp = await async_get_request(
+                url,
+                headers=self.headers,
+                params={
+                    "q": self.search_query,
+                    "per_page": SEARCH_PAGE_SIZE,
+                    "page": page,
+                },
+                output="json",
+            )
+
+            for item in resp["items"]:
+                repository = item["repository"]["full_name"]
+                repositories.setdefault(repository, []).append(item["path"])
+
+            total = min(resp["total_count"], SEARCH_MAX_RESULTS)
+            if (
+                len(resp["items"]) < SEARCH_PAGE_SIZE
+                or page * SEARCH_PAGE_SIZE >= total
+            ):
+                break
+            page += 1
+
+        return {
+            repository: sorted(_without_subcharts(set(chart_paths)))
+            for (repository, chart_paths) in repositories.items()
+        }
+
+    async def discover(self):
+        """Combine the listed repositories with those found by search_query
+
+        Returns:
+            repositories (dict): A mapping of repository name to the paths of the
+                helm charts to update in it
+        """
+        repositories = {
+            repository: list(chart_paths)
+            for (repository, chart_paths) in self.repositories.items()
+        }
+
+        if self.search_query:
+            found = await self.search_chart_paths()
+            for repository, chart_paths in found.items():
+                listed = repositories.setdefault(repository, [])
+                listed.extend(path for path in chart_paths if path not in listed)
+
+        return repositories
+
+    async def _default_branch(self, repository):
+        """Get the name of the default branch of a repository"""
+        url = "/".join([self.github_api_url, "repos", repository])
+        resp = await async_get_request(url, headers=self.headers, output="json")
+        return resp["default_branch"]
+
+    async def _update_repository(self, repository, chart_paths):
+        """Run the action for every helm chart in one repository
+
+        Args:
+            repository (str): The name of the repository
+            chart_paths (list): The paths to the helm charts in the repository
+        """
+        kwargs = dict(self.kwargs)
+        if not kwargs.get("base_branch"):
+            kwargs["base_branch"] = await self._default_branch(repository)
+
+        update_many = UpdateManyHelmDeps(
+            repository,
+            self.github_token,
+            chart_paths,
+            self.chart_urls,
+            chart_workers=self.chart_workers,
+            index_downloads=self.index_downloads,
+            **kwargs,
+        )
+        await update_many.async_update()
+
+    async def async_update(self):
+        """Run the action for every repository concurrently in the running event
+        loop"""
+        repositories = await self.discover()
+        logger.info("Checking the helm charts of repositories: {}", list(repositories))
+
+        semaphore = asyncio.Semaphore(self.repo_workers)
+
+        async def update_repository(repository, chart_paths):
+            async with semaphore:
+                await self._update_repository(repository, chart_paths)
+
+        results = await asyncio.gather(
+            *(
+                update_repository(repository, chart_paths)
+                for (repository, chart_paths) in repositories.items()
+            ),
+            return_exceptions=True,
+        )
+
+        # Report failures in the order the repositories were found, and only after
+        # every other repository has had the chance to open its Pull Requests
+        errors = []
+        for repository, result in zip(repositories, results):
+            if isinstance(result, Exception):
+                logger.error(f"Could not update repository {repository}: {result}")
+                errors.append(result)
+
+        if errors:
+            raise errors[0]
+
+    def update(self):
+        """Run the action for every repository concurrently, in a single event
+        loop"""
+        try:
+            asyncio.run(self.async_update())
+        finally:
+            self.index_downloads.close()
+
+
+def _without_subcharts(chart_paths):
+    """Leave out the helm charts vendored into the charts/ directory of another
+    helm chart, e.g. 'umbrella/charts/redis/Chart.yaml' when 'umbrella/Chart.yaml'
+    is also found, since they are updated with their parent chart
+
+    Args:
+        chart_paths (set): The paths of the helm charts found in a repository
+
+    Returns:
+        (list): The paths of the helm charts that are not vendored subcharts
+    """
+    subchart_dirs = tuple(
+        posixpath.join(posixpath.dirname(chart_path), "charts", "")
+        for chart_path in chart_paths
+    )
+    return [
+        chart_path
+        for chart_path in chart_paths
+        if not chart_path.startswith(subchart_dirs)
+    ]
+
+
+def parse_repositories(repositories):
+    """Parse the repositories argument of the command line
+
+    Args:
+        repositories (str): A string-serialised dictionary mapping each repository
+            to a list, or comma-separated string, of chart paths
+
+    Returns:
+        (dict): A mapping of repository name to a list of chart paths
+    """
+    repositories = json.loads(repositories)
+    if not isinstance(repositories, dict):
+        raise ValueError(
+            "REPOSITORIES must map each repository to its chart paths. "
+            + f"You have provided: {repositories}"
+        )
+
+    return {
+        repository: (
+            split_str_to_list(chart_paths)
+            if isinstance(chart_paths, str)
+            else list(chart_paths)
+        )
+        for (repository, chart_paths) in repositories.items()
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Check and bump the helm chart dependencies of many "
+        + "repositories in a single run"
+    )
+    parser.add_argument(
+        "--repositories",
+        type=parse_repositories,
+        default={},
+        help="A string-serialised dictionary mapping each repository to a "
+        + "comma-separated list of chart paths and/or glob patterns, e.g. "
+        + '\'{"octocat/octocat": "charts/*/Chart.yaml"}\'',
+    )
+    parser.add_argument(
+        "--search-query",
+        help="A GitHub code search query that finds the helm charts to update, "
+        + "e.g. 'org:octocat filename:Chart.yaml'",
+    )
+    parser.add_argument(
+        "--chart-urls",
+        type=json.loads,
+        required=True,
+        help="A string-serialised dictionary storing the location of the "
+        + "dependent charts and their versions",
+    )
+    parser.add_argument(
+        "--github-token",
+        default=os.environ.get("GITHUB_TOKEN"),
+        help="A GitHub token to make requests to the API with. Defaults to the "
+        + "GITHUB_TOKEN environment variable.",
+    )
+    parser.add_argument(
+        "--base-branch",
+        help="The base branch to open Pull Requests against. Defaults to the "
+        + "default branch of each repository.",
+    )
+    parser.add_argument(
+        "--head-branch",
+        default="bump-helm-deps",
+        help="The branch to commit to and open Pull Requests from",
+    )
+    parser.add_argument(
+        "--labels", type=split_str_to_list, default=[], help="Labels to apply"
+    )
+    parser.add_argument(
+        "--reviewers",
+        type=split_str_to_list,
+        default=[],
+        help="GitHub users to request reviews from",
+    )
+    parser.add_argument(
+        "--team-reviewers",
+        type=split_str_to_list,
+        default=[],
+        help="GitHub teams to request reviews from",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Log which helm chart versions can be bumped without opening Pull "
+        + "Requests",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="The maximum number of chart indexes to download concurrently",
+    )
+    parser.add_argument(
+        "--repo-workers",
+        type=int,
+        default=8,
+        help="The maximum number of repositories to process concurrently",
+    )
+    parser.add_argument(
+        "--chart-workers",
+        type=int,
+        default=4,
+        help="The maximum number of charts to process concurrently per repository",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="The maximum number of times to retry a HTTP request",
+    )
+    parser.add_argument(
+        "--requests-per-second",
+        type=float,
+        help="Pace HTTP requests to at most this many per second",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="A directory to persist HTTP responses and parsed chart indexes in",
+    )
+    parser.add_argument(
+        "--version-constraints",
+        type=json.loads,
+        default={},
+        help="A string-serialised dictionary restricting the versions each "
+        + "dependency can be bumped to",
+    )
+    parser.add_argument(
+        "--metrics-file", help="A file to write a JSON summary of the run to"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="A directory to write cProfile statistics and memory allocation "
+        + "summaries of each stage of the run to. Charts are then processed one "
+        + "at a time.",
+    )
+    args = parser.parse_args(args)
+
+    if not args.repositories and not args.search_query:
+        parser.error("one of --repositories or --search-query must be set")
+    if args.github_token is None:
+        parser.error("--github-token or the GITHUB_TOKEN variable must be set")
+    for name in ["max_concurrency", "repo_workers", "chart_workers"]:
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be a positive integer")
+
+    # The stages of charts processed concurrently would be recorded in each
+    # other's profiles
+    if args.profile_dir and args.repo_workers * args.chart_workers > 1:
+        logger.info("Processing one chart at a time, since --profile-dir is set")
+        args.repo_workers = args.chart_workers = 1
+
+    # Set by GitHub Actions, and point to the GitHub Enterprise Server instance
+    # where applicable
+    github_api_url = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    github_graphql_url = os.environ.get("GITHUB_GRAPHQL_URL", None)
+
+    # Share one pool of keep-alive connections between every repository
+    set_client(
+        HTTPClient(
+            pool_maxsize=max(
+                args.max_concurrency, args.repo_workers * args.chart_workers
+            ),
+            headers={"User-Agent": f"helm-bot/{__version__.public()}"},
+            scheduler=RequestScheduler(
+                max_retries=args.max_retries,
+                requests_per_second=args.requests_per_second,
+            ),
+        )
+    )
+
+    update_org_helm_deps = UpdateOrgHelmDeps(
+        args.github_token,
+        args.chart_urls,
+        repositories=args.repositories,
+        search_query=args.search_query,
+        repo_workers=args.repo_workers,
+        chart_workers=args.chart_workers,
+        base_branch=args.base_branch,
+        head_branch=args.head_branch,
+        labels=args.labels,
+        reviewers=args.reviewers,
+        team_reviewers=args.team_reviewers,
+        dry_run=args.dry_run,
+        max_concurrency=args.max_concurrency,
+        cache_dir=args.cache_dir,
+        version_constraints=args.version_constraints,
+        github_api_url=github_api_url,
+        github_graphql_url=github_graphql_url,
+    )
+
+    if args.profile_dir:
+        from .profiling import Profiler
+
+        recorder.profiler = Profiler()
+        recorder.profiler.start()
+
+    try:
+        update_org_helm_deps.update()
+    except ChartVersionError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    finally:
+        stats = get_client().stats
+        logger.info(
+            "HTTP connections opened: {}, reused: {}", stats.opened, stats.reused
+        )
+
+        if args.metrics_file:
+            logger.info("Writing run metrics to: {}", args.metrics_file)
+            recorder.write_summary(args.metrics_file)
+        if args.profile_dir:
+            logger.info("Writing stage profiles to: {}", args.profile_dir)
+            recorder.profiler.write(args.profile_dir)
+            recorder.profiler.stop()
+
+
+if __name__ == "__main__":
+    main()
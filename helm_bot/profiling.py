@@ -0,0 +1,205 @@
+import cProfile
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# The stages of UpdateHelmDeps.update that are profiled. They never nest within
+# each other, so that each profile only covers its own stage.
+PROFILED_STAGES = (
+    "find_pull_request",
+    "get_config",
+    "get_remote_versions",
+    "compare_versions",
+    "update_versions",
+    "create_ref",
+    "create_commit",
+    "create_pull_request",
+)
+
+# The number of lines allocating the most memory to report for each call
+TOP_ALLOCATIONS = 10
+
+# Allocations made by tracemalloc itself are left out of the reports
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+)
+
+
+class StageProfile:
+    """The cProfile statistics and allocation reports of every call of a single
+    stage"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.profiled_calls = 0
+        self.allocations = []
+
+
+class _ActiveCall:
+    """A call of a stage that is being profiled"""
+
+    __slots__ = ("overlapped",)
+
+    def __init__(self, overlapped):
+        self.overlapped = overlapped
+
+
+class Profiler:
+    """Profile stages of a run with cProfile and tracemalloc. The cProfile
+    statistics of every call of a stage are accumulated into one .pstats file
+    per stage, and the lines that allocated the most memory during each call are
+    summarised in a text file per stage.
+
+    Profiles are only accurate for stages that do not overlap, so runs that are
+    profiled process one chart at a time. Should stages overlap nonetheless,
+    only one is profiled by cProfile at a time, and a stage that awaits is not
+    profiled by cProfile at all if it starts while another stage is active. The
+    allocations of overlapping calls are still reported, but without a peak,
+    since tracemalloc only tracks a single peak for the whole process.
+    """
+
+    def __init__(self, stages=PROFILED_STAGES):
+        """
+        Args:
+            stages (iterable, optional): The names of the stages to profile.
+                Defaults to PROFILED_STAGES.
+        """
+        self.stages = set(stages)
+        self.profiles = {}
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock()
+        self._active = []
+
+    def start(self):
+        """Start tracing memory allocations"""
+        tracemalloc.start()
+
+    def stop(self):
+        """Stop tracing memory allocations"""
+        tracemalloc.stop()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    @contextmanager
+    def stage(self, name, awaits=False):
+        """Profile a block of code as a named stage, if it is one of the stages
+        to profile
+
+        Args:
+            name (str): The name of the stage
+            awaits (bool, optional): Whether the block awaits, in which case the
+                event loop runs other coroutines during it that cProfile would
+                record too. Defaults to False.
+        """
+        if name not in self.stages:
+            yield
+            return
+
+        with self._lock:
+            if name not in self.profiles:
+                self.profiles[name] = StageProfile()
+            stage_profile = self.profiles[name]
+
+            # Mark every call that overlaps another
+            call = _ActiveCall(overlapped=bool(self._active))
+            for other in self._active:
+                other.overlapped = True
+            self._active.append(call)
+
+            tracing = tracemalloc.is_tracing()
+            if tracing and not call.overlapped:
+                tracemalloc.reset_peak()
+
+        if tracing:
+            before = self._snapshot()
+
+        profiling = not (awaits and call.overlapped) and self._profiling.acquire(
+            blocking=False
+        )
+        if profiling:
+            try:
+                stage_profile.profile.enable()
+            except ValueError:
+                # Another profiler, e.g. python -m cProfile, is already active
+                self._profiling.release()
+                profiling = False
+
+        try:
+            yield
+        finally:
+            if profiling:
+                stage_profile.profile.disable()
+                self._profiling.release()
+
+            report = None
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                diff = self._snapshot().compare_to(before, "lineno")
+
+            with self._lock:
+                self._active.remove(call)
+                if tracing:
+                    report = self._allocation_report(
+                        diff, None if call.overlapped else peak
+                    )
+                stage_profile.calls += 1
+                stage_profile.profiled_calls += profiling
+                if report is not None:
+                    stage_profile.allocations.append(
+                        f"Call {stage_profile.calls}: {report}"
+                    )
+
+    def _allocation_report(self, diff, peak):
+        """Summarise the memory allocated during a single call of a stage
+
+        Args:
+            diff (list): The tracemalloc.StatisticDiff's between the snapshots
+                taken before and after the call
+            peak (int): The peak size, in bytes, of the traced memory during the
+                call, or None if the call overlapped another stage
+
+        Returns:
+            report (str): The peak and net memory allocated, followed by the lines
+                that allocated the most
+        """
+        net = sum(stat.size_diff for stat in diff)
+        peak = "unknown (overlapped another stage)" if peak is None else _mib(peak)
+        lines = [f"peak {peak}, net {'+' if net >= 0 else '-'}{_mib(abs(net))}"]
+        lines.extend(f"    {stat}" for stat in diff[:TOP_ALLOCATIONS])
+        return "\n".join(lines)
+
+    def write(self, directory):
+        """Write a .pstats file and an allocations summary for every profiled
+        stage. The .pstats files can be read with the pstats module, or
+        visualised with tools such as snakeviz.
+
+        Args:
+            directory (str): The directory to write the reports to. It will be
+                created if it does not exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            profiles = dict(self.profiles)
+
+        for name, stage_profile in profiles.items():
+            if stage_profile.profiled_calls:
+                stage_profile.profile.dump_stats(
+                    os.path.join(directory, f"{name}.pstats")
+                )
+
+            with open(os.path.join(directory, f"{name}.allocations.txt"), "w") as f:
+                f.write(
+                    f"{name}: {stage_profile.calls} calls, "
+                    + f"{stage_profile.profiled_calls} profiled by cProfile\n\n"
+                )
+                f.write("\n\n".join(stage_profile.allocations) + "\n")
+
+
+def _mib(size):
+    """Format a size in bytes in MiB"""
+    return f"{size / (1024 * 1024):.1f} MiB"
@@ -1,14 +1,147 @@
-import sys
+import asyncio
+import threading
 import warnings
-from itertools import compress
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from loguru import logger
-from ruamel.yaml.reader import ReaderError
 
-from .http_requests import get_request
+from .github_api import AsyncGitHubAPI
+from .http_requests import (
+    NON_ASCII_BYTES,
+    SpooledBody,
+    async_get_request,
+    get_request,
+)
+from .index_cache import content_hash, version_table
+from .instrumentation import instrumented, propagate_context
+from .oci_registry import oci_reference, registry, tag_to_version
+from .run_state import index_fingerprint, tags_digest
+from .versions import ChartVersion, ChartVersions, parse_version, resolve_latest
 from .yaml_parser import YamlParser
 
 yaml = YamlParser()
+read_only_yaml = YamlParser(fast=True)
+
+
+class ChartVersionError(ValueError):
+    """The versions of a helm chart dependency could not be found"""
+
+
+class IndexDownloads:
+    """Download helm chart repository indexes, and the tag lists of charts stored
+    in OCI registries, in a bounded thread pool, making sure each distinct URL is
+    only downloaded once. An instance can be shared between several
+    HelmChartVersionPuller's so that charts depending on the same index share the
+    download, and the EntryOffsets scanned from it. Downloads are kept for the
+    whole run, so that charts processed later still share them, and are discarded
+    when the run closes the IndexDownloads.
+
+    The versions of each chart are resolved in a separate pool of threads, which
+    block while waiting on downloads. They would otherwise hold threads of the
+    event loop's default executor, which the async_*_request helpers need.
+    """
+
+    def __init__(self, max_workers=8, resolve_workers=None):
+        """
+        Args:
+            max_workers (int, optional): The maximum number of indexes to download
+                concurrently. Defaults to 8.
+            resolve_workers (int, optional): The maximum number of charts to
+                resolve the versions of concurrently. Defaults to max_workers.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._resolve_executor = ThreadPoolExecutor(
+            max_workers=resolve_workers or max_workers
+        )
+        self._futures = {}
+        self._offsets = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, chart_url, download):
+        """Schedule the download of an index, unless it has already been scheduled
+
+        Args:
+            chart_url (str): The URL of the index
+            download (callable): A function that takes the URL and returns the
+                contents of the index
+
+        Returns:
+            future (concurrent.futures.Future): A future holding the contents of
+                the index
+        """
+        with self._lock:
+            if chart_url not in self._futures:
+                self._futures[chart_url] = self._executor.submit(
+                    propagate_context(download), chart_url
+                )
+            return self._futures[chart_url]
+
+    def close(self):
+        """Discard every download once the run is over, closing the memory maps
+        of their EntryOffsets and the temporary files of spooled indexes"""
+        self._executor.shutdown(wait=True)
+        self._resolve_executor.shutdown(wait=True)
+
+        with self._lock:
+            futures = list(self._futures.values())
+            offsets = [value for value in self._offsets.values() if value is not None]
+            self._futures.clear()
+            self._offsets.clear()
+
+        for entry_offsets in offsets:
+            entry_offsets.close()
+        for future in futures:
+            _close_download(future)
+
+    async def resolve(self, func):
+        """Run a function that resolves the versions of a chart in the resolve
+        pool, without blocking the running event loop
+
+        Args:
+            func (callable): The function to run
+
+        Returns:
+            The return value of func
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._resolve_executor, propagate_context(func)
+        )
+
+    def entry_offsets(self, chart_url, index):
+        """Return the byte ranges of the charts in a downloaded index, scanning it
+        the first time they are needed
+
+        Args:
+            chart_url (str): The URL of the index
+            index (SpooledBody): The downloaded contents of the index
+
+        Returns:
+            offsets (EntryOffsets): The byte ranges of the charts in the index, or
+                None if the index could not be scanned
+        """
+        with self._lock:
+            if chart_url in self._offsets:
+                return self._offsets[chart_url]
+
+        from .index_reader import scan_entry_offsets
+
+        buffer = index.view()
+        offsets = scan_entry_offsets(buffer)
+        if offsets is None and hasattr(buffer, "close"):
+            buffer.close()
+        with self._lock:
+            return self._offsets.setdefault(chart_url, offsets)
+
+
+def _close_download(future):
+    """Close the contents of a finished download, if it holds a SpooledBody"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if isinstance(result, SpooledBody):
+        result.close()
 
 
 class HelmChartVersionPuller:
@@ -21,105 +154,390 @@ class HelmChartVersionPuller:
         self.inputs = inputs
         self.branch = branch
         self.github_api_url = "/".join(
-            ["https://api.github.com", "repos", self.inputs.repository]
+            [self.inputs.github_api_url, "repos", self.inputs.repository]
         )
-        self.chart_versions = {}
+        self.chart_versions = ChartVersions()
+        self.fingerprints = {}
 
-    def _get_config(self, ref):
-        """Get the contents and sha of a YAML config file in a GitHub repo over the API
+    @property
+    def chart_versions(self):
+        """The ChartVersions of the dependencies. Plain dicts of versions are
+        converted when set."""
+        return self._chart_versions
+
+    @chart_versions.setter
+    def chart_versions(self, versions):
+        if not isinstance(versions, ChartVersions):
+            versions = ChartVersions(versions)
+        self._chart_versions = versions
+
+    @instrumented("get_config")
+    async def _get_config_text(self, ref):
+        """Get the raw contents and sha of a file in a GitHub repo over the API.
+        Both are fetched in a single GraphQL request where possible, falling back
+        to the contents API and a download of the raw file otherwise.
 
         Args:
             ref (str): The reference (branch) the file is stored on
 
         Returns:
-            config (dict): The config stored at the provided filepath
+            text (str): The contents of the file at the provided filepath
             sha (str): The SHA of the file
         """
+        try:
+            config = await AsyncGitHubAPI(self.inputs).get_file(
+                self.inputs.chart_path, ref
+            )
+        except (RuntimeError, requests.HTTPError) as e:
+            logger.warning(
+                f"Could not fetch {self.inputs.chart_path} over GraphQL: {e}"
+            )
+            config = None
+
+        if config is not None:
+            return config
+
         url = "/".join([self.github_api_url, "contents", self.inputs.chart_path])
         query = {"ref": ref}
-        resp = get_request(
-            url, headers=self.inputs.headers, params=query, output="json"
+        resp = await async_get_request(
+            url,
+            headers=self.inputs.headers,
+            params=query,
+            output="json",
+            cache=self.inputs.cache,
         )
 
         download_url = resp["download_url"]
         sha = resp["sha"]
 
-        resp = get_request(download_url, headers=self.inputs.headers, output="text")
-        return yaml.yaml_string_to_object(resp), sha
+        resp = await async_get_request(
+            download_url,
+            headers=self.inputs.headers,
+            output="text",
+            cache=self.inputs.cache,
+        )
+        return resp, sha
+
+    async def _get_config(self, ref):
+        """Get the contents and sha of a YAML config file in a GitHub repo over the API
 
-    def _pull_version_github_pages(self, chart, chart_url):
-        """Pull helm chart dependencies and versions from remote host listed on a
-        GitHub Pages site.
+        Args:
+            ref (str): The reference (branch) the file is stored on
+
+        Returns:
+            config (dict): The config stored at the provided filepath
+            sha (str): The SHA of the file
+        """
+        text, sha = await self._get_config_text(ref)
+        return yaml.yaml_string_to_object(text), sha
+
+    @instrumented("fetch_index")
+    def _fetch_index(self, chart_url):
+        """Download a helm chart repository index. The body is streamed in chunks,
+        stripped of non-ascii characters as it arrives, and spooled to disk if it
+        is large, so that the whole index is never held in memory.
 
         Args:
-            chart (str): The name of the helm chart dependency to pull
-                versions for.
             chart_url (str): The URL of the remotely hosted helm chart dependencies
+
+        Returns:
+            index (SpooledBody): The contents of the index, stripped of non-ascii
+                characters
         """
+        index = SpooledBody()
+        for chunk in get_request(
+            chart_url,
+            headers=self.inputs.headers,
+            output="stream",
+            cache=self.inputs.cache,
+        ):
+            if not chunk.isascii():
+                # Every byte of a multi-byte character is outside the ascii
+                # range, so chunks can be filtered independently
+                chunk = chunk.translate(None, NON_ASCII_BYTES)
+            index.write(chunk)
+
+        return index
+
+    def _fetch_indexes(self, chart_urls):
+        """Download several helm chart repository indexes concurrently. The number
+        of simultaneous downloads is bounded by the max_concurrency input, and
+        indexes already downloaded for another chart are reused.
+
+        Args:
+            chart_urls (list): The distinct URLs of the indexes to download
+
+        Returns:
+            futures (dict): A mapping of each URL to the future holding its
+                downloaded index
+        """
+        return {
+            chart_url: self.inputs.index_downloads.fetch(chart_url, self._fetch_index)
+            for chart_url in chart_urls
+        }
+
+    def _read_version_tables(self, charts, chart_url, index):
+        """Read the (created, version) tables of some charts from an index. If a
+        parsed index cache is configured and holds a copy of this exact index, it
+        is used instead of parsing the YAML. Otherwise, every chart in the index
+        is parsed and written to the cache for subsequent runs. Without a cache,
+        only the slices of the index holding the requested charts are parsed,
+        found with the index's EntryOffsets.
+
+        Args:
+            charts (list): The names of the helm charts to read tables for
+            chart_url (str): The URL of the remotely hosted helm chart dependencies
+            index (SpooledBody or str): The downloaded contents of the index at
+                chart_url
+
+        Returns:
+            tables (dict): A mapping of chart name to a list of (created, version)
+                tuples sorted by created
+        """
+        index_cache = self.inputs.index_cache
+        if index_cache is not None:
+            if isinstance(index, SpooledBody):
+                digest = index.digest()
+            else:
+                digest = content_hash(index)
+            tables = index_cache.lookup(chart_url, digest, charts)
+            if tables is not None:
+                logger.info("Using cached versions from index: {}", chart_url)
+                return tables
+
+        # The index reader, and ruamel.yaml with it, are only imported once an
+        # index is read, to keep them out of the start up of every run
+        from ruamel.yaml.reader import ReaderError
+
+        from .index_reader import read_charts_releases
+
+        offsets = None
+        if index_cache is None and isinstance(index, SpooledBody):
+            offsets = self.inputs.index_downloads.entry_offsets(chart_url, index)
+
+        if isinstance(index, SpooledBody):
+            # Each reader has its own position, so the same download can be read
+            # by several charts at once
+            index = index.open()
+
         try:
-            releases = get_request(
-                chart_url, headers=self.inputs.headers, output="text"
+            if offsets is not None:
+                charts_releases = offsets.read_charts_releases(charts)
+            elif index_cache is None:
+                charts_releases = read_charts_releases(index, charts)
+            else:
+                charts_releases = read_charts_releases(index)
+                index_cache.store(chart_url, digest, charts_releases)
+
+        except ReaderError as re:
+            raise ChartVersionError(
+                f"Could not read from URL: {chart_url}\n\n{re}"
+            ) from re
+
+        return {
+            chart: version_table(charts_releases[chart])
+            for chart in charts
+            if chart in charts_releases
+        }
+
+    def _pull_version_github_pages(self, charts, chart_url, index):
+        """Pull helm chart dependencies and versions from remote host listed on a
+        GitHub Pages site. The index is parsed once and the highest version of every
+        requested chart satisfying its version constraint is resolved in a single
+        pass over its releases. If none of a chart's releases are semantic
+        versions, the most recently created release is used instead.
+
+        Args:
+            charts (list): The names of the helm chart dependencies to pull
+                versions for. They must all be hosted in the same index.
+            chart_url (str): The URL of the remotely hosted helm chart dependencies
+            index (SpooledBody or str): The downloaded contents of the index at
+                chart_url
+        """
+        tables = self._read_version_tables(charts, chart_url, index)
+
+        for chart in charts:
+            table = tables.get(chart)
+            if not table:
+                raise ChartVersionError(
+                    f"Could not find chart {chart} in index: {chart_url}"
+                )
+
+            current = self.chart_versions[chart].current
+            latest = resolve_latest(
+                (version for (_, version) in table),
+                current=current,
+                constraint=self._version_constraint(chart),
             )
+            if latest is None:
+                if any(parse_version(version) for (_, version) in table):
+                    logger.warning(
+                        f"No version of chart {chart} satisfies its constraint, "
+                        + f"keeping version {current}"
+                    )
+                    latest = current
+                else:
+                    # Tables are (created, version) pairs sorted by created
+                    latest = table[-1][1]
 
-            releases = releases.encode("ascii", "ignore")
-            releases = releases.decode()
+            self.chart_versions[chart].latest = latest
 
-            releases = yaml.yaml_string_to_object(releases)
+    def _pull_version_oci(self, chart, reference, tags):
+        """Pull the latest version of a helm chart dependency stored in an OCI
+        registry. Tags are not ordered by when they were pushed, so only tags that
+        are semantic versions are considered.
 
-            releases = sorted(releases["entries"][chart], key=lambda k: k["created"])
-            self.chart_versions[chart]["latest"] = releases[-1]["version"]
+        Args:
+            chart (str): The name of the helm chart dependency
+            reference (str): The oci:// URL of the chart
+            tags (list): The tags of the chart in the registry
+        """
+        versions = [tag_to_version(tag) for tag in tags]
+        current = self.chart_versions[chart].current
+        latest = resolve_latest(
+            versions, current=current, constraint=self._version_constraint(chart)
+        )
 
-        except ReaderError as re:
-            logger.error(f"Could not read from URL: {chart_url}\n\n{re}")
-            sys.exit(1)
+        if latest is None:
+            if not any(parse_version(version) for version in versions):
+                raise ChartVersionError(
+                    f"Could not find a version of chart {chart}: {reference}"
+                )
+
+            logger.warning(
+                f"No version of chart {chart} satisfies its constraint, "
+                + f"keeping version {current}"
+            )
+            latest = current
+
+        self.chart_versions[chart].latest = latest
 
+    def _version_constraint(self, chart):
+        """Return the version constraint of a helm chart dependency"""
+        return self.inputs.version_constraints.get(
+            chart, self.inputs.version_constraints.get("*", {})
+        )
+
+    @instrumented("get_remote_versions")
     def _get_remote_versions(self):
         """
         Decipher where a list of chart versions is hosted and find the most recently
         published version
         """
         logger.info("Fetching most recently published helm chart versions...")
+
+        # Group the charts by the index that hosts them so that each index is only
+        # downloaded and parsed once
+        index_charts = {}
+        oci_charts = {}
         for chart, chart_url in self.inputs.chart_urls.items():
+            if chart not in self.chart_versions:
+                # chart_urls may be shared by several charts, each only
+                # depending on some of them
+                continue
+
             if (
                 ("/gh-pages/" in chart_url)
                 or chart_url.endswith("index.yaml")
                 or chart_url.endswith("index.yml")
             ):
-                self._pull_version_github_pages(chart, chart_url)
+                index_charts.setdefault(chart_url, []).append(chart)
+            elif chart_url.startswith("oci://"):
+                oci_charts[chart] = oci_reference(chart_url, chart)
             else:
                 warnings.warn(
                     f"NotImplemented: Cannot currently retrieve version from URL type: {chart_url}"
                 )
                 continue
 
+        futures = self._fetch_indexes(list(index_charts.keys()))
+        # Tag lists are fetched in the same pool, concurrently with the indexes
+        futures.update(
+            {
+                reference: self.inputs.index_downloads.fetch(
+                    reference, registry.list_tags
+                )
+                for reference in oci_charts.values()
+            }
+        )
+
+        # Results are consumed in chart_urls order so that errors are reported
+        # deterministically, regardless of which download finished first
+        errors = []
+        for chart_url, charts in index_charts.items():
+            try:
+                index = futures[chart_url].result()
+            except Exception as e:
+                logger.error(f"Could not fetch versions for charts {charts}: {e}")
+                errors.append(e)
+                continue
+
+            self._pull_version_github_pages(charts, chart_url, index)
+            if self.inputs.run_state is not None:
+                self.fingerprints[chart_url] = index_fingerprint(
+                    self.inputs.cache, chart_url, index
+                )
+
+        for chart, reference in oci_charts.items():
+            try:
+                tags = futures[reference].result()
+            except Exception as e:
+                logger.error(f"Could not fetch versions for chart {chart}: {e}")
+                errors.append(e)
+                continue
+
+            self._pull_version_oci(chart, reference, tags)
+            if self.inputs.run_state is not None:
+                self.fingerprints[reference] = {"digest": tags_digest(tags)}
+
+        if errors:
+            raise errors[0]
+
+    @instrumented("compare_versions")
     def _compare_chart_versions(self):
         """Compare the current helm chart dependencies against the most recently
-        available and ascertain if a subchart can be updated
+        available and ascertain if a subchart can be updated. A subchart is only
+        updated if the latest version is newer than the current one.
 
         Returns:
             charts_to_update (list): A list of the helm chart dependencies that need
                 updating
         """
-        condition = [
-            (
-                self.chart_versions[chart]["current"]
-                != self.chart_versions[chart]["latest"]
-            )
-            for chart in self.chart_versions.keys()
-        ]
-        return list(compress(self.chart_versions.keys(), condition))
+        return self.chart_versions.outdated()
 
-    def get_chart_versions(self):
-        """Get the versions of dependent helm charts"""
+    @instrumented("get_chart_versions")
+    async def get_chart_versions(self):
+        """Get the versions of dependent helm charts. The chart is fetched in the
+        running event loop, and its dependencies are resolved in the resolve pool
+        of the index downloads."""
         logger.info("Fetching current subchart versions from helm chart...")
-        self.inputs.chart_yaml, self.inputs.sha = self._get_config(self.branch)
+        # The raw text is kept so that new versions can be spliced into it
+        self.inputs.chart_yaml_text, self.inputs.sha = await self._get_config_text(
+            self.branch
+        )
+        await self.inputs.index_downloads.resolve(self._resolve_chart_versions)
 
-        self.chart_versions = {
-            chart["name"]: {"current": chart["version"]}
-            for chart in self.inputs.chart_yaml["dependencies"]
-            if chart["name"] in self.inputs.chart_urls.keys()
-        }
+    def _resolve_chart_versions(self):
+        """Find the latest versions of the dependencies of the fetched chart, and
+        which of them need updating"""
+        # The chart is only loaded read-only to find its dependencies
+        self.inputs.chart_yaml = read_only_yaml.yaml_string_to_object(
+            self.inputs.chart_yaml_text
+        )
+
+        self.chart_versions = ChartVersions(
+            {
+                chart["name"]: ChartVersion(
+                    chart["name"],
+                    chart["version"],
+                    source=self.inputs.chart_urls[chart["name"]],
+                )
+                for chart in self.inputs.chart_yaml["dependencies"]
+                if chart["name"] in self.inputs.chart_urls.keys()
+            }
+        )
 
         self._get_remote_versions()
         self.inputs.charts_to_update = self._compare_chart_versions()
         self.inputs.chart_versions = self.chart_versions
+        self.inputs.index_fingerprints = self.fingerprints
@@ -0,0 +1,308 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+
+# Methods that can be repeated without changing the result, so are safe to retry
+# after a server error or a dropped connection
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+class RateLimitBudget:
+    """The rate limit quota of one GitHub API resource, as last reported by the
+    X-RateLimit-* response headers"""
+
+    def __init__(self, limit, remaining, reset):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def __repr__(self):
+        return (
+            f"RateLimitBudget(limit={self.limit}, remaining={self.remaining}, "
+            + f"reset={self.reset})"
+        )
+
+
+class TokenBucket:
+    """Pace events to a steady rate, while allowing short bursts"""
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): The number of tokens added per second
+            capacity (int, optional): The maximum number of tokens that can be
+                saved up for a burst. Defaults to rate, rounded up to at least 1.
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, borrowing against future refills if there are none left
+
+        Returns:
+            wait (float): How long to wait, in seconds, before the reserved token
+                becomes available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RequestScheduler:
+    """Decide when HTTP requests may be sent, and whether they should be retried.
+
+    The rate limit budget of each GitHub API resource is tracked from the
+    X-RateLimit-* headers of every response. Requests are paced out over the
+    remaining window once the budget runs low, and held until the window resets
+    once it is spent. Retry-After and secondary rate limits pause every request to
+    the host. Requests rejected by a rate limit are retried whatever their method,
+    since the server did not act on them, while server errors and dropped
+    connections are only retried for idempotent methods. Retries are delayed with
+    jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_retries=5,
+        backoff_factor=1.0,
+        max_backoff=60.0,
+        max_wait=300.0,
+        requests_per_second=None,
+        low_budget=0.1,
+    ):
+        """
+        Args:
+            max_retries (int, optional): The maximum number of times to retry a
+                request. Defaults to 5.
+            backoff_factor (float, optional): The base delay of the exponential
+                backoff, in seconds. Defaults to 1.0.
+            max_backoff (float, optional): The longest delay between retries of a
+                failed request, in seconds. Defaults to 60.
+            max_wait (float, optional): The longest a request will be held for a
+                rate limit to reset, in seconds. If the wait would be longer, the
+                request fails instead. Defaults to 300.
+            requests_per_second (float, optional): Pace every request to this
+                rate. Defaults to None, which does not pace requests.
+            low_budget (float, optional): The fraction of a rate limit below
+                which the remaining requests are spread evenly over the time left
+                until the limit resets. Defaults to 0.1.
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+        self.low_budget = low_budget
+        self.bucket = None
+        if requests_per_second:
+            self.bucket = TokenBucket(requests_per_second)
+
+        self._lock = threading.Lock()
+        self._budgets = {}
+        self._next_slot = {}
+        self._blocked_until = {}
+
+    @staticmethod
+    def _resource(url):
+        """Guess which rate limit resource a request counts against, before its
+        response reports it
+
+        Returns:
+            (tuple): The host and resource of the request
+        """
+        parsed = urlparse(url)
+        if parsed.path.endswith("/graphql"):
+            resource = "graphql"
+        elif "/search/" in parsed.path:
+            resource = "search"
+        else:
+            resource = "core"
+        return parsed.netloc, resource
+
+    def budget(self, url):
+        """Return the rate limit budget that a request to a URL would draw from,
+        so that callers can plan their work within the remaining quota
+
+        Args:
+            url (str): The URL of a request, e.g. the base URL of the GitHub API
+
+        Returns:
+            budget (RateLimitBudget): The last reported budget, or None if no
+                response from this host and resource has reported one yet
+        """
+        with self._lock:
+            return self._budgets.get(self._resource(url))
+
+    def wait(self, url):
+        """Block until a request to a URL may be sent
+
+        Args:
+            url (str): The URL of the request
+
+        Raises:
+            requests.HTTPError: If the rate limit will not reset within max_wait
+        """
+        key = self._resource(url)
+        host, resource = key
+
+        with self._lock:
+            now = time.time()
+            delay = self._blocked_until.get(host, now) - now
+
+            budget = self._budgets.get(key)
+            if budget is not None and budget.reset > now:
+                if budget.remaining <= 0:
+                    delay = max(delay, budget.reset - now)
+                elif budget.remaining < budget.limit * self.low_budget:
+                    # Spread what is left of the budget until the window resets
+                    spacing = (budget.reset - now) / budget.remaining
+                    slot = max(now, self._next_slot.get(key, now))
+                    self._next_slot[key] = slot + spacing
+                    delay = max(delay, slot - now)
+                # Count the request now, so that concurrent requests see it
+                budget.remaining -= 1
+
+        if delay > self.max_wait:
+            raise requests.HTTPError(
+                f"The {resource} rate limit of {host} will not reset for "
+                + f"{delay:.0f}s. Request URL: {url}"
+            )
+
+        if self.bucket is not None:
+            delay = max(delay, self.bucket.reserve())
+        if delay > 0:
+            logger.debug("Waiting {:.2f}s before requesting: {}", delay, url)
+            time.sleep(delay)
+
+    def set_budget(self, url, budget):
+        """Record a rate limit budget that was looked up rather than reported by
+        the headers of a response, e.g. from the /rate_limit endpoint
+
+        Args:
+            url (str): The URL of a request that draws from the budget
+            budget (RateLimitBudget): The budget
+        """
+        with self._lock:
+            self._budgets[self._resource(url)] = budget
+
+    def update(self, resp):
+        """Record the rate limit budget reported by a response
+
+        Args:
+            resp (requests.Response): The response to a request
+        """
+        headers = resp.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+
+        host = urlparse(resp.url).netloc
+        resource = headers.get("X-RateLimit-Resource") or self._resource(resp.url)[1]
+        try:
+            budget = RateLimitBudget(
+                int(headers.get("X-RateLimit-Limit", 0)),
+                int(headers["X-RateLimit-Remaining"]),
+                float(headers.get("X-RateLimit-Reset", 0)),
+            )
+        except ValueError:
+            return
+
+        with self._lock:
+            self._budgets[(host, resource)] = budget
+
+    def _backoff(self, attempt):
+        """Return a jittered exponential backoff delay for a retry"""
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff_factor * 2**attempt)
+        )
+
+    @staticmethod
+    def _retry_after(resp):
+        """Parse the Retry-After header of a response, in seconds"""
+        value = resp.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _is_rate_limited(self, resp):
+        """Check whether a response rejected its request for exceeding a primary
+        or secondary rate limit"""
+        if resp.status_code == 429:
+            return True
+        if resp.status_code != 403:
+            return False
+        return (
+            resp.headers.get("X-RateLimit-Remaining") == "0"
+            or "Retry-After" in resp.headers
+            or "rate limit" in resp.text.lower()
+        )
+
+    def retry_delay(self, method, attempt, resp=None):
+        """Decide whether to retry a request
+
+        Args:
+            method (str): The HTTP method of the request
+            attempt (int): The number of times the request has been retried
+            resp (requests.Response, optional): The response to the request, or
+                None if no response was received. Defaults to None.
+
+        Returns:
+            delay (float): How long to wait, in seconds, before retrying the
+                request, or None if it should not be retried
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        if resp is None:
+            return self._backoff(attempt) if method in IDEMPOTENT_METHODS else None
+
+        if self._is_rate_limited(resp):
+            delay = self._retry_after(resp)
+            if delay is None and resp.headers.get("X-RateLimit-Remaining") == "0":
+                delay = float(resp.headers.get("X-RateLimit-Reset", 0)) - time.time()
+            if delay is None:
+                # GitHub asks for at least a minute's wait after a secondary rate
+                # limit, increasing exponentially
+                delay = min(self.max_wait, 60.0 * 2**attempt)
+            delay = max(delay, 0.0)
+
+            if delay > self.max_wait:
+                return None
+
+            # Hold every other request to the host too
+            host = urlparse(resp.url).netloc
+            with self._lock:
+                self._blocked_until[host] = max(
+                    self._blocked_until.get(host, 0), time.time() + delay
+                )
+            logger.warning(
+                "Rate limited by {}, retrying in {:.0f}s: {}", host, delay, resp.url
+            )
+            return delay
+
+        if resp.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS:
+            delay = self._retry_after(resp)
+            if delay is None:
+                delay = self._backoff(attempt)
+            return delay if delay <= self.max_wait else None
+
+        return None
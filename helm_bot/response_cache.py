@@ -0,0 +1,238 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from loguru import logger
+
+
+class ResponseCache:
+    """A persistent on-disk cache of HTTP response bodies, keyed by URL. Entries
+    record the ETag and Last-Modified validators of a response so that subsequent
+    requests can be made conditional, and a 304 Not Modified response can be
+    served from disk. Bodies are stored gzip-compressed.
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024, max_age=7 * 86400):
+        """
+        Args:
+            directory (str): The directory to store cached responses in. It will
+                be created if it does not exist.
+            max_size (int, optional): The maximum total size, in bytes, of the
+                compressed bodies to keep. The least recently stored entries are
+                evicted first. Defaults to 256 MiB.
+            max_age (int, optional): The maximum age, in seconds, of an entry
+                before it is evicted. Defaults to 7 days.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _key(self, url, params={}):
+        """Calculate the filename stem for a URL and its query parameters"""
+        raw = json.dumps([url, sorted(params.items())])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        """Return the metadata and body filepaths of a cache key"""
+        stem = os.path.join(self.directory, key)
+        return f"{stem}.json", f"{stem}.gz"
+
+    def _write_atomic(self, path, data):
+        """Write bytes to a file so that concurrent readers never see a partial
+        file"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load_metadata(self, key):
+        meta_path, _ = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def validators(self, url, params={}):
+        """Return the conditional request headers for a cached URL
+
+        Args:
+            url (str): The URL of the request
+            params (dict, optional): The query parameters of the request.
+                Defaults to an empty dict.
+
+        Returns:
+            headers (dict): The If-None-Match and/or If-Modified-Since headers to
+                send. Empty if there is no usable cache entry.
+        """
+        meta = self._load_metadata(self._key(url, params))
+        if meta is None or (time.time() - meta["stored_at"]) > self.max_age:
+            return {}
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load(self, url, params={}):
+        """Read the body of a cached response from disk
+
+        Args:
+            url (str): The URL of the request
+            params (dict, optional): The query parameters of the request.
+                Defaults to an empty dict.
+
+        Returns:
+            body (bytes): The decompressed body of the cached response, or None if
+                the URL is not cached
+            encoding (str): The text encoding of the cached response
+        """
+        key = self._key(url, params)
+        meta = self._load_metadata(key)
+        _, body_path = self._paths(key)
+        try:
+            with gzip.open(body_path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None, None
+
+        return body, (meta or {}).get("encoding")
+
+    def open(self, url, params={}):
+        """Open the body of a cached response for reading in chunks, without
+        decompressing it all into memory
+
+        Args:
+            url (str): The URL of the request
+            params (dict, optional): The query parameters of the request.
+                Defaults to an empty dict.
+
+        Returns:
+            body (file-like): A binary file object of the decompressed body, or
+                None if the URL is not cached
+        """
+        _, body_path = self._paths(self._key(url, params))
+        try:
+            return gzip.open(body_path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def store(self, url, resp, params={}):
+        """Store a response on disk if it carries an ETag or Last-Modified
+        validator
+
+        Args:
+            url (str): The URL of the request
+            resp (requests.Response): The response to store
+            params (dict, optional): The query parameters of the request.
+                Defaults to an empty dict.
+        """
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return
+
+        key = self._key(url, params)
+        meta_path, body_path = self._paths(key)
+        body = gzip.compress(resp.content)
+        meta = self._metadata(url, resp, len(body))
+
+        with self._lock:
+            self._write_atomic(body_path, body)
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+            self.evict()
+
+    def store_stream(self, url, resp, chunks, params={}):
+        """Store a streamed response on disk as it is read, if it carries an ETag
+        or Last-Modified validator. The entry is only written once every chunk
+        has been read.
+
+        Args:
+            url (str): The URL of the request
+            resp (requests.Response): The response to store
+            chunks (iterator): The chunks of the response's body
+            params (dict, optional): The query parameters of the request.
+                Defaults to an empty dict.
+
+        Yields:
+            chunk (bytes): Each chunk of the body, once it has been written
+        """
+        if not (resp.headers.get("ETag") or resp.headers.get("Last-Modified")):
+            yield from chunks
+            return
+
+        key = self._key(url, params)
+        meta_path, body_path = self._paths(key)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                    for chunk in chunks:
+                        gz.write(chunk)
+                        yield chunk
+                size = f.tell()
+
+            meta = self._metadata(url, resp, size)
+            with self._lock:
+                os.replace(tmp_path, body_path)
+                self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+                self.evict()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _metadata(self, url, resp, size):
+        """Describe a stored response whose compressed body is size bytes"""
+        return {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "encoding": resp.encoding,
+            "stored_at": time.time(),
+            "size": size,
+        }
+
+    def evict(self):
+        """Remove entries older than max_age, then the least recently stored
+        entries until the cache is no larger than max_size
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            key = filename[: -len(".json")]
+            meta = self._load_metadata(key)
+            if meta is None:
+                continue
+            entries.append((meta["stored_at"], meta["size"], key))
+
+        now = time.time()
+        total_size = 0
+        for stored_at, size, key in sorted(entries, reverse=True):
+            if (now - stored_at) > self.max_age or (total_size + size) > self.max_size:
+                logger.debug("Evicting cached response: {}", key)
+                self._remove(key)
+            else:
+                total_size += size
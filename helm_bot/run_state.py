@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from loguru import logger
+
+from .http_requests import NON_ASCII_BYTES, get_client, get_request
+from .oci_registry import registry
+
+# Bump when the layout of the state files changes, so that old files are ignored
+FORMAT_VERSION = 1
+
+
+def config_digest(inputs):
+    """Hash the inputs that decide the outcome of a run, besides the chart and the
+    indexes themselves, so that a state recorded with other inputs is not used
+
+    Args:
+        inputs (UpdateHelmDeps): The inputs of the run
+
+    Returns:
+        (str): The hex SHA-256 digest of the inputs
+    """
+    raw = json.dumps(
+        [FORMAT_VERSION, inputs.chart_urls, inputs.version_constraints],
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def tags_digest(tags):
+    """Hash the tags of a chart stored in an OCI registry, in any order"""
+    raw = json.dumps(sorted(tags))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def index_fingerprint(cache, chart_url, index):
+    """Fingerprint a downloaded index. The ETag and Last-Modified validators the
+    response cache holds for it are preferred, since they can be checked with a
+    conditional request that transfers no body. Otherwise, the hash of its
+    contents is used.
+
+    Args:
+        cache (ResponseCache): The response cache the index was downloaded with
+        chart_url (str): The URL of the index
+        index (SpooledBody): The downloaded contents of the index
+
+    Returns:
+        fingerprint (dict): Either the validators of the index, or its digest
+    """
+    validators = cache.validators(chart_url)
+    if validators:
+        return {"validators": validators}
+    return {"digest": index.digest().hex()}
+
+
+class RunState:
+    """A persistent record of the outcome of the last run for each helm chart. When
+    a run finds that nothing needs updating, the blob SHA of the chart on the base
+    branch, a fingerprint of every index its dependencies are hosted in, and the
+    versions resolved from them are stored. The next run checks the fingerprints
+    with cheap conditional requests first and, if nothing has changed, stops
+    before listing Pull Requests or downloading and parsing any index.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The directory to store the state files in. It will be
+                created if it does not exist.
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, inputs):
+        """Return the filepath of the state of a helm chart"""
+        raw = json.dumps([inputs.repository, inputs.chart_path, inputs.base_branch])
+        key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, inputs):
+        """Read the state recorded by the last run of a helm chart
+
+        Args:
+            inputs (UpdateHelmDeps): The inputs of the run
+
+        Returns:
+            state (dict): The recorded state, or None if there is none or it was
+                recorded with other inputs
+        """
+        try:
+            with open(self._path(inputs)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if state.get("config") != config_digest(inputs):
+            return None
+        return state
+
+    def store(self, inputs, chart_sha, indexes, versions):
+        """Record the state of a run that found nothing to update
+
+        Args:
+            inputs (UpdateHelmDeps): The inputs of the run
+            chart_sha (str): The blob SHA of the chart on the base branch
+            indexes (dict): A mapping of each index URL, or oci:// reference, to
+                its fingerprint
+            versions (dict): A mapping of each dependency to its resolved version
+        """
+        state = {
+            "config": config_digest(inputs),
+            "chart_sha": chart_sha,
+            "indexes": indexes,
+            "versions": versions,
+        }
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._path(inputs))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def remove(self, inputs):
+        """Forget the state of a helm chart, so that its next run is a full run"""
+        try:
+            os.remove(self._path(inputs))
+        except FileNotFoundError:
+            pass
+
+
+def chart_unchanged(inputs, chart_sha):
+    """Check whether the chart on the base branch still has the recorded blob SHA.
+    The request is made conditional through the response cache, so that an
+    unchanged chart is answered with a 304 Not Modified, which GitHub does not
+    count against the rate limit.
+
+    Args:
+        inputs (UpdateHelmDeps): The inputs of the run
+        chart_sha (str): The recorded blob SHA of the chart
+
+    Returns:
+        (bool): True if the chart is unchanged
+    """
+    url = "/".join(
+        [
+            inputs.github_api_url,
+            "repos",
+            inputs.repository,
+            "contents",
+            inputs.chart_path,
+        ]
+    )
+    resp = get_request(
+        url,
+        headers=inputs.headers,
+        params={"ref": inputs.base_branch},
+        output="json",
+        cache=inputs.cache,
+    )
+    return resp["sha"] == chart_sha
+
+
+def index_unchanged(chart_url, fingerprint, headers={}):
+    """Check whether an index, or the tags of a chart in an OCI registry, still
+    match their recorded fingerprint
+
+    Args:
+        chart_url (str): The URL of the index, or the oci:// reference of the
+            chart
+        fingerprint (dict): The recorded fingerprint
+        headers (dict, optional): The headers to send with the request. Defaults
+            to an empty dict.
+
+    Returns:
+        (bool): True if the index is unchanged
+    """
+    if chart_url.startswith("oci://"):
+        return tags_digest(registry.list_tags(chart_url)) == fingerprint.get("digest")
+
+    if "validators" in fingerprint:
+        resp = get_client().request(
+            "GET",
+            chart_url,
+            headers={**headers, **fingerprint["validators"]},
+            stream=True,
+        )
+        # Only the status is needed, so the body of a changed index is not read
+        resp.close()
+        return resp.status_code == 304
+
+    # Hash the index as HelmChartVersionPuller does, without non-ascii bytes
+    digest = hashlib.sha256()
+    for chunk in get_request(chart_url, headers=headers, output="stream"):
+        digest.update(chunk.translate(None, NON_ASCII_BYTES))
+    return digest.hexdigest() == fingerprint.get("digest")
+
+
+def unchanged_versions(inputs):
+    """Check the fingerprints recorded by the last run of a helm chart. Every
+    check is a single conditional request where possible, and they stop at the
+    first change found.
+
+    Args:
+        inputs (UpdateHelmDeps): The inputs of the run, with a run_state
+
+    Returns:
+        versions (dict): The versions resolved by the last run if nothing has
+            changed since, otherwise None
+    """
+    state = inputs.run_state.load(inputs)
+    if state is None:
+        return None
+
+    if not chart_unchanged(inputs, state["chart_sha"]):
+        logger.info("{} has changed since the last run", inputs.chart_path)
+        return None
+
+    for chart_url, fingerprint in state["indexes"].items():
+        if not index_unchanged(chart_url, fingerprint, headers=inputs.headers):
+            logger.info("{} has changed since the last run", chart_url)
+            return None
+
+    return state["versions"]
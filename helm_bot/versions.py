@@ -0,0 +1,319 @@
+import re
+from functools import lru_cache
+
+SEMVER_REGEX = re.compile(
+    r"^v?(?P<major>\d+)(?:\.(?P<minor>\d+))?(?:\.(?P<patch>\d+))?"
+    r"(?:-(?P<prerelease>[0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$"
+)
+COMPARATOR_REGEX = re.compile(r"^(?P<op>>=|<=|!=|>|<|=|\^|~)?\s*(?P<version>.+)$")
+
+# A release sorts after any prerelease of the same major.minor.patch
+RELEASE = (1,)
+
+# The number of parsed versions to cache. This bounds the memory the cache holds
+# in long runs over many indexes, while covering the versions of any one index.
+PARSE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_version(version):
+    """Parse a semantic version into a compact tuple that sorts by precedence.
+    Missing minor and patch numbers are taken to be 0, a leading 'v' is allowed
+    and build metadata is ignored. The most recently used results are cached, so
+    versions seen repeatedly in a run are only parsed once.
+
+    Args:
+        version (str): The version to parse, e.g. '1.2.3-rc.1'
+
+    Returns:
+        (tuple): A (major, minor, patch, prerelease) tuple, or None if the
+            version is not a semantic version. prerelease is RELEASE for
+            releases, or a tuple of (0, identifiers...) for prereleases.
+    """
+    match = SEMVER_REGEX.match(str(version).strip())
+    if match is None:
+        return None
+
+    prerelease = RELEASE
+    if match.group("prerelease"):
+        # Numeric identifiers sort numerically, and before alphanumeric ones
+        prerelease = (0,) + tuple(
+            (0, int(part), "") if part.isdigit() else (1, 0, part)
+            for part in match.group("prerelease").split(".")
+        )
+
+    return (
+        int(match.group("major")),
+        int(match.group("minor") or 0),
+        int(match.group("patch") or 0),
+        prerelease,
+    )
+
+
+def is_prerelease(parsed):
+    """Check whether a parsed version is a prerelease"""
+    return parsed[3] != RELEASE
+
+
+def _comparator(op, version):
+    """Build a predicate for a single range comparator such as '>=1.2.0'
+
+    Args:
+        op (str): The comparison operator, or None for an exact match
+        version (str): The version to compare against. May contain wildcards,
+            e.g. '1.x' or '1.2.*'.
+
+    Returns:
+        (list): A list of predicates taking a parsed version
+    """
+    # Only the numbers before any prerelease or build metadata can be wildcards,
+    # since prerelease identifiers, e.g. 'rc.1', are dot-separated too
+    parts = re.split(r"[-+]", version, maxsplit=1)[0].split(".")
+    wildcards = ("x", "X", "*")
+    if parts[0] in wildcards:
+        return [lambda v: True]
+
+    # Count the explicitly given numbers of a partial or wildcard version
+    given = 0
+    for part in parts[:3]:
+        if part in wildcards:
+            break
+        given += 1
+    bound = parse_version(".".join(parts[:given]) if given < len(parts) else version)
+    if bound is None:
+        raise ValueError(f"Invalid version in range: {version}")
+    major, minor, patch, _ = bound
+
+    def next_version(position):
+        """The lowest prerelease of the version after bumping a number"""
+        bumped = [major, minor, patch]
+        bumped[position] += 1
+        bumped[position + 1 :] = [0] * (2 - position)
+        return (*bumped, (0,))
+
+    if op == "^":
+        # Allow changes that do not modify the left-most non-zero number
+        position = (
+            0 if major > 0 or given == 1 else (1 if minor > 0 or given == 2 else 2)
+        )
+        upper = next_version(position)
+        return [lambda v: v >= bound, lambda v: v < upper]
+    if op == "~":
+        # Allow patch-level changes, or minor-level changes if only a major
+        # version is given
+        upper = next_version(0 if given == 1 else 1)
+        return [lambda v: v >= bound, lambda v: v < upper]
+    if given < 3 and op in (None, "="):
+        # A partial version matches every version it is a prefix of
+        upper = next_version(given - 1)
+        return [lambda v: v >= bound[:3] + ((0,),), lambda v: v < upper]
+
+    return {
+        None: [lambda v: v == bound],
+        "=": [lambda v: v == bound],
+        "!=": [lambda v: v != bound],
+        ">": [lambda v: v > bound],
+        ">=": [lambda v: v >= bound],
+        "<": [lambda v: v < bound],
+        "<=": [lambda v: v <= bound],
+    }[op]
+
+
+def parse_range(version_range):
+    """Parse a semantic version range, such as '>=1.2.0 <2.0.0', '^1.2',
+    '~1.2.3', '1.x' or '>=1.0.0, <1.5.0 || >=2.0.0'. Comparators separated by
+    spaces or commas must all match, and alternatives are separated by '||'.
+
+    Args:
+        version_range (str): The range to parse
+
+    Returns:
+        (callable): A predicate taking a parsed version, and returning True if
+            the version satisfies the range
+    """
+    alternatives = []
+    for alternative in version_range.split("||"):
+        predicates = []
+        # Allow a space between an operator and its version, e.g. '>= 1.0.0'
+        alternative = re.sub(r"(>=|<=|!=|>|<|=|\^|~)\s+", r"\1", alternative)
+        for comparator in re.split(r"[\s,]+", alternative.strip()):
+            if not comparator:
+                continue
+            match = COMPARATOR_REGEX.match(comparator)
+            predicates.extend(_comparator(match.group("op"), match.group("version")))
+        alternatives.append(predicates)
+
+    return lambda v: any(
+        all(predicate(v) for predicate in predicates) for predicates in alternatives
+    )
+
+
+def resolve_latest(versions, current=None, constraint={}):
+    """Find the highest version satisfying a constraint in a single pass
+
+    Args:
+        versions (iterable): The published versions to choose from
+        current (str, optional): The version currently in use. Defaults to None.
+        constraint (dict, optional): Restrictions on the versions to choose from.
+            Defaults to an empty dict. Accepted keys are:
+              - 'range' (str): a semantic version range, see parse_range
+              - 'major' (bool): only choose versions with the same major
+                version as current
+              - 'prereleases' (bool): allow prereleases. Defaults to True only
+                if current is itself a prerelease.
+
+    Returns:
+        latest (str): The highest version satisfying the constraint, or None if
+            no version is a semantic version satisfying the constraint
+    """
+    parsed_current = parse_version(current) if current is not None else None
+
+    in_range = None
+    if constraint.get("range"):
+        in_range = parse_range(constraint["range"])
+
+    same_major = None
+    if constraint.get("major") and parsed_current is not None:
+        same_major = parsed_current[0]
+
+    prereleases = constraint.get("prereleases")
+    if prereleases is None:
+        prereleases = parsed_current is not None and is_prerelease(parsed_current)
+
+    latest, latest_parsed = None, None
+    for version in versions:
+        parsed = parse_version(version)
+        if parsed is None:
+            continue
+        if not prereleases and is_prerelease(parsed):
+            continue
+        if same_major is not None and parsed[0] != same_major:
+            continue
+        if in_range is not None and not in_range(parsed):
+            continue
+        if latest_parsed is None or parsed > latest_parsed:
+            latest, latest_parsed = version, parsed
+
+    return latest
+
+
+class ChartVersion:
+    """The current and latest versions of a single helm chart dependency. The
+    parsed form of each version is kept alongside it, so that comparing them does
+    not parse them again. The versions can also be read and set as the 'current'
+    and 'latest' items, as with the dicts that used to hold them.
+    """
+
+    __slots__ = ("name", "source", "_current", "_latest", "current_key", "latest_key")
+
+    def __init__(self, name, current, latest=None, source=None):
+        """
+        Args:
+            name (str): The name of the dependency
+            current (str): The version currently in use
+            latest (str, optional): The latest version available. Defaults to
+                None, until it has been resolved.
+            source (str, optional): The URL of the index, or the oci:// URL of the
+                repository, the dependency is published to. Defaults to None.
+        """
+        self.name = name
+        self.source = source
+        self.current = current
+        self.latest = latest
+
+    @property
+    def current(self):
+        return self._current
+
+    @current.setter
+    def current(self, version):
+        self._current = version
+        self.current_key = parse_version(version) if version is not None else None
+
+    @property
+    def latest(self):
+        return self._latest
+
+    @latest.setter
+    def latest(self, version):
+        self._latest = version
+        self.latest_key = parse_version(version) if version is not None else None
+
+    def is_newer(self):
+        """Check whether the latest version should replace the current one. If
+        either version is not a semantic version, any difference counts as newer.
+        A latest version that was never resolved, e.g. for a dependency hosted at
+        an unsupported kind of URL, never does."""
+        if self._latest is None:
+            return False
+        if self.latest_key is None or self.current_key is None:
+            return self._latest != self._current
+        return self.latest_key > self.current_key
+
+    def to_dict(self):
+        """Return the versions as a {'current': ..., 'latest': ...} dict. latest
+        is left out until it has been resolved."""
+        versions = {"current": self._current}
+        if self._latest is not None:
+            versions["latest"] = self._latest
+        return versions
+
+    def __getitem__(self, key):
+        if key not in ("current", "latest"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, version):
+        if key not in ("current", "latest"):
+            raise KeyError(key)
+        setattr(self, key, version)
+
+    def __eq__(self, other):
+        if isinstance(other, ChartVersion):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ChartVersion({self.name!r}, {self._current!r}, {self._latest!r})"
+
+
+class ChartVersions(dict):
+    """A mapping of the name of each helm chart dependency to its ChartVersion.
+    Plain {'current': ..., 'latest': ...} dicts set as items are converted to
+    ChartVersion's.
+    """
+
+    def __init__(self, versions={}):
+        """
+        Args:
+            versions (dict, optional): A mapping of dependency name to its
+                ChartVersion, or to a dict of its versions. Defaults to an empty
+                dict.
+        """
+        super().__init__()
+        for name, version in versions.items():
+            self[name] = version
+
+    def __setitem__(self, name, version):
+        if not isinstance(version, ChartVersion):
+            version = ChartVersion(name, version["current"], version.get("latest"))
+        super().__setitem__(name, version)
+
+    def outdated(self):
+        """List the dependencies whose latest version is newer than their current
+        one, in order. Dependencies whose latest version was never resolved are
+        left out.
+
+        Returns:
+            (list): The names of the dependencies to update
+        """
+        return [name for (name, version) in self.items() if version.is_newer()]
+
+    def to_dict(self):
+        """Return the versions as a dict of {'current': ..., 'latest': ...}
+        dicts"""
+        return {name: version.to_dict() for (name, version) in self.items()}
@@ -1,6 +1,7 @@
+import threading
 from io import StringIO
 
-import ruamel.yaml
+from .instrumentation import instrumented
 
 
 def represent_none(self, data):
@@ -8,21 +9,85 @@ def represent_none(self, data):
 
 
 class YamlParser:
-    def __init__(self):
-        self.yaml = ruamel.yaml.YAML()
-        self.yaml.indent(mapping=2, sequence=4, offset=2)
-        self.yaml.allow_duplicate_keys = True
-        self.yaml.explicit_start = False
-        self.yaml.preserve_quotes = True
-        self.yaml.representer.add_representer(type(None), represent_none)
+    def __init__(self, fast=False):
+        """
+        Args:
+            fast (bool, optional): Use the read-only fast mode. Documents are
+                loaded with the safe loader, which uses the C-based LibYAML
+                bindings of ruamel.yaml.clib when they are installed and a
+                pure-Python fallback otherwise. Comments, quotes and formatting
+                are not preserved, so documents loaded this way should not be
+                written back. Defaults to False, which uses round-trip mode.
+        """
+        self.fast = fast
+        self._local = threading.local()
+        self._yaml = None
 
+        # A ruamel.yaml.YAML instance is not safe to use from several threads at
+        # once, which happens when several charts are processed concurrently
+        self._lock = threading.Lock()
+
+    @property
+    def yaml(self):
+        """The round-trip ruamel.yaml.YAML instance. It is only built the first
+        time it is used, so that module-level YamlParser's cost nothing at import
+        time. Must be accessed while holding the lock."""
+        if self._yaml is None:
+            # ruamel.yaml is only imported once YAML is first handled, so that
+            # runs that handle none, e.g. ones finding nothing has changed, skip it
+            import ruamel.yaml
+
+            yaml = ruamel.yaml.YAML()
+            yaml.indent(mapping=2, sequence=4, offset=2)
+            yaml.allow_duplicate_keys = True
+            yaml.explicit_start = False
+            yaml.preserve_quotes = True
+            yaml.representer.add_representer(type(None), represent_none)
+            self._yaml = yaml
+        return self._yaml
+
+    def _fast_yaml(self):
+        """Return the safe loader of the current thread. Each thread has its own
+        so that indexes can be read concurrently without taking the lock."""
+        if not hasattr(self._local, "yaml"):
+            import ruamel.yaml
+
+            self._local.yaml = ruamel.yaml.YAML(typ="safe")
+            self._local.yaml.allow_duplicate_keys = True
+        return self._local.yaml
+
+    @instrumented("yaml_dump")
     def object_to_yaml_str(self, obj, options={}):
+        if self.fast:
+            raise TypeError("YamlParser in fast mode is read-only")
+
         string_stream = StringIO()
-        self.yaml.dump(obj, string_stream, **options)
+        with self._lock:
+            self.yaml.dump(obj, string_stream, **options)
         output_str = string_stream.getvalue()
         string_stream.close()
 
         return output_str
 
+    @instrumented("yaml_load")
     def yaml_string_to_object(self, string, options={}):
-        return self.yaml.load(string, **options)
+        if self.fast:
+            return self._fast_yaml().load(string, **options)
+
+        with self._lock:
+            return self.yaml.load(string, **options)
+
+    def parse_events(self, stream):
+        """Parse a YAML document into a stream of events, without constructing
+        any nodes. Only available in fast mode.
+
+        Args:
+            stream (str or file-like): The YAML document
+
+        Returns:
+            events (generator): The parser's events
+        """
+        if not self.fast:
+            raise TypeError("Only a YamlParser in fast mode can parse events")
+
+        return self._fast_yaml().parse(stream)
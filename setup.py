@@ -109,7 +109,10 @@ setup(
         )
     ),
     entry_points={
-        "console_scripts": ["helm-bot=helm_bot.main:main"],
+        "console_scripts": [
+            "helm-bot=helm_bot.main:main",
+            "helm-bot-org=helm_bot.org_scan:main",
+        ],
     },
     install_requires=REQUIRED,
     extras_require=EXTRAS,
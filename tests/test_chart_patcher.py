@@ -0,0 +1,65 @@
+import pytest
+
+from helm_bot.chart_patcher import ChartPatcher
+
+test_chart_yaml = """\
+# An umbrella chart ünïcode
+name: "test-chart"
+version: 0.0.0
+dependencies:
+  - name: binderhub
+    version: "0.2.0-n960.h47d7917"   # pinned by CI
+    repository: https://jupyterhub.github.io/helm-chart/
+  - {name: grafana, version: 6.11.0, repository: "https://grafana.github.io"}
+  - name: prometheus
+    repository: https://prometheus-community.github.io/helm-charts
+    version: '15.10.1'
+    tags: [monitoring]
+  - name: binderhub
+    alias: second-binderhub
+    version: 0.1.0
+"""
+
+
+def test_record_spans():
+    patcher = ChartPatcher(test_chart_yaml)
+
+    assert set(patcher.spans.keys()) == {"binderhub", "grafana", "prometheus"}
+    start, end, _ = patcher.spans["binderhub"]
+    assert test_chart_yaml[start:end] == '"0.2.0-n960.h47d7917"'
+
+
+def test_patch():
+    patcher = ChartPatcher(test_chart_yaml)
+
+    result = patcher.patch(
+        {"binderhub": "1.0.0-0.dev", "grafana": "6.12.0", "prometheus": "15.11.0"}
+    )
+
+    assert result == (
+        test_chart_yaml.replace('"0.2.0-n960.h47d7917"', '"1.0.0-0.dev"')
+        .replace("version: 6.11.0", "version: 6.12.0")
+        .replace("'15.10.1'", "'15.11.0'")
+    )
+
+
+def test_patch_quotes_plain_non_strings():
+    patcher = ChartPatcher(test_chart_yaml)
+
+    result = patcher.patch({"grafana": "6.10"})
+
+    assert 'version: "6.10"' in result
+
+
+def test_patch_missing_dependency():
+    patcher = ChartPatcher(test_chart_yaml)
+
+    with pytest.raises(ValueError):
+        patcher.patch({"missing": "1.0.0"})
+
+
+def test_patch_no_dependencies():
+    patcher = ChartPatcher("name: test-chart\n")
+
+    assert patcher.spans == {}
+    assert patcher.patch({}) == "name: test-chart\n"
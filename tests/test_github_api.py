@@ -1,12 +1,15 @@
-import base64
+import asyncio
 import unittest
 from unittest.mock import call, patch
 
-from helm_bot.github_api import GitHubAPI
+from helm_bot.github_api import (
+    FIND_PULL_REQUESTS_QUERY,
+    GET_FILE_QUERY,
+    GET_TREE_MODES_QUERY,
+    AsyncGitHubAPI,
+    GitHubAPI,
+)
 from helm_bot.main import UpdateHelmDeps
-from helm_bot.yaml_parser import YamlParser
-
-yaml = YamlParser()
 
 
 class TestGitHubAPI(unittest.TestCase):
@@ -21,7 +24,7 @@ class TestGitHubAPI(unittest.TestCase):
         github = GitHubAPI(helm_deps)
         pr_url = "/".join([github.api_url, "issues", "1"])
 
-        with patch("helm_bot.github_api.post_request") as mock:
+        with patch("helm_bot.github_api.async_post_request") as mock:
             github._assign_labels(pr_url)
 
             self.assertEqual(mock.call_count, 1)
@@ -42,7 +45,7 @@ class TestGitHubAPI(unittest.TestCase):
         github = GitHubAPI(helm_deps)
         pr_url = "/".join([github.api_url, "pull", "1"])
 
-        with patch("helm_bot.github_api.post_request") as mock:
+        with patch("helm_bot.github_api.async_post_request") as mock:
             github._assign_reviewers(pr_url)
 
             self.assertEqual(mock.call_count, 1)
@@ -63,7 +66,7 @@ class TestGitHubAPI(unittest.TestCase):
         github = GitHubAPI(helm_deps)
         pr_url = "/".join([github.api_url, "pull", "1"])
 
-        with patch("helm_bot.github_api.post_request") as mock:
+        with patch("helm_bot.github_api.async_post_request") as mock:
             github._assign_reviewers(pr_url)
 
             self.assertEqual(mock.call_count, 1)
@@ -73,7 +76,7 @@ class TestGitHubAPI(unittest.TestCase):
                 json={"team_reviewers": helm_deps.team_reviewers},
             )
 
-    def test_create_commit(self):
+    def test_create_tree_commit(self):
         helm_deps = UpdateHelmDeps(
             "octocat/octocat",
             "ThIs_Is_A_t0k3n",
@@ -81,35 +84,109 @@ class TestGitHubAPI(unittest.TestCase):
             {"some_chart": "https://some-chart.com"},
         )
         github = GitHubAPI(helm_deps)
-
-        helm_deps.sha = "test_sha"
         commit_msg = "This is a commit message"
-        contents = {"key1": "This is a test"}
-
-        contents = yaml.object_to_yaml_str(contents).encode("utf-8")
-        contents = base64.b64encode(contents)
-        contents = contents.decode("utf-8")
+        files = {
+            "chart-name/Chart.yaml": "key1: This is a test\n",
+            "chart-name/values.yaml": "key2: This is a test\n",
+        }
 
-        body = {
-            "message": commit_msg,
-            "content": contents,
-            "sha": helm_deps.sha,
-            "branch": helm_deps.head_branch,
+        mock_get = patch(
+            "helm_bot.github_api.async_get_request",
+            side_effect=[
+                {"object": {"sha": "parent_sha"}},
+                {"tree": {"sha": "base_tree_sha"}},
+            ],
+        )
+        tree_modes = {
+            "data": {
+                "repository": {
+                    "object": {
+                        "entries": [
+                            # 0o100755, an executable file
+                            {"name": "Chart.yaml", "mode": 33261},
+                            {"name": "templates", "mode": 16384},
+                        ]
+                    }
+                }
+            }
         }
+        mock_post = patch(
+            "helm_bot.github_api.async_post_request",
+            side_effect=[tree_modes, {"sha": "tree_sha"}, {"sha": "commit_sha"}],
+        )
+        mock_patch = patch("helm_bot.github_api.async_patch_request")
 
-        with patch("helm_bot.github_api.put") as mock:
-            github.create_commit(
-                commit_msg,
-                contents,
-            )
+        with mock_get as mock_g, mock_post as mock_po, mock_patch as mock_pa:
+            result = github.create_tree_commit(commit_msg, files)
 
-            self.assertEqual(mock.call_count, 1)
-            mock.assert_called_with(
-                "/".join([github.api_url, "contents", helm_deps.chart_path]),
-                json=body,
+            self.assertEqual(mock_g.call_count, 2)
+            self.assertEqual(mock_po.call_count, 3)
+            self.assertEqual(mock_pa.call_count, 1)
+            mock_g.assert_called_with(
+                "/".join([github.api_url, "git", "commits", "parent_sha"]),
+                headers=helm_deps.headers,
+                output="json",
+            )
+            mock_po.assert_has_calls(
+                [
+                    call(
+                        github.graphql_url,
+                        headers=helm_deps.headers,
+                        json={
+                            "query": GET_TREE_MODES_QUERY,
+                            "variables": {
+                                "owner": "octocat",
+                                "name": "octocat",
+                                "expression": "parent_sha:chart-name",
+                            },
+                        },
+                        return_json=True,
+                    ),
+                    call(
+                        "/".join([github.api_url, "git", "trees"]),
+                        headers=helm_deps.headers,
+                        json={
+                            "base_tree": "base_tree_sha",
+                            # The modes of the existing files are kept
+                            "tree": [
+                                {
+                                    "path": "chart-name/Chart.yaml",
+                                    "mode": "100755",
+                                    "type": "blob",
+                                    "content": files["chart-name/Chart.yaml"],
+                                },
+                                {
+                                    "path": "chart-name/values.yaml",
+                                    "mode": "100644",
+                                    "type": "blob",
+                                    "content": files["chart-name/values.yaml"],
+                                },
+                            ],
+                        },
+                        return_json=True,
+                    ),
+                    call(
+                        "/".join([github.api_url, "git", "commits"]),
+                        headers=helm_deps.headers,
+                        json={
+                            "message": commit_msg,
+                            "tree": "tree_sha",
+                            "parents": ["parent_sha"],
+                        },
+                        return_json=True,
+                    ),
+                ]
+            )
+            mock_pa.assert_called_with(
+                "/".join(
+                    [github.api_url, "git", "refs", "heads", helm_deps.head_branch]
+                ),
                 headers=helm_deps.headers,
+                json={"sha": "commit_sha"},
             )
 
+        self.assertEqual(result, "commit_sha")
+
     def test_create_update_pull_request_no_labels_no_reviewers(self):
         helm_deps = UpdateHelmDeps(
             "octocat/octocat",
@@ -142,7 +219,7 @@ class TestGitHubAPI(unittest.TestCase):
             "head": helm_deps.head_branch,
         }
 
-        with patch("helm_bot.github_api.post_request") as mock:
+        with patch("helm_bot.github_api.async_post_request") as mock:
             github.create_update_pull_request()
 
             self.assertEqual(mock.call_count, 1)
@@ -187,7 +264,7 @@ class TestGitHubAPI(unittest.TestCase):
         }
 
         mock_post = patch(
-            "helm_bot.github_api.post_request",
+            "helm_bot.github_api.async_post_request",
             return_value={
                 "issue_url": "/".join([github.api_url, "issues", "1"]),
                 "number": 1,
@@ -255,7 +332,7 @@ class TestGitHubAPI(unittest.TestCase):
         }
 
         mock_post = patch(
-            "helm_bot.github_api.post_request",
+            "helm_bot.github_api.async_post_request",
             return_value={
                 "url": "/".join([github.api_url, "pulls", "1"]),
                 "number": 1,
@@ -324,7 +401,7 @@ class TestGitHubAPI(unittest.TestCase):
         }
 
         mock_post = patch(
-            "helm_bot.github_api.post_request",
+            "helm_bot.github_api.async_post_request",
             return_value={
                 "issue_url": "/".join([github.api_url, "issues", "1"]),
                 "url": "/".join([github.api_url, "pulls", "1"]),
@@ -365,6 +442,49 @@ class TestGitHubAPI(unittest.TestCase):
             )
             mock.assert_has_calls(calls)
 
+    def test_create_update_pull_request_assigns_concurrently(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+            labels=["label1", "label2"],
+            reviewers=["reviewer1", "reviewer2"],
+        )
+        github = AsyncGitHubAPI(helm_deps)
+        github.pr_exists = False
+        helm_deps.chart_versions = {
+            "chart1": {"current": "1.2.3", "latest": "7.8.9"},
+        }
+        helm_deps.charts_to_update = ["chart1"]
+
+        pending = []
+
+        async def fake_post(url, **kwargs):
+            if kwargs.get("return_json"):
+                return {
+                    "issue_url": "/".join([github.api_url, "issues", "1"]),
+                    "url": "/".join([github.api_url, "pulls", "1"]),
+                    "number": 1,
+                }
+            # Neither follow-up request completes until both have been sent
+            pending.append(url)
+            while len(pending) < 2:
+                await asyncio.sleep(0)
+
+        with patch("helm_bot.github_api.async_post_request", side_effect=fake_post):
+            asyncio.run(
+                asyncio.wait_for(github.create_update_pull_request(), timeout=1)
+            )
+
+        self.assertCountEqual(
+            pending,
+            [
+                "/".join([github.api_url, "issues", "1", "labels"]),
+                "/".join([github.api_url, "pulls", "1", "requested_reviewers"]),
+            ],
+        )
+
     def test_create_ref(self):
         helm_deps = UpdateHelmDeps(
             "octocat/octocat",
@@ -378,7 +498,7 @@ class TestGitHubAPI(unittest.TestCase):
 
         test_body = {"ref": f"refs/heads/{test_ref}", "sha": test_sha}
 
-        with patch("helm_bot.github_api.post_request") as mock:
+        with patch("helm_bot.github_api.async_post_request") as mock:
             github.create_ref(test_ref, test_sha)
 
             self.assertEqual(mock.call_count, 1)
@@ -388,7 +508,7 @@ class TestGitHubAPI(unittest.TestCase):
                 json=test_body,
             )
 
-    def test_find_existing_pull_request_no_matches(self):
+    def test_list_files(self):
         helm_deps = UpdateHelmDeps(
             "octocat/octocat",
             "ThIs_Is_A_t0k3n",
@@ -398,25 +518,199 @@ class TestGitHubAPI(unittest.TestCase):
         github = GitHubAPI(helm_deps)
 
         mock_get = patch(
-            "helm_bot.github_api.get_request",
-            return_value=[
+            "helm_bot.github_api.async_get_request",
+            return_value={
+                "tree": [
+                    {"path": "chart-name", "type": "tree"},
+                    {"path": "chart-name/Chart.yaml", "type": "blob"},
+                ]
+            },
+        )
+
+        with mock_get as mock:
+            result = github.list_files("main")
+
+            self.assertEqual(mock.call_count, 1)
+            mock.assert_called_with(
+                "/".join([github.api_url, "git", "trees", "main"]),
+                headers=helm_deps.headers,
+                params={"recursive": "1"},
+                output="json",
+            )
+
+        self.assertEqual(result, ["chart-name/Chart.yaml"])
+
+    def test_list_files_truncated(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        github = GitHubAPI(helm_deps)
+
+        mock_get = patch(
+            "helm_bot.github_api.async_get_request",
+            side_effect=[
+                {"tree": [], "truncated": True},
                 {
-                    "head": {
-                        "label": "some_branch",
-                    }
-                }
+                    "tree": [
+                        {"path": "README.md", "type": "blob", "sha": "a"},
+                        {"path": "charts", "type": "tree", "sha": "b"},
+                    ]
+                },
+                {
+                    "tree": [
+                        {"path": "chart-name", "type": "tree", "sha": "c"},
+                        {"path": "chart-name/Chart.yaml", "type": "blob", "sha": "d"},
+                    ]
+                },
             ],
         )
 
         with mock_get as mock:
+            result = github.list_files("main")
+
+            self.assertEqual(mock.call_count, 3)
+            mock.assert_called_with(
+                "/".join([github.api_url, "git", "trees", "b"]),
+                headers=helm_deps.headers,
+                params={"recursive": "1"},
+                output="json",
+            )
+
+        self.assertEqual(result, ["README.md", "charts/chart-name/Chart.yaml"])
+
+    def test_get_rate_limit(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        github = GitHubAPI(helm_deps)
+        core = {"limit": 5000, "remaining": 4999, "reset": 1700000000}
+
+        mock_get = patch(
+            "helm_bot.github_api.async_get_request",
+            return_value={"resources": {"core": core, "search": {}}},
+        )
+
+        with mock_get as mock:
+            result = github.get_rate_limit()
+
+            mock.assert_called_once_with(
+                "https://api.github.com/rate_limit",
+                headers=helm_deps.headers,
+                output="json",
+            )
+
+        self.assertEqual(result, core)
+
+    def test_get_file(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        github = GitHubAPI(helm_deps)
+
+        mock_post = patch(
+            "helm_bot.github_api.async_post_request",
+            side_effect=[
+                {
+                    "data": {
+                        "repository": {
+                            "object": {
+                                "oid": "123456789",
+                                "text": "hello: world",
+                                "isTruncated": False,
+                            }
+                        }
+                    }
+                },
+                {"data": {"repository": {"object": None}}},
+                {
+                    "data": {
+                        "repository": {
+                            "object": {
+                                "oid": "123456789",
+                                "text": None,
+                                "isTruncated": False,
+                            }
+                        }
+                    }
+                },
+            ],
+        )
+
+        with mock_post as mock:
+            result = github.get_file("chart-name/Chart.yaml", "main")
+
+            mock.assert_called_with(
+                github.graphql_url,
+                headers=helm_deps.headers,
+                json={
+                    "query": GET_FILE_QUERY,
+                    "variables": {
+                        "owner": "octocat",
+                        "name": "octocat",
+                        "expression": "main:chart-name/Chart.yaml",
+                    },
+                },
+                return_json=True,
+            )
+            self.assertEqual(result, ("hello: world", "123456789"))
+
+            self.assertIsNone(github.get_file("missing/Chart.yaml", "main"))
+            self.assertIsNone(github.get_file("binary/Chart.yaml", "main"))
+
+    def test_find_existing_pull_request_no_matches(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        github = GitHubAPI(helm_deps)
+
+        mock_post = patch(
+            "helm_bot.github_api.async_post_request",
+            return_value={
+                "data": {
+                    "repository": {
+                        "refs": {
+                            "pageInfo": {"hasNextPage": False, "endCursor": None},
+                            "nodes": [
+                                {
+                                    "name": "abcd",
+                                    "associatedPullRequests": {"nodes": []},
+                                }
+                            ],
+                        }
+                    }
+                }
+            },
+        )
+
+        with mock_post as mock:
             github.find_existing_pull_request()
 
             self.assertEqual(mock.call_count, 1)
             mock.assert_called_with(
-                "/".join([github.api_url, "pulls"]),
+                github.graphql_url,
                 headers=helm_deps.headers,
-                params={"state": "open", "sort": "created", "direction": "desc"},
-                output="json",
+                json={
+                    "query": FIND_PULL_REQUESTS_QUERY,
+                    "variables": {
+                        "owner": "octocat",
+                        "name": "octocat",
+                        "refPrefix": "refs/heads/bump-helm-deps/chart-name/",
+                        "cursor": None,
+                    },
+                },
+                return_json=True,
             )
             self.assertFalse(github.pr_exists)
             self.assertTrue(
@@ -434,33 +728,69 @@ class TestGitHubAPI(unittest.TestCase):
         )
         github = GitHubAPI(helm_deps)
 
-        mock_get = patch(
-            "helm_bot.github_api.get_request",
-            return_value=[
-                {
-                    "head": {
-                        "label": "bump-helm-deps/chart-name",
-                    },
-                    "number": 1,
+        def page(nodes, has_next_page, end_cursor):
+            return {
+                "data": {
+                    "repository": {
+                        "refs": {
+                            "pageInfo": {
+                                "hasNextPage": has_next_page,
+                                "endCursor": end_cursor,
+                            },
+                            "nodes": [
+                                {
+                                    "name": name,
+                                    "associatedPullRequests": {
+                                        "nodes": [{"number": number}] if number else []
+                                    },
+                                }
+                                for (name, number) in nodes
+                            ],
+                        }
+                    }
                 }
+            }
+
+        mock_post = patch(
+            "helm_bot.github_api.async_post_request",
+            side_effect=[
+                page([("abcd", 1), ("efgh", None)], True, "cursor1"),
+                # The branches of charts in subdirectories are not matched
+                page([("ijkl", 2), ("subchart/mnop", 3)], False, None),
             ],
         )
 
-        with mock_get as mock:
+        with mock_post as mock:
             github.find_existing_pull_request()
 
-            self.assertEqual(mock.call_count, 1)
-            mock.assert_called_with(
-                "/".join([github.api_url, "pulls"]),
-                headers=helm_deps.headers,
-                params={"state": "open", "sort": "created", "direction": "desc"},
-                output="json",
+            self.assertEqual(mock.call_count, 2)
+            self.assertEqual(
+                mock.call_args.kwargs["json"]["variables"]["cursor"], "cursor1"
             )
             self.assertTrue(github.pr_exists)
             self.assertEqual(
-                helm_deps.head_branch, "/".join(["bump-helm-deps", "chart-name"])
+                helm_deps.head_branch,
+                "/".join(["bump-helm-deps", "chart-name", "ijkl"]),
             )
-            self.assertEqual(github.pr_number, 1)
+            self.assertEqual(github.pr_number, 2)
+
+    def test_graphql_errors(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        github = GitHubAPI(helm_deps)
+
+        mock_post = patch(
+            "helm_bot.github_api.async_post_request",
+            return_value={"errors": [{"message": "Something went wrong"}]},
+        )
+
+        with mock_post:
+            with self.assertRaises(RuntimeError):
+                github._graphql("query { viewer { login } }", {})
 
     def test_get_ref(self):
         helm_deps = UpdateHelmDeps(
@@ -473,7 +803,8 @@ class TestGitHubAPI(unittest.TestCase):
         test_ref = "test_ref"
 
         mock_get = patch(
-            "helm_bot.github_api.get_request", return_value={"object": {"sha": "sha"}}
+            "helm_bot.github_api.async_get_request",
+            return_value={"object": {"sha": "sha"}},
         )
 
         with mock_get as mock:
@@ -519,7 +850,7 @@ class TestGitHubAPI(unittest.TestCase):
         }
 
         mock_patch = patch(
-            "helm_bot.github_api.patch_request", return_value={"number": 1}
+            "helm_bot.github_api.async_patch_request", return_value={"number": 1}
         )
 
         with mock_patch as mock:
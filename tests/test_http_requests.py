@@ -1,8 +1,25 @@
+import asyncio
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import pytest
 import requests
 import responses
 
-from helm_bot.http_requests import get_request, patch_request, post_request
+from helm_bot.http_requests import (
+    HTTPClient,
+    SpooledBody,
+    async_get_request,
+    async_post_request,
+    get_client,
+    get_request,
+    patch_request,
+    post_request,
+    put_request,
+    set_client,
+)
+from helm_bot.response_cache import ResponseCache
 
 test_url = "http://jsonplaceholder.typicode.com/"
 test_header = {"Authorization": "token ThIs_Is_A_ToKeN"}
@@ -42,22 +59,126 @@ def test_get_request_text():
     assert resp == '{"Response": "OK"}'
 
 
+@responses.activate
+def test_async_requests_concurrently():
+    responses.add(responses.GET, test_url, json={"Response": "OK"}, status=200)
+    responses.add(responses.POST, test_url, json={"Request": "Sent"}, status=200)
+
+    async def send_requests():
+        return await asyncio.gather(
+            async_get_request(test_url, headers=test_header, output="json"),
+            async_post_request(test_url, json=test_body, return_json=True),
+        )
+
+    result = asyncio.run(send_requests())
+
+    assert result == [{"Response": "OK"}, {"Request": "Sent"}]
+    assert len(responses.calls) == 2
+
+
 def test_get_request_output_exception():
     with pytest.raises(ValueError):
         _ = get_request(test_url, headers=test_header, output="yaml")
 
 
 @responses.activate
-def test_get_request_url_exception():
+def test_get_request_url_exception(monkeypatch):
+    monkeypatch.setattr("helm_bot.http_requests.time.sleep", lambda delay: None)
     responses.add(responses.GET, test_url, status=500)
 
     with pytest.raises(requests.HTTPError):
         _ = get_request(test_url)
 
-    assert len(responses.calls) == 1
+    # GET requests are retried after a server error
+    assert len(responses.calls) == 1 + get_client().scheduler.max_retries
     assert responses.calls[0].request.url == test_url
 
 
+@responses.activate
+def test_get_request_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    responses.add(
+        responses.GET, test_url, body="hello: world", headers={"ETag": '"abc"'}
+    )
+    responses.add(
+        responses.GET,
+        test_url,
+        status=304,
+        match=[responses.matchers.header_matcher({"If-None-Match": '"abc"'})],
+    )
+
+    first = get_request(test_url, output="text", cache=cache)
+    second = get_request(test_url, output="text", cache=cache)
+
+    assert len(responses.calls) == 2
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert responses.calls[1].response.status_code == 304
+    assert first == second == "hello: world"
+
+
+@responses.activate
+def test_get_request_bytes():
+    responses.add(responses.GET, test_url, body=b"hello: world", status=200)
+
+    resp = get_request(test_url, output="bytes")
+
+    assert resp == b"hello: world"
+
+
+@responses.activate
+def test_get_request_stream():
+    responses.add(responses.GET, test_url, body=b"x" * 100_000, status=200)
+
+    chunks = list(get_request(test_url, output="stream"))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == b"x" * 100_000
+    assert "gzip" in responses.calls[0].request.headers["Accept-Encoding"]
+
+
+@responses.activate
+def test_get_request_stream_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    responses.add(
+        responses.GET, test_url, body=b"hello: world", headers={"ETag": '"abc"'}
+    )
+    responses.add(
+        responses.GET,
+        test_url,
+        status=304,
+        match=[responses.matchers.header_matcher({"If-None-Match": '"abc"'})],
+    )
+
+    first = b"".join(get_request(test_url, output="stream", cache=cache))
+    second = b"".join(get_request(test_url, output="stream", cache=cache))
+
+    assert len(responses.calls) == 2
+    assert responses.calls[1].response.status_code == 304
+    assert first == second == b"hello: world"
+
+
+def test_spooled_body(tmp_path):
+    body = SpooledBody(max_memory=16)
+    for chunk in (b"hello: ", b"world\n" * 10):
+        body.write(chunk)
+
+    readers = [body.open(), body.open()]
+
+    assert body.size == 67
+    assert readers[0].read(7) == b"hello: "
+    assert readers[1].read() == b"hello: " + b"world\n" * 10
+    assert readers[0].read(6) == b"world\n"
+    assert body.digest() == hashlib.sha256(b"hello: " + b"world\n" * 10).digest()
+    # The body has been spooled to disk, so it is memory-mapped
+    assert body.view()[:] == b"hello: " + b"world\n" * 10
+
+    body.close()
+
+    small_body = SpooledBody()
+    small_body.write(b"hello: world")
+    assert small_body.view() == b"hello: world"
+
+
 @responses.activate
 def test_post_request():
     responses.add(responses.POST, test_url, json={"Request": "Sent"}, status=200)
@@ -132,3 +253,89 @@ def test_patch_request_exception():
 
     assert len(responses.calls) == 1
     assert responses.calls[0].request.url == test_url
+
+
+@responses.activate
+def test_put_request():
+    responses.add(responses.PUT, test_url, json={"Request": "Sent"}, status=200)
+
+    resp = put_request(test_url, headers=test_header, json=test_body, return_json=True)
+
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.url == test_url
+    assert resp == {"Request": "Sent"}
+
+
+@responses.activate
+def test_put_request_exception(monkeypatch):
+    monkeypatch.setattr("helm_bot.http_requests.time.sleep", lambda delay: None)
+    responses.add(responses.PUT, test_url, status=500)
+
+    with pytest.raises(requests.HTTPError):
+        put_request(test_url, headers=test_header, json=test_body)
+
+    assert len(responses.calls) == 1 + get_client().scheduler.max_retries
+
+
+@responses.activate
+def test_post_request_rate_limited(monkeypatch):
+    # Use a fresh client, so that the rate limit does not hold up other tests
+    monkeypatch.setattr("helm_bot.http_requests._client", HTTPClient())
+    sleeps = []
+    monkeypatch.setattr("helm_bot.http_requests.time.sleep", sleeps.append)
+    responses.add(responses.POST, test_url, status=429, headers={"Retry-After": "3"})
+    responses.add(responses.POST, test_url, json={"Request": "Sent"}, status=200)
+
+    resp = post_request(test_url, json=test_body, return_json=True)
+
+    # POST requests are only retried when a rate limit rejected them
+    assert resp == {"Request": "Sent"}
+    assert len(responses.calls) == 2
+    assert sleeps[0] == 3.0
+
+
+@responses.activate
+def test_post_request_server_error_not_retried():
+    responses.add(responses.POST, test_url, status=502)
+
+    with pytest.raises(requests.HTTPError):
+        post_request(test_url, json=test_body)
+
+    assert len(responses.calls) == 1
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"OK"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_client_reuses_connections():
+    server = HTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    default_client = get_client()
+    client = HTTPClient(headers={"User-Agent": "helm-bot-tests"})
+    set_client(client)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/"
+        for _ in range(3):
+            assert get_request(url, output="text") == "OK"
+    finally:
+        set_client(default_client)
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    assert client.stats.requests == 3
+    assert client.stats.opened == 1
+    assert client.stats.reused == 2
@@ -0,0 +1,47 @@
+from helm_bot.index_cache import IndexCache, content_hash, version_table
+
+test_url = "https://example.com/index.yaml"
+test_releases = {
+    "some-chart": [
+        ("1.1.0", "2021-06-01T00:00:00Z", "def"),
+        ("1.0.0", "2021-01-01T00:00:00Z", None),
+    ],
+    "other-chart": [("9.9.9", "2022-01-01T00:00:00Z", "abc")],
+    "ünïcode-chart": [("0.1.0", None, None)],
+}
+
+
+def test_version_table():
+    assert version_table(test_releases["some-chart"]) == [
+        ("2021-01-01T00:00:00Z", "1.0.0"),
+        ("2021-06-01T00:00:00Z", "1.1.0"),
+    ]
+
+
+def test_store_and_lookup(tmp_path):
+    cache = IndexCache(str(tmp_path))
+    digest = content_hash("entries: {}")
+
+    cache.store(test_url, digest, test_releases)
+    tables = cache.lookup(
+        test_url, digest, ["some-chart", "ünïcode-chart", "missing-chart"]
+    )
+
+    assert tables == {
+        "some-chart": version_table(test_releases["some-chart"]),
+        "ünïcode-chart": [("", "0.1.0")],
+    }
+
+
+def test_lookup_stale(tmp_path):
+    cache = IndexCache(str(tmp_path))
+
+    cache.store(test_url, content_hash("old"), test_releases)
+
+    assert cache.lookup(test_url, content_hash("new"), ["some-chart"]) is None
+
+
+def test_lookup_missing(tmp_path):
+    cache = IndexCache(str(tmp_path))
+
+    assert cache.lookup(test_url, content_hash("new"), ["some-chart"]) is None
@@ -0,0 +1,96 @@
+from io import StringIO
+
+from helm_bot.index_reader import read_charts_releases, scan_entry_offsets
+
+test_index = """
+apiVersion: v1
+entries:
+  other-chart:
+  - version: 9.9.9
+    created: "2022-01-01T00:00:00Z"
+    digest: abc
+    urls:
+    - https://example.com/other-chart-9.9.9.tgz
+  some-chart:
+  - version: 1.0.0
+    created: "2021-01-01T00:00:00Z"
+    digest: def
+    maintainers:
+    - name: octocat
+      email: octocat@example.com
+    urls:
+    - https://example.com/some-chart-1.0.0.tgz
+  - version: 1.1.0
+    created: "2021-06-01T00:00:00Z"
+    annotations:
+      category: Testing
+generated: "2022-01-01T00:00:00Z"
+"""
+
+
+def test_read_chart_releases():
+    releases = read_charts_releases(test_index, ["some-chart"])
+
+    assert releases["some-chart"] == [
+        ("1.0.0", "2021-01-01T00:00:00Z", "def"),
+        ("1.1.0", "2021-06-01T00:00:00Z", None),
+    ]
+
+
+def test_read_chart_releases_stream():
+    releases = read_charts_releases(StringIO(test_index), ["other-chart"])
+
+    assert releases == {"other-chart": [("9.9.9", "2022-01-01T00:00:00Z", "abc")]}
+
+
+def test_read_chart_releases_missing_chart():
+    assert read_charts_releases(test_index, ["missing-chart"]) == {}
+
+
+def test_read_chart_releases_no_entries():
+    assert read_charts_releases("apiVersion: v1\n", ["some-chart"]) == {}
+
+
+def test_read_charts_releases():
+    releases = read_charts_releases(
+        test_index, ["some-chart", "other-chart", "missing-chart"]
+    )
+
+    assert releases == {
+        "other-chart": [("9.9.9", "2022-01-01T00:00:00Z", "abc")],
+        "some-chart": [
+            ("1.0.0", "2021-01-01T00:00:00Z", "def"),
+            ("1.1.0", "2021-06-01T00:00:00Z", None),
+        ],
+    }
+
+
+def test_scan_entry_offsets():
+    buffer = test_index.encode()
+    offsets = scan_entry_offsets(buffer)
+
+    assert list(offsets.ranges) == ["other-chart", "some-chart"]
+    start, end = offsets.ranges["other-chart"]
+    assert buffer[start:end].startswith(b"  other-chart:\n  - version: 9.9.9")
+    assert buffer[end:].startswith(b"  some-chart:")
+    assert offsets.read_charts_releases(
+        ["some-chart", "other-chart", "missing-chart"]
+    ) == read_charts_releases(test_index, ["some-chart", "other-chart"])
+
+
+def test_scan_entry_offsets_crlf():
+    offsets = scan_entry_offsets(test_index.replace("\n", "\r\n").encode())
+
+    assert list(offsets.ranges) == ["other-chart", "some-chart"]
+    assert offsets.read_charts_releases(
+        ["some-chart", "other-chart"]
+    ) == read_charts_releases(test_index, ["some-chart", "other-chart"])
+
+
+def test_scan_entry_offsets_unsupported():
+    assert scan_entry_offsets(b"apiVersion: v1\n") is None
+    assert scan_entry_offsets(b"entries: {}\n") is None
+    # Flow style charts cannot be split on lines
+    assert scan_entry_offsets(b"entries:\n  some-chart: []\n") is None
+    # No chart names are found at the indentation of the first line
+    assert scan_entry_offsets(b"entries:\n  - some-chart\n") is None
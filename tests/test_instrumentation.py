@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from helm_bot import instrumentation
+from helm_bot.instrumentation import Recorder, instrumented, propagate_context
+
+
+def test_stage_records_nested_requests():
+    recorder = Recorder()
+
+    with recorder.stage("outer"):
+        with recorder.stage("inner"):
+            recorder.record_request(
+                "GET", "https://example.com/index.yaml?ref=main", 200, 100, 0.5
+            )
+        recorder.record_request(
+            "GET", "https://example.com/index.yaml", 404, 10, 0.1, retries=2
+        )
+
+    summary = recorder.summary()
+
+    assert summary["outer"]["calls"] == 1
+    assert summary["outer"]["requests"] == 2
+    assert summary["outer"]["bytes_downloaded"] == 110
+    assert summary["outer"]["retries"] == 2
+    assert summary["outer"]["status_codes"] == {"200": 1, "404": 1}
+    assert summary["inner"]["requests"] == 1
+    assert summary["http GET https://example.com/index.yaml"]["calls"] == 2
+    assert summary["http GET https://example.com/index.yaml"]["wall_time_s"] == (
+        pytest.approx(0.6)
+    )
+    assert len(recorder.trace_events) == 4
+
+
+def test_propagate_context_to_thread():
+    recorder = Recorder()
+
+    def request():
+        recorder.record_request("GET", "https://example.com", 200, 1, 0.1)
+
+    with recorder.stage("fetch"):
+        thread = threading.Thread(target=propagate_context(request))
+        thread.start()
+        thread.join()
+
+    assert recorder.summary()["fetch"]["requests"] == 1
+
+
+def test_instrumented_coroutine():
+    instrumentation.recorder.reset()
+
+    @instrumented("fetch")
+    async def fetch():
+        await asyncio.sleep(0.01)
+        instrumentation.recorder.record_request(
+            "GET", "https://example.com", 200, 1, 0.1
+        )
+
+    asyncio.run(fetch())
+
+    summary = instrumentation.recorder.summary()
+    assert summary["fetch"]["calls"] == 1
+    assert summary["fetch"]["requests"] == 1
+    assert summary["fetch"]["wall_time_s"] >= 0.01
+    instrumentation.recorder.reset()
+
+
+def test_write_reports(tmp_path):
+    recorder = Recorder()
+    with recorder.stage('stage "quoted"'):
+        recorder.record_request("GET", "https://example.com", 200, 1, 0.1)
+
+    recorder.write_summary(tmp_path / "summary.json")
+    recorder.write_chrome_trace(tmp_path / "trace.json")
+    recorder.write_openmetrics(tmp_path / "metrics.txt")
+
+    with open(tmp_path / "summary.json") as f:
+        assert json.load(f) == recorder.summary()
+    with open(tmp_path / "trace.json") as f:
+        assert len(json.load(f)["traceEvents"]) == 2
+
+    metrics = (tmp_path / "metrics.txt").read_text().splitlines()
+    assert 'helm_bot_stage_requests_total{stage="stage \\"quoted\\""} 1' in metrics
+    assert (
+        'helm_bot_stage_responses_total{stage="http GET https://example.com",code="200"} 1'
+        in metrics
+    )
+    assert metrics[-1] == "# EOF"
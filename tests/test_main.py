@@ -1,7 +1,20 @@
-import base64
+import asyncio
+import subprocess
+import sys
+import time
 import unittest
+from unittest.mock import patch
 
-from helm_bot.main import UpdateHelmDeps, split_str_to_list
+from helm_bot.http_requests import HTTPClient
+from helm_bot.main import (
+    REQUESTS_PER_CHART,
+    UpdateHelmDeps,
+    UpdateManyHelmDeps,
+    graphql_url,
+    split_str_to_list,
+)
+from helm_bot.pull_version_info import ChartVersionError
+from helm_bot.request_scheduler import RateLimitBudget
 from helm_bot.yaml_parser import YamlParser
 
 yaml = YamlParser()
@@ -34,14 +47,275 @@ class TestUpdateHelmDeps(unittest.TestCase):
         expected_output = {
             "dependencies": [{"name": "some_chart", "version": "new_version"}]
         }
-        expected_output = yaml.object_to_yaml_str(expected_output).encode("utf-8")
-        expected_output = base64.b64encode(expected_output)
-        expected_output = expected_output.decode("utf-8")
+        expected_output = yaml.object_to_yaml_str(expected_output)
 
         result = update_versions.update_versions()
 
         self.assertEqual(result, expected_output)
 
+    def test_update_versions_in_place(self):
+        update_versions = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://come-chart.com"},
+        )
+        update_versions.chart_yaml_text = (
+            "dependencies:\n"
+            "- name: some_chart   # a comment\n"
+            "  version: 'old_version'\n"
+        )
+        update_versions.charts_to_update = ["some_chart"]
+        update_versions.chart_versions = {
+            "some_chart": {
+                "current": "old_version",
+                "latest": "new_version",
+            }
+        }
+
+        result = update_versions.update_versions()
+
+        self.assertEqual(
+            result,
+            "dependencies:\n"
+            "- name: some_chart   # a comment\n"
+            "  version: 'new_version'\n",
+        )
+
+    def test_update_versions_block_scalar(self):
+        update_versions = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://come-chart.com"},
+        )
+        update_versions.chart_yaml_text = (
+            "dependencies:\n"
+            "  - name: some_chart\n"
+            "    version: |-\n"
+            "      old_version\n"
+        )
+        update_versions.charts_to_update = ["some_chart"]
+        update_versions.chart_versions = {
+            "some_chart": {
+                "current": "old_version",
+                "latest": "new_version",
+            }
+        }
+
+        result = update_versions.update_versions()
+
+        self.assertEqual(
+            yaml.yaml_string_to_object(result),
+            {"dependencies": [{"name": "some_chart", "version": "new_version"}]},
+        )
+
+    def test_head_branch(self):
+        apps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "apps/foo/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        infra = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "infra/foo/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+            branch_by_directory=True,
+        )
+        root = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            "Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+
+        self.assertEqual(apps.chart_name, "foo")
+        # Branches keep being named after the chart, as in earlier versions
+        self.assertEqual(apps.head_branch, "bump-helm-deps/foo")
+        self.assertEqual(infra.head_branch, "bump-helm-deps/infra/foo")
+        self.assertEqual(root.chart_name, "octocat")
+        self.assertEqual(root.head_branch, "bump-helm-deps/octocat")
+
+
+class TestUpdateManyHelmDeps(unittest.TestCase):
+    def test_expand_chart_paths(self):
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            ["charts/*/Chart.yaml", "other/Chart.yaml", "charts/a/Chart.yaml"],
+            {"some_chart": "https://some-chart.com"},
+        )
+        files = [
+            "README.md",
+            "charts/b/Chart.yaml",
+            "charts/a/Chart.yaml",
+            "charts/a/values.yaml",
+            "charts/a/charts/c/Chart.yaml",
+            "other/Chart.yaml",
+        ]
+
+        with patch(
+            "helm_bot.main.AsyncGitHubAPI.list_files", return_value=files
+        ) as mock:
+            result = asyncio.run(update_many.expand_chart_paths())
+
+            mock.assert_called_once_with("main")
+
+        self.assertEqual(
+            result, ["charts/a/Chart.yaml", "charts/b/Chart.yaml", "other/Chart.yaml"]
+        )
+
+    def test_expand_chart_paths_no_globs(self):
+        chart_paths = ["charts/a/Chart.yaml", "charts/b/Chart.yaml"]
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            chart_paths,
+            {"some_chart": "https://some-chart.com"},
+        )
+
+        with patch("helm_bot.main.AsyncGitHubAPI.list_files") as mock:
+            result = asyncio.run(update_many.expand_chart_paths())
+
+            self.assertEqual(mock.call_count, 0)
+
+        self.assertEqual(result, chart_paths)
+
+    @patch.object(UpdateManyHelmDeps, "_fetch_rate_limit")
+    def test_update(self, mock_fetch_rate_limit):
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            [
+                "charts/a/Chart.yaml",
+                "charts/b/Chart.yaml",
+                "charts/c/Chart.yaml",
+                "Chart.yaml",
+            ],
+            {"some_chart": "https://some-chart.com"},
+            chart_workers=2,
+            dry_run=True,
+        )
+        updated = []
+
+        async def fake_update(chart):
+            self.assertTrue(chart.dry_run)
+            self.assertEqual(chart.head_branch, f"bump-helm-deps/{chart.chart_name}")
+            self.assertIs(chart.index_downloads, update_many.index_downloads)
+            updated.append(chart.chart_name)
+            if chart.chart_name != "a":
+                raise ValueError(chart.chart_name)
+
+        with patch("helm_bot.main.UpdateHelmDeps.async_update", fake_update):
+            with self.assertRaises(ValueError) as cm:
+                update_many.update()
+
+        # A chart at the root of the repository is named after the repository
+        self.assertCountEqual(updated, ["a", "b", "c", "octocat"])
+        self.assertEqual(str(cm.exception), "b")
+
+    @patch.object(UpdateManyHelmDeps, "_fetch_rate_limit")
+    def test_update_colliding_chart_names(self, mock_fetch_rate_limit):
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            ["apps/foo/Chart.yaml", "infra/foo/Chart.yaml", "apps/bar/Chart.yaml"],
+            {"some_chart": "https://some-chart.com"},
+        )
+        head_branches = {}
+
+        async def fake_update(chart):
+            head_branches[chart.chart_path] = chart.head_branch
+
+        with patch("helm_bot.main.UpdateHelmDeps.async_update", fake_update):
+            update_many.update()
+
+        # Only charts sharing a name are told apart by their directories
+        self.assertEqual(
+            head_branches,
+            {
+                "apps/foo/Chart.yaml": "bump-helm-deps/apps/foo",
+                "infra/foo/Chart.yaml": "bump-helm-deps/infra/foo",
+                "apps/bar/Chart.yaml": "bump-helm-deps/bar",
+            },
+        )
+
+    @patch.object(UpdateManyHelmDeps, "_fetch_rate_limit")
+    def test_update_chart_version_error(self, mock_fetch_rate_limit):
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            ["charts/a/Chart.yaml", "charts/b/Chart.yaml"],
+            {"some_chart": "https://some-chart.com"},
+        )
+        finished = []
+
+        def get_chart_versions(chart):
+            if chart.chart_name == "a":
+                raise ChartVersionError(chart.chart_name)
+
+        async def fake_update(chart):
+            await asyncio.to_thread(get_chart_versions, chart)
+            # Give the failing chart's error the chance to cancel this one
+            await asyncio.sleep(0.05)
+            finished.append(chart.chart_name)
+
+        with patch("helm_bot.main.UpdateHelmDeps.async_update", fake_update):
+            with self.assertRaises(ChartVersionError):
+                update_many.update()
+
+        self.assertEqual(finished, ["b"])
+
+    def test_within_rate_limit(self):
+        chart_paths = ["charts/a/Chart.yaml", "charts/b/Chart.yaml"]
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            chart_paths,
+            {"some_chart": "https://some-chart.com"},
+        )
+        client = HTTPClient()
+
+        with patch("helm_bot.http_requests._client", client):
+            # The budget is unknown until a response reports it
+            self.assertEqual(update_many._within_rate_limit(chart_paths), chart_paths)
+
+            budget = RateLimitBudget(5000, REQUESTS_PER_CHART, time.time() + 3600)
+            client.scheduler._budgets[("api.github.com", "core")] = budget
+            self.assertEqual(
+                update_many._within_rate_limit(chart_paths), chart_paths[:1]
+            )
+
+            # The rate limit resets soon enough to wait for it
+            budget.reset = time.time() + 10
+            self.assertEqual(update_many._within_rate_limit(chart_paths), chart_paths)
+
+    def test_fetch_rate_limit(self):
+        update_many = UpdateManyHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_A_t0k3n",
+            ["charts/a/Chart.yaml"],
+            {"some_chart": "https://some-chart.com"},
+        )
+        client = HTTPClient()
+        reset = time.time() + 3600
+
+        with patch("helm_bot.http_requests._client", client), patch(
+            "helm_bot.main.AsyncGitHubAPI.get_rate_limit",
+            return_value={"limit": 5000, "remaining": 10, "reset": reset},
+        ) as mock:
+            # Plain chart paths make no request before the charts are planned,
+            # so the budget is looked up
+            asyncio.run(update_many._fetch_rate_limit())
+            asyncio.run(update_many._fetch_rate_limit())
+
+            mock.assert_called_once_with()
+
+        budget = client.scheduler.budget(update_many.github_api_url)
+        self.assertEqual((budget.remaining, budget.reset), (10, reset))
+
 
 def test_split_str_to_list_simple():
     test_str1 = "label1,label2"
@@ -71,5 +345,32 @@ def test_split_str_to_list_complex():
     assert result1 == result2
 
 
+def test_graphql_url():
+    assert graphql_url("https://api.github.com") == "https://api.github.com/graphql"
+    assert (
+        graphql_url("https://github.example.com/api/v3")
+        == "https://github.example.com/api/graphql"
+    )
+
+
+def test_import_time():
+    # Import the entry point in a fresh interpreter, as a container start would.
+    # Wall-clock times vary too much between CI runners to assert on, so only
+    # the modules that are imported are checked.
+    script = (
+        "import sys, helm_bot.main; "
+        + "print(helm_bot.main.yaml._yaml is None, "
+        + "sorted(m for m in sys.modules if m.startswith('ruamel') "
+        + "or m in ('cProfile', 'tracemalloc', 'helm_bot.chart_patcher')))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+
+    # Module-level YamlParser's are only built when first used, and ruamel.yaml,
+    # the chart patcher and the profiler are only imported when needed
+    assert result.stdout.strip() == "True []"
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,112 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from helm_bot.oci_registry import OCIRegistryClient, oci_reference, tag_to_version
+
+TAGS = ["1.0.0", "1.1.0", "1.2.0_build.1", "2.0.0-rc.1", "latest"]
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """A stand-in for an OCI registry that requires a bearer token and pages its
+    tag lists"""
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, body, headers={}):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append(self.path)
+
+        if url.path == "/token":
+            self.send_json(200, {"token": "t0k3n"})
+            return
+
+        if self.headers.get("Authorization") != "Bearer t0k3n":
+            realm = f"http://127.0.0.1:{self.server.server_port}/token"
+            challenge = (
+                f'Bearer realm="{realm}",service="stand-in",'
+                + 'scope="repository:charts/some_chart:pull"'
+            )
+            self.send_json(401, {"errors": []}, {"WWW-Authenticate": challenge})
+            return
+
+        if url.path != "/v2/charts/some_chart/tags/list":
+            self.send_json(404, {"errors": []})
+            return
+
+        n = int(query["n"][0])
+        start = TAGS.index(query["last"][0]) + 1 if "last" in query else 0
+        page = TAGS[start : start + n]
+        headers = {}
+        if start + n < len(TAGS):
+            headers["Link"] = (
+                f"</v2/charts/some_chart/tags/list?n={n}&last={page[-1]}>; "
+                + 'rel="next"'
+            )
+        self.send_json(200, {"name": "charts/some_chart", "tags": page}, headers)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def registry_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RegistryHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_oci_reference():
+    assert (
+        oci_reference("oci://registry.example.com/charts", "some_chart")
+        == "oci://registry.example.com/charts/some_chart"
+    )
+    assert (
+        oci_reference("oci://registry.example.com/charts/some_chart/", "some_chart")
+        == "oci://registry.example.com/charts/some_chart"
+    )
+
+
+def test_tag_to_version():
+    assert tag_to_version("1.2.0_build.1") == "1.2.0+build.1"
+
+
+def test_list_tags(registry_server, monkeypatch):
+    monkeypatch.setattr("helm_bot.oci_registry.PAGE_SIZE", 2)
+    client = OCIRegistryClient()
+    reference = f"oci://127.0.0.1:{registry_server.server_port}/charts/some_chart"
+
+    assert client.list_tags(reference) == TAGS
+    # The token is requested once, and reused for every page
+    assert sum(path.startswith("/token") for path in registry_server.requests) == 1
+    assert len(registry_server.requests) == 5
+
+    assert client.list_tags(reference) == TAGS
+    assert sum(path.startswith("/token") for path in registry_server.requests) == 1
+
+
+def test_list_tags_not_found(registry_server):
+    client = OCIRegistryClient()
+    reference = f"oci://127.0.0.1:{registry_server.server_port}/charts/other_chart"
+
+    with pytest.raises(requests.HTTPError):
+        client.list_tags(reference)
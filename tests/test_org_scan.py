@@ -0,0 +1,122 @@
+import asyncio
+import unittest
+from unittest.mock import call, patch
+
+from helm_bot.org_scan import UpdateOrgHelmDeps, parse_repositories
+
+
+class TestUpdateOrgHelmDeps(unittest.TestCase):
+    def test_search_chart_paths(self):
+        update_org = UpdateOrgHelmDeps(
+            "ThIs_Is_A_t0k3n",
+            {"some_chart": "https://some-chart.com"},
+            search_query="org:octocat filename:Chart.yaml",
+        )
+        first_page = [
+            {"repository": {"full_name": "octocat/a"}, "path": f"charts/{i}/Chart.yaml"}
+            for i in range(100)
+        ]
+        second_page = [
+            {"repository": {"full_name": "octocat/b"}, "path": "Chart.yaml"},
+            {"repository": {"full_name": "octocat/a"}, "path": "charts/0/Chart.yaml"},
+            # Vendored subcharts are updated with their parent chart
+            {
+                "repository": {"full_name": "octocat/a"},
+                "path": "charts/0/charts/redis/Chart.yaml",
+            },
+        ]
+
+        with patch(
+            "helm_bot.org_scan.async_get_request",
+            side_effect=[
+                {"total_count": 102, "items": first_page},
+                {"total_count": 102, "items": second_page},
+            ],
+        ) as mock:
+            result = asyncio.run(update_org.search_chart_paths())
+
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(mock.call_args.kwargs["params"]["page"], 2)
+        self.assertEqual(len(result["octocat/a"]), 100)
+        self.assertNotIn("charts/0/charts/redis/Chart.yaml", result["octocat/a"])
+        self.assertEqual(result["octocat/b"], ["Chart.yaml"])
+
+    def test_discover(self):
+        update_org = UpdateOrgHelmDeps(
+            "ThIs_Is_A_t0k3n",
+            {"some_chart": "https://some-chart.com"},
+            repositories={"octocat/a": ["charts/*/Chart.yaml"]},
+            search_query="org:octocat filename:Chart.yaml",
+        )
+        found = {
+            "octocat/a": ["charts/*/Chart.yaml", "other/Chart.yaml"],
+            "octocat/b": ["Chart.yaml"],
+        }
+
+        with patch.object(UpdateOrgHelmDeps, "search_chart_paths", return_value=found):
+            result = asyncio.run(update_org.discover())
+
+        self.assertEqual(
+            result,
+            {
+                "octocat/a": ["charts/*/Chart.yaml", "other/Chart.yaml"],
+                "octocat/b": ["Chart.yaml"],
+            },
+        )
+
+    def test_update(self):
+        update_org = UpdateOrgHelmDeps(
+            "ThIs_Is_A_t0k3n",
+            {"some_chart": "https://some-chart.com"},
+            repositories={"octocat/a": ["Chart.yaml"], "octocat/b": ["Chart.yaml"]},
+            dry_run=True,
+        )
+        updated = {}
+
+        async def fake_update(update_many):
+            self.assertTrue(update_many.kwargs["dry_run"])
+            self.assertIs(update_many.index_downloads, update_org.index_downloads)
+            updated[update_many.repository] = update_many.base_branch
+            if update_many.repository == "octocat/b":
+                raise ValueError(update_many.repository)
+
+        mock_get = patch(
+            "helm_bot.org_scan.async_get_request",
+            side_effect=[{"default_branch": "main"}, {"default_branch": "master"}],
+        )
+        mock_update = patch(
+            "helm_bot.org_scan.UpdateManyHelmDeps.async_update", fake_update
+        )
+
+        with mock_get as mock, mock_update:
+            with self.assertRaises(ValueError) as cm:
+                update_org.update()
+
+            mock.assert_has_calls(
+                [
+                    call(
+                        "https://api.github.com/repos/octocat/a",
+                        headers=update_org.headers,
+                        output="json",
+                    ),
+                    call(
+                        "https://api.github.com/repos/octocat/b",
+                        headers=update_org.headers,
+                        output="json",
+                    ),
+                ]
+            )
+
+        self.assertEqual(updated, {"octocat/a": "main", "octocat/b": "master"})
+        self.assertEqual(str(cm.exception), "octocat/b")
+
+
+def test_parse_repositories():
+    result = parse_repositories(
+        '{"octocat/a": "charts/a/Chart.yaml, charts/b/Chart.yaml", "octocat/b": ["Chart.yaml"]}'
+    )
+
+    assert result == {
+        "octocat/a": ["charts/a/Chart.yaml", "charts/b/Chart.yaml"],
+        "octocat/b": ["Chart.yaml"],
+    }
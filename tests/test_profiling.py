@@ -0,0 +1,89 @@
+import pstats
+import threading
+
+from helm_bot.instrumentation import Recorder
+from helm_bot.profiling import Profiler
+
+
+def allocate():
+    return [str(i) * 10 for i in range(10000)]
+
+
+def test_profile_stages(tmp_path):
+    recorder = Recorder()
+    recorder.profiler = Profiler(stages=["parse"])
+    recorder.profiler.start()
+    try:
+        for _ in range(2):
+            with recorder.stage("parse"):
+                allocate()
+        with recorder.stage("other"):
+            allocate()
+    finally:
+        recorder.profiler.stop()
+
+    recorder.profiler.write(str(tmp_path))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "parse.allocations.txt",
+        "parse.pstats",
+    ]
+    stats = pstats.Stats(str(tmp_path / "parse.pstats"))
+    _, ncalls, _, _, _ = next(
+        value for (func, value) in stats.stats.items() if func[2] == "allocate"
+    )
+    assert ncalls == 2
+
+    report = (tmp_path / "parse.allocations.txt").read_text()
+    assert report.startswith("parse: 2 calls, 2 profiled by cProfile")
+    assert "Call 2: peak" in report
+    # The stage is still timed as usual
+    assert recorder.stages["parse"].calls == 2
+
+
+def test_profile_overlapping_stages(tmp_path):
+    profiler = Profiler(stages=["parse"])
+    entered = threading.Event()
+    release = threading.Event()
+
+    def other_thread():
+        with profiler.stage("parse"):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    entered.wait()
+    with profiler.stage("parse"):
+        allocate()
+    release.set()
+    thread.join()
+
+    # Only one call can be profiled by cProfile at a time
+    assert profiler.profiles["parse"].calls == 2
+    assert profiler.profiles["parse"].profiled_calls == 1
+
+
+def test_profile_overlapping_async_stages(tmp_path):
+    profiler = Profiler(stages=["find", "parse"])
+    profiler.start()
+    try:
+        with profiler.stage("parse"):
+            # Other coroutines would be recorded in the profile of a stage that
+            # awaits, so it is not profiled by cProfile while overlapping another
+            with profiler.stage("find", awaits=True):
+                allocate()
+        with profiler.stage("find", awaits=True):
+            allocate()
+    finally:
+        profiler.stop()
+
+    assert profiler.profiles["find"].calls == 2
+    assert profiler.profiles["find"].profiled_calls == 1
+    # Overlapping calls share tracemalloc's peak, so it is not reported
+    assert all(
+        "peak unknown" in report
+        for report in profiler.profiles["parse"].allocations
+        + profiler.profiles["find"].allocations[:1]
+    )
+    assert "peak unknown" not in profiler.profiles["find"].allocations[1]
@@ -1,8 +1,18 @@
+import asyncio
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch
 
+from helm_bot.http_requests import SpooledBody
+from helm_bot.index_cache import content_hash
+from helm_bot.index_reader import read_charts_releases, scan_entry_offsets
 from helm_bot.main import UpdateHelmDeps
-from helm_bot.pull_version_info import HelmChartVersionPuller
+from helm_bot.pull_version_info import (
+    ChartVersionError,
+    HelmChartVersionPuller,
+    IndexDownloads,
+)
 
 
 class TestHelmChartVersionPuller(unittest.TestCase):
@@ -44,8 +54,31 @@ class TestHelmChartVersionPuller(unittest.TestCase):
 
         self.assertEqual(result, ["some_chart"])
 
-    @patch("helm_bot.pull_version_info.get_request")
-    def test_get_config(self, mock_get):
+    def test_compare_chart_versions_older(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, "main")
+        version_puller.chart_versions = {
+            "some_chart": {
+                "current": "2.0.0",
+                "latest": "1.9.0",
+            }
+        }
+
+        result = version_puller._compare_chart_versions()
+
+        self.assertEqual(result, [])
+
+    @patch(
+        "helm_bot.github_api.async_post_request",
+        return_value={"data": {"repository": {"object": None}}},
+    )
+    @patch("helm_bot.pull_version_info.async_get_request")
+    def test_get_config(self, mock_get, mock_post):
         helm_deps = UpdateHelmDeps(
             "octocat/octocat",
             "ThIs_Is_a_t0k3n",
@@ -65,10 +98,395 @@ class TestHelmChartVersionPuller(unittest.TestCase):
         expected_config = {"hello": "world"}
         expected_sha = "123456789"
 
-        config, sha = version_puller._get_config(helm_deps.base_branch)
+        config, sha = asyncio.run(version_puller._get_config(helm_deps.base_branch))
 
         self.assertDictEqual(config, expected_config)
         self.assertEqual(sha, expected_sha)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("helm_bot.github_api.async_post_request")
+    @patch("helm_bot.pull_version_info.async_get_request")
+    def test_get_config_graphql(self, mock_get, mock_post):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com"},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+
+        mock_post.return_value = {
+            "data": {
+                "repository": {
+                    "object": {
+                        "oid": "123456789",
+                        "text": "hello: world",
+                        "isTruncated": False,
+                    }
+                }
+            }
+        }
+
+        config, sha = asyncio.run(version_puller._get_config(helm_deps.base_branch))
+
+        self.assertDictEqual(config, {"hello": "world"})
+        self.assertEqual(sha, "123456789")
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(
+            mock_post.call_args.kwargs["json"]["variables"]["expression"],
+            "main:chart-name/Chart.yaml",
+        )
+        mock_get.assert_not_called()
+
+    def test_pull_version_github_pages(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com/index.yaml"},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {"some_chart": {"current": "1.0.0"}}
+
+        index = (
+            "entries:\n"
+            "  some_chart:\n"
+            "  - version: 1.1.0\n"
+            "    created: 2021-06-01T00:00:00Z\n"
+            "  - version: 1.0.0\n"
+            "    created: 2021-01-01T00:00:00Z\n"
+        )
+
+        version_puller._pull_version_github_pages(
+            ["some_chart"], "https://some-chart.com/index.yaml", index
+        )
+
+        self.assertEqual(version_puller.chart_versions["some_chart"]["latest"], "1.1.0")
+
+    def test_pull_version_github_pages_missing_chart(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://some-chart.com/index.yaml"},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {"some_chart": {"current": "1.0.0"}}
+
+        with self.assertRaises(ChartVersionError):
+            version_puller._pull_version_github_pages(
+                ["some_chart"],
+                "https://some-chart.com/index.yaml",
+                "entries:\n  other_chart: []\n",
+            )
+
+    def test_pull_version_github_pages_semver(self):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {
+                "some_chart": "https://some-chart.com/index.yaml",
+                "other_chart": "https://some-chart.com/index.yaml",
+            },
+            version_constraints={"other_chart": {"major": True}},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {
+            "some_chart": {"current": "1.0.0"},
+            "other_chart": {"current": "1.0.0"},
+        }
+
+        # The backported 1.0.5 and the prerelease 2.1.0-rc.1 were created last
+        index = (
+            "entries:\n"
+            "  some_chart:\n"
+            "  - version: 2.1.0-rc.1\n"
+            "    created: 2021-09-01T00:00:00Z\n"
+            "  - version: 1.0.5\n"
+            "    created: 2021-08-01T00:00:00Z\n"
+            "  - version: 2.0.0\n"
+            "    created: 2021-06-01T00:00:00Z\n"
+            "  other_chart:\n"
+            "  - version: 2.0.0\n"
+            "    created: 2021-09-01T00:00:00Z\n"
+            "  - version: 1.1.0\n"
+            "    created: 2021-06-01T00:00:00Z\n"
+        )
+
+        version_puller._pull_version_github_pages(
+            ["some_chart", "other_chart"], "https://some-chart.com/index.yaml", index
+        )
+
+        self.assertEqual(version_puller.chart_versions["some_chart"]["latest"], "2.0.0")
+        self.assertEqual(
+            version_puller.chart_versions["other_chart"]["latest"], "1.1.0"
+        )
+
+    @patch("helm_bot.pull_version_info.get_request")
+    def test_get_remote_versions(self, mock_get):
+        chart_urls = {
+            "chart1": "https://chart1.com/index.yaml",
+            "chart2": "https://chart2.com/index.yaml",
+        }
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            chart_urls,
+            max_concurrency=2,
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {
+            "chart1": {"current": "1.0.0"},
+            "chart2": {"current": "2.0.0"},
+        }
+
+        indexes = {
+            chart_url: f"entries:\n  {chart}:\n  - version: 3.0.0\n"
+            for chart, chart_url in chart_urls.items()
+        }
+        mock_get.side_effect = lambda url, **kwargs: iter([indexes[url].encode()])
+
+        version_puller._get_remote_versions()
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertDictEqual(
+            version_puller.chart_versions,
+            {
+                "chart1": {"current": "1.0.0", "latest": "3.0.0"},
+                "chart2": {"current": "2.0.0", "latest": "3.0.0"},
+            },
+        )
+
+    @patch("helm_bot.pull_version_info.get_request")
+    def test_resolve_chart_versions_unsupported_url(self, mock_get):
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"some_chart": "https://example.com/charts"},
+        )
+        helm_deps.chart_yaml_text = (
+            "dependencies:\n- name: some_chart\n  version: 1.0.0\n"
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+
+        with self.assertWarns(UserWarning):
+            version_puller._resolve_chart_versions()
+
+        mock_get.assert_not_called()
+        # A dependency whose version could not be looked up is not updated
+        self.assertEqual(helm_deps.charts_to_update, [])
+        self.assertEqual(helm_deps.chart_versions, {"some_chart": {"current": "1.0.0"}})
+
+    @patch("helm_bot.pull_version_info.get_request")
+    def test_get_remote_versions_reports_first_error(self, mock_get):
+        chart_urls = {
+            "chart1": "https://chart1.com/index.yaml",
+            "chart2": "https://chart2.com/index.yaml",
+        }
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            chart_urls,
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {
+            "chart1": {"current": "1.0.0"},
+            "chart2": {"current": "2.0.0"},
+        }
+
+        def fail(url, **kwargs):
+            raise ValueError(url)
+
+        mock_get.side_effect = fail
+
+        with self.assertRaises(ValueError) as cm:
+            version_puller._get_remote_versions()
+
+        self.assertEqual(str(cm.exception), chart_urls["chart1"])
+
+    @patch("helm_bot.pull_version_info.get_request")
+    def test_get_remote_versions_shared_index(self, mock_get):
+        chart_url = "https://charts.com/index.yaml"
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"chart1": chart_url, "chart2": chart_url},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {
+            "chart1": {"current": "1.0.0"},
+            "chart2": {"current": "2.0.0"},
+        }
+
+        mock_get.return_value = iter(
+            [
+                b"entries:\n  chart1:\n  - version: 1.1.0\n",
+                b"  chart2:\n  - version: 2.1.0\n",
+            ]
+        )
+
+        with patch(
+            "helm_bot.index_reader.scan_entry_offsets",
+            wraps=scan_entry_offsets,
+        ) as mock_scan:
+            version_puller._get_remote_versions()
+
+            self.assertEqual(mock_scan.call_count, 1)
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertDictEqual(
+            version_puller.chart_versions,
+            {
+                "chart1": {"current": "1.0.0", "latest": "1.1.0"},
+                "chart2": {"current": "2.0.0", "latest": "2.1.0"},
+            },
+        )
+
+    @patch("helm_bot.pull_version_info.registry.list_tags")
+    @patch("helm_bot.pull_version_info.get_request")
+    def test_get_remote_versions_oci(self, mock_get, mock_list_tags):
+        chart_urls = {
+            "chart1": "https://chart1.com/index.yaml",
+            "chart2": "oci://registry.example.com/charts",
+        }
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            chart_urls,
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+        version_puller.chart_versions = {
+            "chart1": {"current": "1.0.0"},
+            "chart2": {"current": "2.0.0"},
+        }
+
+        mock_get.return_value = iter([b"entries:\n  chart1:\n  - version: 3.0.0\n"])
+        mock_list_tags.return_value = ["2.0.0", "2.1.0_build.1", "3.0.0-rc.1"]
+
+        version_puller._get_remote_versions()
+
+        mock_list_tags.assert_called_once_with(
+            "oci://registry.example.com/charts/chart2"
+        )
+        self.assertDictEqual(
+            version_puller.chart_versions,
+            {
+                "chart1": {"current": "1.0.0", "latest": "3.0.0"},
+                "chart2": {"current": "2.0.0", "latest": "2.1.0+build.1"},
+            },
+        )
+
+    @patch("helm_bot.pull_version_info.get_request")
+    def test_fetch_index(self, mock_get):
+        chart_url = "https://charts.com/index.yaml"
+        helm_deps = UpdateHelmDeps(
+            "octocat/octocat",
+            "ThIs_Is_a_t0k3n",
+            "chart-name/Chart.yaml",
+            {"chart1": chart_url},
+        )
+        version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+
+        # A multi-byte character split across two chunks
+        snowman = "\u2603".encode("utf-8")
+        mock_get.return_value = iter(
+            [b"entries: {}\n# a snowman " + snowman[:1], snowman[1:] + b"\n"]
+        )
+
+        index = version_puller._fetch_index(chart_url)
+
+        mock_get.assert_called_once_with(
+            chart_url, headers=helm_deps.headers, output="stream", cache=None
+        )
+        self.assertEqual(index.open().read(), b"entries: {}\n# a snowman \n")
+        self.assertEqual(index.digest(), content_hash("entries: {}\n# a snowman \n"))
+
+    def test_pull_version_github_pages_index_cache(self):
+        chart_url = "https://some-chart.com/index.yaml"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            helm_deps = UpdateHelmDeps(
+                "octocat/octocat",
+                "ThIs_Is_a_t0k3n",
+                "chart-name/Chart.yaml",
+                {"some_chart": chart_url},
+                cache_dir=cache_dir,
+            )
+            version_puller = HelmChartVersionPuller(helm_deps, helm_deps.base_branch)
+            version_puller.chart_versions = {"some_chart": {"current": "1.0.0"}}
+            index = "entries:\n  some_chart:\n  - version: 1.1.0\n"
+
+            with patch(
+                "helm_bot.index_reader.read_charts_releases",
+                wraps=read_charts_releases,
+            ) as mock_read:
+                version_puller._pull_version_github_pages(
+                    ["some_chart"], chart_url, index
+                )
+                version_puller._pull_version_github_pages(
+                    ["some_chart"], chart_url, index
+                )
+
+                self.assertEqual(mock_read.call_count, 1)
+
+        self.assertEqual(version_puller.chart_versions["some_chart"]["latest"], "1.1.0")
+
+
+def test_index_downloads_deduplicates():
+    downloads = IndexDownloads(max_workers=2)
+    urls = []
+
+    def download(url):
+        urls.append(url)
+        return "entries: {}"
+
+    first = downloads.fetch("https://charts.com/index.yaml", download)
+    second = downloads.fetch("https://charts.com/index.yaml", download)
+
+    assert first is second
+    assert first.result() == "entries: {}"
+    assert urls == ["https://charts.com/index.yaml"]
+
+
+def test_index_downloads_close():
+    downloads = IndexDownloads(max_workers=2)
+    bodies = []
+
+    def download(url):
+        body = SpooledBody(max_memory=16)
+        body.write(b"entries:\n  chart1:\n  - version: 1.0.0\n")
+        bodies.append(body)
+        return body
+
+    chart_url = "https://charts.com/index.yaml"
+    # Charts processed one after another still share the download
+    for _ in range(3):
+        index = downloads.fetch(chart_url, download).result()
+        offsets = downloads.entry_offsets(chart_url, index)
+    assert len(bodies) == 1
+    assert not offsets.buffer.closed
+
+    downloads.close()
+    assert bodies[0]._file.closed
+    assert offsets.buffer.closed
+
+
+def test_index_downloads_resolve():
+    downloads = IndexDownloads(max_workers=2, resolve_workers=1)
+
+    async def resolve():
+        loop_thread = threading.get_ident()
+        # The versions are resolved off the event loop, in the resolve pool
+        thread = await downloads.resolve(threading.get_ident)
+        assert thread != loop_thread
+        assert thread in {t.ident for t in downloads._resolve_executor._threads}
+
+    asyncio.run(resolve())
 
 
 if __name__ == "__main__":
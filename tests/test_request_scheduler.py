@@ -0,0 +1,133 @@
+import time
+
+import pytest
+import requests
+
+from helm_bot.request_scheduler import RequestScheduler, TokenBucket
+
+api_url = "https://api.github.com/repos/octocat/octocat/pulls"
+
+
+def make_response(status_code, headers={}, body=b"", url=api_url):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers)
+    resp._content = body
+    resp.url = url
+    return resp
+
+
+def rate_limit_headers(remaining, reset, limit=5000, resource="core"):
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(int(reset)),
+        "X-RateLimit-Resource": resource,
+    }
+
+
+def test_budget():
+    scheduler = RequestScheduler()
+    reset = time.time() + 3600
+
+    assert scheduler.budget("https://api.github.com") is None
+
+    scheduler.update(make_response(200, rate_limit_headers(4999, reset)))
+    scheduler.update(
+        make_response(
+            200,
+            rate_limit_headers(10, reset, resource="graphql"),
+            url="https://api.github.com/graphql",
+        )
+    )
+
+    budget = scheduler.budget("https://api.github.com/repos/octocat/octocat")
+    assert (budget.limit, budget.remaining) == (5000, 4999)
+    assert scheduler.budget("https://api.github.com/graphql").remaining == 10
+    assert scheduler.budget("https://example.com/index.yaml") is None
+
+
+def test_wait_exhausted_budget(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("helm_bot.request_scheduler.time.sleep", sleeps.append)
+    scheduler = RequestScheduler(max_wait=60)
+
+    scheduler.update(make_response(200, rate_limit_headers(0, time.time() + 30)))
+    scheduler.wait(api_url)
+
+    assert 25 < sleeps[0] <= 30
+
+    scheduler.update(make_response(200, rate_limit_headers(0, time.time() + 3600)))
+    with pytest.raises(requests.HTTPError):
+        scheduler.wait(api_url)
+
+
+def test_wait_paces_low_budget(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("helm_bot.request_scheduler.time.sleep", sleeps.append)
+    scheduler = RequestScheduler()
+
+    # 100 seconds left to spend 10 requests in
+    scheduler.update(
+        make_response(200, rate_limit_headers(10, time.time() + 100, limit=1000))
+    )
+    for _ in range(3):
+        scheduler.wait(api_url)
+
+    assert len(sleeps) == 2
+    assert 9 < sleeps[0] <= 10
+    assert sleeps[1] > sleeps[0]
+
+
+def test_retry_delay():
+    scheduler = RequestScheduler(max_retries=2, max_backoff=4)
+
+    # Server errors and dropped connections are only retried if idempotent
+    assert 0 <= scheduler.retry_delay("GET", 0, make_response(502)) <= 1
+    assert 0 <= scheduler.retry_delay("PUT", 1, make_response(503)) <= 2
+    assert scheduler.retry_delay("POST", 0, make_response(502)) is None
+    assert scheduler.retry_delay("GET", 0) is not None
+    assert scheduler.retry_delay("PATCH", 0) is None
+
+    # Client errors are not retried, nor is anything after max_retries
+    assert scheduler.retry_delay("GET", 0, make_response(404)) is None
+    assert scheduler.retry_delay("GET", 2, make_response(502)) is None
+
+
+def test_retry_delay_rate_limited():
+    scheduler = RequestScheduler(max_wait=120)
+
+    assert scheduler.retry_delay(
+        "POST", 0, make_response(429, {"Retry-After": "5"})
+    ) == pytest.approx(5)
+
+    primary = make_response(403, rate_limit_headers(0, time.time() + 30))
+    assert 25 < scheduler.retry_delay("POST", 0, primary) <= 30
+
+    secondary = make_response(
+        403, body=b'{"message": "You have exceeded a secondary rate limit"}'
+    )
+    assert scheduler.retry_delay("POST", 0, secondary) == 60
+    assert scheduler.retry_delay("POST", 1, secondary) == 120
+    assert scheduler.retry_delay("POST", 2, secondary) == 120
+
+    forbidden = make_response(403, body=b'{"message": "Resource not accessible"}')
+    assert scheduler.retry_delay("GET", 0, forbidden) is None
+
+
+def test_retry_delay_rate_limited_too_long():
+    scheduler = RequestScheduler(max_wait=60)
+
+    resp = make_response(429, {"Retry-After": "3600"})
+
+    assert scheduler.retry_delay("GET", 0, resp) is None
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    waits = [bucket.reserve() for _ in range(4)]
+
+    assert waits[:2] == [0, 0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
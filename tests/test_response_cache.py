@@ -0,0 +1,92 @@
+import gzip
+import os
+import time
+
+import requests
+
+from helm_bot.response_cache import ResponseCache
+
+test_url = "https://example.com/index.yaml"
+
+
+def make_response(body, headers):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = body
+    resp.headers.update(headers)
+    resp.encoding = "utf-8"
+    return resp
+
+
+def test_store_and_load(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    resp = make_response(
+        b"hello: world",
+        {"ETag": '"abc"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+    )
+
+    cache.store(test_url, resp)
+
+    assert cache.validators(test_url) == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+    assert cache.load(test_url) == (b"hello: world", "utf-8")
+    assert cache.validators(test_url, params={"ref": "main"}) == {}
+
+
+def test_store_stream_and_open(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    resp = make_response(None, {"ETag": '"abc"'})
+
+    chunks = cache.store_stream(test_url, resp, iter([b"hello: ", b"world"]))
+
+    assert cache.open(test_url) is None
+    assert list(chunks) == [b"hello: ", b"world"]
+    assert cache.validators(test_url) == {"If-None-Match": '"abc"'}
+    with cache.open(test_url) as f:
+        assert f.read() == b"hello: world"
+
+
+def test_store_stream_incomplete(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    resp = make_response(None, {"ETag": '"abc"'})
+
+    chunks = cache.store_stream(test_url, resp, iter([b"hello: ", b"world"]))
+    next(chunks)
+    chunks.close()
+
+    assert cache.open(test_url) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_store_without_validators(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+
+    cache.store(test_url, make_response(b"hello: world", {}))
+
+    assert cache.validators(test_url) == {}
+    assert cache.load(test_url) == (None, None)
+    assert os.listdir(tmp_path) == []
+
+
+def test_evict_by_age(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_age=60)
+    cache.store(test_url, make_response(b"old", {"ETag": '"old"'}))
+
+    cache.max_age = -1
+    cache.evict()
+
+    assert cache.load(test_url) == (None, None)
+
+
+def test_evict_by_size(tmp_path):
+    # Only one compressed body fits in the cache at a time
+    cache = ResponseCache(str(tmp_path), max_size=len(gzip.compress(b"a" * 1000)))
+
+    cache.store(test_url, make_response(b"a" * 1000, {"ETag": '"a"'}))
+    time.sleep(0.01)
+    cache.store(test_url + "?2", make_response(b"b" * 1000, {"ETag": '"b"'}))
+
+    assert cache.load(test_url) == (None, None)
+    assert cache.load(test_url + "?2")[0] == b"b" * 1000
@@ -0,0 +1,122 @@
+import asyncio
+from unittest.mock import patch
+
+import responses
+
+from helm_bot.http_requests import SpooledBody
+from helm_bot.main import UpdateHelmDeps
+from helm_bot.run_state import tags_digest
+
+index_url = "https://some-chart.com/index.yaml"
+contents_url = "https://api.github.com/repos/octocat/octocat/contents/chart/Chart.yaml"
+
+
+def make_inputs(cache_dir, **kwargs):
+    return UpdateHelmDeps(
+        "octocat/octocat",
+        "ThIs_Is_A_t0k3n",
+        "chart/Chart.yaml",
+        {"some_chart": index_url},
+        cache_dir=str(cache_dir),
+        **kwargs,
+    )
+
+
+def record(inputs, fingerprint={"validators": {"If-None-Match": '"abc"'}}):
+    inputs.run_state.store(
+        inputs, "blob-sha", {index_url: fingerprint}, {"some_chart": "1.2.3"}
+    )
+
+
+def test_store_and_load(tmp_path):
+    inputs = make_inputs(tmp_path)
+    assert inputs.run_state.load(inputs) is None
+
+    record(inputs)
+    assert inputs.run_state.load(inputs)["versions"] == {"some_chart": "1.2.3"}
+
+    # A state recorded with other inputs is not used
+    other_inputs = make_inputs(tmp_path, version_constraints={"*": {"major": 1}})
+    assert other_inputs.run_state.load(other_inputs) is None
+
+    inputs.run_state.remove(inputs)
+    assert inputs.run_state.load(inputs) is None
+
+
+def test_tags_digest():
+    assert tags_digest(["1.0.0", "1.1.0"]) == tags_digest(["1.1.0", "1.0.0"])
+    assert tags_digest(["1.0.0"]) != tags_digest(["1.0.0", "1.1.0"])
+
+
+@responses.activate
+def test_check_state_unchanged(tmp_path):
+    inputs = make_inputs(tmp_path)
+    record(inputs)
+    responses.add(responses.GET, contents_url, json={"sha": "blob-sha"}, status=200)
+    responses.add(responses.GET, index_url, status=304)
+
+    assert inputs.check_state() == {"some_chart": "1.2.3"}
+    assert len(responses.calls) == 2
+    assert responses.calls[1].request.headers["If-None-Match"] == '"abc"'
+
+
+@responses.activate
+def test_check_state_changed(tmp_path):
+    inputs = make_inputs(tmp_path)
+    record(inputs)
+    responses.add(responses.GET, contents_url, json={"sha": "blob-sha"}, status=200)
+    responses.add(responses.GET, index_url, body="entries: {}", status=200)
+
+    assert inputs.check_state() is None
+
+    # The chart is checked first, so a changed chart needs no other request
+    responses.replace(
+        responses.GET, contents_url, json={"sha": "other-sha"}, status=200
+    )
+    assert inputs.check_state() is None
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_check_state_digest(tmp_path):
+    inputs = make_inputs(tmp_path)
+    body = "entries: {}\n"
+    responses.add(responses.GET, contents_url, json={"sha": "blob-sha"}, status=200)
+    responses.add(responses.GET, index_url, body=body, status=200)
+
+    # The index is hashed the same way as a downloaded index
+    index = SpooledBody()
+    index.write(body.encode())
+    record(inputs, {"digest": index.digest().hex()})
+
+    assert inputs.check_state() == {"some_chart": "1.2.3"}
+
+
+def test_update_short_circuits(tmp_path):
+    inputs = make_inputs(tmp_path)
+
+    with patch.object(
+        UpdateHelmDeps, "check_state", return_value={"some_chart": "1.2.3"}
+    ), patch("helm_bot.main.AsyncGitHubAPI.find_existing_pull_request") as mock_find:
+        asyncio.run(inputs.async_update())
+
+    mock_find.assert_not_called()
+    assert inputs.charts_to_update == []
+    assert inputs.chart_versions == {
+        "some_chart": {"current": "1.2.3", "latest": "1.2.3"}
+    }
+
+
+def test_record_state(tmp_path):
+    inputs = make_inputs(tmp_path)
+    inputs.sha = "blob-sha"
+    inputs.index_fingerprints = {index_url: {"digest": "abc"}}
+    inputs.chart_versions = {"some_chart": {"current": "1.2.3", "latest": "1.2.3"}}
+    inputs.charts_to_update = []
+
+    inputs.record_state(pr_exists=False)
+    assert inputs.run_state.load(inputs)["chart_sha"] == "blob-sha"
+
+    # Runs that can update the chart always run in full next time
+    inputs.record_state(pr_exists=True)
+    assert inputs.run_state.load(inputs) is None
@@ -0,0 +1,165 @@
+import pytest
+
+from helm_bot.versions import (
+    PARSE_CACHE_SIZE,
+    ChartVersion,
+    ChartVersions,
+    is_prerelease,
+    parse_range,
+    parse_version,
+    resolve_latest,
+)
+
+
+def test_parse_version():
+    assert parse_version("1.2.3") == (1, 2, 3, (1,))
+    assert parse_version("v1.2") == (1, 2, 0, (1,))
+    assert parse_version("1.2.3+build.5") == (1, 2, 3, (1,))
+    assert parse_version("not-a-version") is None
+    assert parse_version("1.2.3.4") is None
+
+
+def test_parse_version_precedence():
+    # The example ordering from https://semver.org/#spec-item-11
+    versions = [
+        "1.0.0-alpha",
+        "1.0.0-alpha.1",
+        "1.0.0-alpha.beta",
+        "1.0.0-beta",
+        "1.0.0-beta.2",
+        "1.0.0-beta.11",
+        "1.0.0-rc.1",
+        "1.0.0",
+        "1.0.1",
+        "1.10.0",
+        "2.0.0",
+    ]
+
+    assert sorted(reversed(versions), key=parse_version) == versions
+
+
+def test_parse_version_cache_is_bounded():
+    assert parse_version.cache_info().maxsize == PARSE_CACHE_SIZE
+
+
+def test_is_prerelease():
+    assert is_prerelease(parse_version("1.0.0-0.dev.git.1.h123"))
+    assert not is_prerelease(parse_version("1.0.0"))
+
+
+@pytest.mark.parametrize(
+    "version_range, matching, not_matching",
+    [
+        (">=1.2.0 <2.0.0", ["1.2.0", "1.9.9"], ["1.1.9", "2.0.0"]),
+        (">= 1.2.0, < 2.0.0", ["1.2.0", "1.9.9"], ["1.1.9", "2.0.0"]),
+        ("^1.2", ["1.2.0", "1.9.0"], ["1.1.0", "2.0.0"]),
+        ("^0.2.3", ["0.2.3", "0.2.9"], ["0.2.2", "0.3.0"]),
+        ("~1.2.3", ["1.2.3", "1.2.9"], ["1.2.2", "1.3.0"]),
+        ("1.x", ["1.0.0", "1.9.9"], ["0.9.0", "2.0.0"]),
+        ("1.2.*", ["1.2.0", "1.2.9"], ["1.1.0", "1.3.0"]),
+        ("*", ["0.0.1", "9.9.9"], []),
+        ("<1.0.0 || >=2.0.0", ["0.9.0", "2.1.0"], ["1.0.0", "1.5.0"]),
+        ("!=1.0.1", ["1.0.0", "1.0.2"], ["1.0.1"]),
+        (">=1.2.3-rc.2", ["1.2.3-rc.2", "1.2.3-rc.10", "1.2.3"], ["1.2.3-rc.1"]),
+        ("1.2.3-rc.1", ["1.2.3-rc.1"], ["1.2.3-rc.2", "1.2.3"]),
+        ("<1.0.0-0.dev.2", ["1.0.0-0.dev.1"], ["1.0.0-0.dev.2", "1.0.0"]),
+    ],
+)
+def test_parse_range(version_range, matching, not_matching):
+    in_range = parse_range(version_range)
+
+    for version in matching:
+        assert in_range(parse_version(version)), version
+    for version in not_matching:
+        assert not in_range(parse_version(version)), version
+
+
+def test_parse_range_invalid():
+    with pytest.raises(ValueError):
+        parse_range(">=one.two")
+
+
+def test_resolve_latest_backported_patch():
+    # 1.0.5 was released after 2.0.0, but is not the latest version
+    versions = ["1.0.0", "2.0.0", "1.0.5"]
+
+    assert resolve_latest(versions, current="1.0.0") == "2.0.0"
+
+
+def test_resolve_latest_prereleases():
+    versions = ["1.0.0", "1.1.0-rc.1", "not-a-version"]
+
+    assert resolve_latest(versions, current="1.0.0") == "1.0.0"
+    assert resolve_latest(versions, current="1.0.0-rc.1") == "1.1.0-rc.1"
+    assert (
+        resolve_latest(versions, current="1.0.0", constraint={"prereleases": True})
+        == "1.1.0-rc.1"
+    )
+    assert (
+        resolve_latest(
+            versions, current="1.0.0-rc.1", constraint={"prereleases": False}
+        )
+        == "1.0.0"
+    )
+
+
+def test_resolve_latest_constraints():
+    versions = ["1.0.0", "1.2.0", "1.3.0", "2.0.0"]
+
+    assert resolve_latest(versions, current="1.0.0", constraint={"major": True}) == (
+        "1.3.0"
+    )
+    assert (
+        resolve_latest(versions, current="1.0.0", constraint={"range": "~1.2.0"})
+        == "1.2.0"
+    )
+    assert (
+        resolve_latest(versions, current="1.0.0", constraint={"range": ">=3.0.0"})
+        is None
+    )
+    assert resolve_latest(["not-a-version"]) is None
+
+
+def test_is_newer():
+    assert ChartVersion("some_chart", "1.9.0", "1.10.0").is_newer()
+    assert not ChartVersion("some_chart", "2.0.0", "1.0.5").is_newer()
+    assert not ChartVersion("some_chart", "1.0.0", "1.0.0").is_newer()
+    assert ChartVersion("some_chart", "old_version", "new_version").is_newer()
+
+
+def test_chart_version():
+    version = ChartVersion("some_chart", "1.9.0", source="https://some-chart.com")
+
+    assert version.current_key == (1, 9, 0, (1,))
+    assert version.latest_key is None
+    assert version == {"current": "1.9.0"}
+
+    version["latest"] = "1.10.0"
+    assert version.latest == "1.10.0"
+    assert version.latest_key == parse_version("1.10.0")
+    assert version.is_newer()
+    assert version == {"current": "1.9.0", "latest": "1.10.0"}
+    assert {"current": "1.9.0", "latest": "1.10.0"} == version
+    with pytest.raises(KeyError):
+        version["source"]
+    with pytest.raises(AttributeError):
+        version.other = "value"
+
+    assert ChartVersion("some_chart", "old_version", "new_version").is_newer()
+    # A latest version that was never resolved never replaces the current one
+    assert not ChartVersion("some_chart", "1.9.0").is_newer()
+
+
+def test_chart_versions():
+    versions = ChartVersions(
+        {
+            "chart1": {"current": "1.0.0", "latest": "1.1.0"},
+            "chart2": ChartVersion("chart2", "2.0.0", "2.0.0"),
+            "chart3": {"current": "3.0.0", "latest": "2.0.0"},
+        }
+    )
+
+    assert isinstance(versions["chart1"], ChartVersion)
+    assert versions["chart1"].name == "chart1"
+    assert versions.outdated() == ["chart1"]
+    assert versions.to_dict()["chart2"] == {"current": "2.0.0", "latest": "2.0.0"}
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from ruamel.yaml.events import ScalarEvent
+
+from helm_bot.yaml_parser import YamlParser
+
+test_yaml = """\
+# A comment
+name: "some-chart"
+dependencies:
+  - name: other-chart
+    version: 1.0.0
+"""
+
+
+def test_fast_load_matches_round_trip():
+    fast = YamlParser(fast=True).yaml_string_to_object(test_yaml)
+    round_trip = YamlParser().yaml_string_to_object(test_yaml)
+
+    assert fast == {
+        "name": "some-chart",
+        "dependencies": [{"name": "other-chart", "version": "1.0.0"}],
+    }
+    assert fast == round_trip
+    assert type(fast) is dict
+
+
+def test_fast_mode_is_read_only():
+    with pytest.raises(TypeError):
+        YamlParser(fast=True).object_to_yaml_str({"hello": "world"})
+
+
+def test_round_trip_preserves_formatting():
+    yaml = YamlParser()
+
+    assert yaml.object_to_yaml_str(yaml.yaml_string_to_object(test_yaml)) == test_yaml
+
+
+def test_parse_events():
+    yaml = YamlParser(fast=True)
+
+    scalars = [
+        event.value
+        for event in yaml.parse_events(test_yaml)
+        if isinstance(event, ScalarEvent)
+    ]
+
+    assert scalars == ["name", "some-chart", "dependencies"] + [
+        "name",
+        "other-chart",
+        "version",
+        "1.0.0",
+    ]
+
+    with pytest.raises(TypeError):
+        YamlParser().parse_events(test_yaml)
+
+
+def test_fast_load_concurrently():
+    yaml = YamlParser(fast=True)
+    documents = [f"number: {i}\n" for i in range(50)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(yaml.yaml_string_to_object, documents))
+
+    assert results == [{"number": i} for i in range(50)]